@@ -17,7 +17,7 @@
 include art/build/Android.common_build.mk
 
 ART_CPPLINT := art/tools/cpplint.py
-ART_CPPLINT_FILTER := --filter=-whitespace/line_length,-build/include,-readability/function,-readability/streams,-readability/todo,-runtime/references,-runtime/sizeof,-runtime/threadsafe_fn,-runtime/printf
+ART_CPPLINT_FILTER := --filter=-whitespace/line_length,-build/include,-readability/function,-readability/streams,-readability/todo,-runtime/references,-runtime/sizeof,-runtime/threadsafe_fn,-runtime/printf,-runtime/arena_container,-runtime/hash_container,-runtime/heavy_copy,-runtime/endl
 ART_CPPLINT_SRC := $(shell find art -name "*.h" -o -name "*$(ART_CPP_EXTENSION)" | grep -v art/compiler/llvm/generated/ | grep -v art/runtime/elf\.h)
 
 # "mm cpplint-art" to verify we aren't regressing
@@ -32,25 +32,34 @@ cpplint-art-all:
 
 OUT_CPPLINT := $(TARGET_COMMON_OUT_ROOT)/cpplint
 
-ART_CPPLINT_TARGETS :=
+ART_CPPLINT_JOBS := $(shell getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1)
 
-define declare-art-cpplint-target
-art_cpplint_file := $(1)
-art_cpplint_touch := $$(OUT_CPPLINT)/$$(subst /,__,$$(art_cpplint_file))
+# All the files that changed since the last run are linted by a single
+# cpplint process, rather than starting one per file.  cpplint writes
+# $(ART_CPPLINT_STAMP_DIR)/<file with / replaced by __> for each file that
+# passes, recording its mtime and size, and skips the files which still have
+# those, so after a failure only the files that failed and those changed
+# since are linted.
+# If cpplint itself or this file changed, the stamps are removed and
+# everything is linted again.
+ART_CPPLINT_STAMP_DIR := $(OUT_CPPLINT)/stamps
+ART_CPPLINT_TARGET := $(OUT_CPPLINT)/cpplint-art.stamp
 
-$$(art_cpplint_touch): $$(art_cpplint_file) $(ART_CPPLINT) art/build/Android.cpplint.mk
-	$(hide) $(ART_CPPLINT) $(ART_CPPLINT_FILTER) $$<
-	@mkdir -p $$(dir $$@)
-	$(hide) touch $$@
-
-ART_CPPLINT_TARGETS += $$(art_cpplint_touch)
-endef
-
-$(foreach file, $(ART_CPPLINT_SRC), $(eval $(call declare-art-cpplint-target,$(file))))
-#$(info $(call declare-art-cpplint-target,$(firstword $(ART_CPPLINT_SRC))))
+$(ART_CPPLINT_TARGET): $(ART_CPPLINT_SRC) $(ART_CPPLINT) art/build/Android.cpplint.mk
+	$(if $(filter-out $(ART_CPPLINT_SRC),$?),$(hide) rm -rf $(ART_CPPLINT_STAMP_DIR))
+	$(hide) $(ART_CPPLINT) $(ART_CPPLINT_FILTER) --jobs=$(ART_CPPLINT_JOBS) \
+	  --stamp-dir=$(ART_CPPLINT_STAMP_DIR) $(ART_CPPLINT_SRC)
+	@mkdir -p $(dir $@)
+	$(hide) touch $@
 
 include $(CLEAR_VARS)
 LOCAL_MODULE := cpplint-art-phony
 LOCAL_MODULE_TAGS := optional
-LOCAL_ADDITIONAL_DEPENDENCIES := $(ART_CPPLINT_TARGETS)
+LOCAL_ADDITIONAL_DEPENDENCIES := $(ART_CPPLINT_TARGET)
 include $(BUILD_PHONY_PACKAGE)
+
+# "mm cpplint-art-include-graph" to see which headers cost the build most
+.PHONY: cpplint-art-include-graph
+cpplint-art-include-graph:
+	@mkdir -p $(OUT_CPPLINT)
+	$(ART_CPPLINT) --include-graph=$(OUT_CPPLINT)/include-graph
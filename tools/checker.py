@@ -72,11 +72,18 @@
 #
 
 import argparse
+import hashlib
+import io
+import json
 import os
+import pickle
 import re
 import shutil
 import sys
 import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+from contextlib import contextmanager
 from subprocess import check_call
 
 class CommonEqualityMixin:
@@ -92,6 +99,19 @@ class CommonEqualityMixin:
     return "<%s: %s>" % (type(self).__name__, str(self.__dict__))
 
 
+class CheckFailedException(Exception):
+  """Raised when a check line fails. Besides the error message, it records the
+     offending check line and the window of output lines it was tested against.
+     The window is given by the number of its first line, counting from 1 from
+     the beginning of the output group, and the list of lines in it."""
+
+  def __init__(self, message, checkLine, windowStart, windowLines):
+    super(CheckFailedException, self).__init__(message)
+    self.checkLine = checkLine
+    self.windowStart = windowStart
+    self.windowLines = windowLines
+
+
 class CheckElement(CommonEqualityMixin):
   """Single element of the check line."""
 
@@ -333,13 +353,15 @@ class CheckGroup(CommonEqualityMixin):
   # appearance. Variable state is propagated but the scope of the search remains
   # the same for all checks. Each output line can only be matched once.
   # If all check lines are matched, the resulting variable state is returned
-  # together with the remaining output. The function also returns output lines
-  # which appear before either of the matched lines so they can be tested
-  # against Not checks.
-  def __matchIndependentChecks(self, checkLines, outputLines, varState):
+  # together with the remaining output and the number of output lines consumed.
+  # The function also returns output lines which appear before either of the
+  # matched lines so they can be tested against Not checks. The 'startLineNo'
+  # parameter is the position of the first output line within the group and is
+  # only used to report the searched window on failure.
+  def __matchIndependentChecks(self, checkLines, outputLines, startLineNo, varState):
     # If no checks are provided, skip over the entire output.
     if not checkLines:
-      return outputLines, varState, []
+      return outputLines, [], len(outputLines), varState
 
     # Keep track of which lines have been matched.
     matchedLines = []
@@ -348,23 +370,25 @@ class CheckGroup(CommonEqualityMixin):
     for checkLine in checkLines:
       matchLineNo, varState = self.__findFirstMatch(checkLine, outputLines, matchedLines, varState)
       if varState is None:
-        raise Exception("Could not match line " + str(checkLine))
+        raise CheckFailedException("Could not match line " + str(checkLine),
+                                   checkLine, startLineNo, outputLines)
       matchedLines.append(matchLineNo)
 
     # Return new variable state and the output lines which lie outside the
     # match locations of this independent group.
     preceedingLines = outputLines[:min(matchedLines)-1]
     remainingLines = outputLines[max(matchedLines):]
-    return preceedingLines, remainingLines, varState
+    return preceedingLines, remainingLines, max(matchedLines), varState
 
   # Makes sure that the given check lines do not match any of the given output
   # lines. Variable state does not change.
-  def __matchNotLines(self, checkLines, outputLines, varState):
+  def __matchNotLines(self, checkLines, outputLines, startLineNo, varState):
     for checkLine in checkLines:
       assert checkLine.variant == CheckLine.Variant.Not
       matchLineNo, varState = self.__findFirstMatch(checkLine, outputLines, [], varState)
       if varState is not None:
-        raise Exception("CHECK-NOT line " + str(checkLine) + " matches output")
+        raise CheckFailedException("CHECK-NOT line " + str(checkLine) + " matches output",
+                                   checkLine, startLineNo, outputLines)
 
   # Matches the check lines in this group against an output group. It is
   # responsible for running the checks in the right order and scope, and
@@ -373,18 +397,20 @@ class CheckGroup(CommonEqualityMixin):
     varState = {}
     checkLines = self.lines
     outputLines = outputGroup.body
+    startLineNo = 1
 
     while checkLines:
       # Extract the next sequence of location-independent checks to be matched.
       notChecks, independentChecks, checkLines = self.__nextIndependentChecks(checkLines)
       # Match the independent checks.
-      notOutput, outputLines, newVarState = \
-          self.__matchIndependentChecks(independentChecks, outputLines, varState)
+      notOutput, outputLines, consumedLines, newVarState = \
+          self.__matchIndependentChecks(independentChecks, outputLines, startLineNo, varState)
       # Run the Not checks against the output lines which lie between the last
       # two independent groups or the bounds of the output.
-      self.__matchNotLines(notChecks, notOutput, varState)
-      # Update variable state.
+      self.__matchNotLines(notChecks, notOutput, startLineNo, varState)
+      # Update variable state and the position of the remaining output.
       varState = newVarState
+      startLineNo += consumedLines
 
 class OutputGroup(CommonEqualityMixin):
   """Represents a named part of the test output against which a check group of
@@ -434,78 +460,117 @@ class FileSplitMixin(object):
 class CheckFile(FileSplitMixin):
   """Collection of check groups extracted from the input test file."""
 
+  # Compiled prefix regexes shared by all instances, keyed by the prefix and by
+  # whether the regex classifies the line variant.
+  _prefixRegexCache = {}
+
+  # Maps the suffix captured by the classifier regex to the type of the line.
+  # Lines starting only with 'CHECK' are matched in order, 'CHECK-DAG' lines
+  # are no-order assertions and 'CHECK-NOT' lines are no-order negative
+  # assertions. Lines beginning with 'CHECK-START' start a new check group
+  # instead and are not looked up here.
+  _variantBySuffix = {
+    None: CheckLine.Variant.InOrder,
+    "-DAG": CheckLine.Variant.DAG,
+    "-NOT": CheckLine.Variant.Not
+  }
+
   def __init__(self, prefix, checkStream):
     self.prefix = prefix
     self.groups = self._parseStream(checkStream)
 
-  # Attempts to parse a check line. The regex searches for a comment symbol
-  # followed by the CHECK keyword, given attribute and a colon at the very
-  # beginning of the line. Whitespaces are ignored.
+  # Returns the compiled regex which searches for a comment symbol followed by
+  # the CHECK keyword, given attribute and a colon at the very beginning of the
+  # line. Whitespaces are ignored. If 'classify' is set, the keyword may be
+  # followed by any of the supported variant suffixes which is then captured
+  # in the 'variant' group.
+  @classmethod
+  def _getPrefixRegex(cls, prefix, classify=False):
+    key = (prefix, classify)
+    regex = cls._prefixRegexCache.get(key)
+    if regex is None:
+      ignoreWhitespace = "\s*"
+      commentSymbols = ["//", "#"]
+      prefixRegex = ignoreWhitespace + \
+                    "(" + "|".join(commentSymbols) + ")" + \
+                    ignoreWhitespace + \
+                    prefix
+      if classify:
+        prefixRegex += "(?P<variant>-START|-DAG|-NOT)?"
+      regex = re.compile(prefixRegex + ":")
+      cls._prefixRegexCache[key] = regex
+    return regex
+
+  # Attempts to parse a check line with the given prefix. Returns the content of
+  # the line following the prefix or None if the line does not start with it.
   def _extractLine(self, prefix, line):
-    ignoreWhitespace = "\s*"
-    commentSymbols = ["//", "#"]
-    prefixRegex = ignoreWhitespace + \
-                  "(" + "|".join(commentSymbols) + ")" + \
-                  ignoreWhitespace + \
-                  prefix + ":"
-
     # The 'match' function succeeds only if the pattern is matched at the
     # beginning of the line.
-    match = re.match(prefixRegex, line)
+    match = self._getPrefixRegex(prefix).match(line)
     if match is not None:
       return line[match.end():].strip()
     else:
       return None
 
   def _processLine(self, line, lineNo):
-    # Lines beginning with 'CHECK-START' start a new check group.
-    startLine = self._extractLine(self.prefix + "-START", line)
-    if startLine is not None:
-      return None, startLine
-
-    # Lines starting only with 'CHECK' are matched in order.
-    plainLine = self._extractLine(self.prefix, line)
-    if plainLine is not None:
-      return (plainLine, CheckLine.Variant.InOrder), None
-
-    # 'CHECK-DAG' lines are no-order assertions.
-    dagLine = self._extractLine(self.prefix + "-DAG", line)
-    if dagLine is not None:
-      return (dagLine, CheckLine.Variant.DAG), None
-
-    # 'CHECK-NOT' lines are no-order negative assertions.
-    notLine = self._extractLine(self.prefix + "-NOT", line)
-    if notLine is not None:
-      return (notLine, CheckLine.Variant.Not), None
-
-    # Other lines are ignored.
-    return None, None
+    # Identify the type of the line with a single match of the classifier.
+    match = self._getPrefixRegex(self.prefix, classify=True).match(line)
+    if match is None:
+      # Other lines are ignored.
+      return None, None
+
+    content = line[match.end():].strip()
+    suffix = match.group("variant")
+    if suffix == "-START":
+      return None, content
+    else:
+      return (content, self._variantBySuffix[suffix], lineNo), None
 
   def _exceptionLineOutsideGroup(self, line, lineNo):
     raise Exception("Check file line lies outside a group (line " + str(lineNo) + ")")
 
   def _processGroup(self, name, lines):
-    checkLines = list(map(lambda line: CheckLine(line[0], line[1]), lines))
+    checkLines = list(map(lambda line: CheckLine(line[0], line[1], line[2]), lines))
     return CheckGroup(name, checkLines)
 
-  def match(self, outputFile, printInfo=False):
+  # Matches all check groups against the output. The first failure is raised
+  # immediately unless a 'report' is provided, in which case the result of
+  # every group is recorded and the first failure is raised once all groups
+  # have been matched.
+  def match(self, outputFile, printInfo=False, report=None):
+    firstFailure = None
     for checkGroup in self.groups:
-      # TODO: Currently does not handle multiple occurrences of the same group
-      # name, e.g. when a pass is run multiple times. It will always try to
-      # match a check group against the first output group of the same name.
-      outputGroup = outputFile.findGroup(checkGroup.name)
-      if outputGroup is None:
-        raise Exception("Group " + checkGroup.name + " not found in the output")
-      if printInfo:
-        print("TEST " + checkGroup.name + "... ", end="", flush=True)
+      startTime = time.monotonic()
       try:
-        checkGroup.match(outputGroup)
-        if printInfo:
-          print("PASSED")
+        self.__matchGroup(checkGroup, outputFile, printInfo)
+        if report is not None:
+          report.addGroup(checkGroup.name, time.monotonic() - startTime)
       except Exception as e:
-        if printInfo:
-          print("FAILED!")
-        raise e
+        if report is None:
+          raise e
+        report.addGroup(checkGroup.name, time.monotonic() - startTime, e)
+        if firstFailure is None:
+          firstFailure = e
+    if firstFailure is not None:
+      raise firstFailure
+
+  def __matchGroup(self, checkGroup, outputFile, printInfo):
+    # TODO: Currently does not handle multiple occurrences of the same group
+    # name, e.g. when a pass is run multiple times. It will always try to
+    # match a check group against the first output group of the same name.
+    outputGroup = outputFile.findGroup(checkGroup.name)
+    if outputGroup is None:
+      raise Exception("Group " + checkGroup.name + " not found in the output")
+    if printInfo:
+      print("TEST " + checkGroup.name + "... ", end="", flush=True)
+    try:
+      checkGroup.match(outputGroup)
+      if printInfo:
+        print("PASSED")
+    except Exception as e:
+      if printInfo:
+        print("FAILED!")
+      raise e
 
 
 class OutputFile(FileSplitMixin):
@@ -580,6 +645,112 @@ class OutputFile(FileSplitMixin):
     return None
 
 
+class TestReport(object):
+  """Machine-readable record of a checker run. Holds the status and match time
+     of every check group together with the time spent in each phase of the
+     run, and serializes them as JSON or JUnit XML."""
+
+  class GroupResult(object):
+    """Outcome of matching a single check group."""
+
+    def __init__(self, name, seconds, failure):
+      self.name = name
+      self.seconds = seconds
+      self.failure = failure
+
+    def passed(self):
+      return self.failure is None
+
+    # Returns the details of the failure as a dictionary. Information about the
+    # check line and the searched output is only available for failures raised
+    # as CheckFailedException.
+    def failureInfo(self):
+      info = { "message": str(self.failure) }
+      if isinstance(self.failure, CheckFailedException):
+        checkLine = self.failure.checkLine
+        windowLines = self.failure.windowLines
+        info["checkLine"] = checkLine.content
+        info["checkLineNo"] = checkLine.lineNo
+        info["outputWindow"] = {
+          "start": self.failure.windowStart,
+          "end": self.failure.windowStart + len(windowLines) - 1,
+          "lines": windowLines
+        }
+      return info
+
+  def __init__(self, testName):
+    self.testName = testName
+    self.phases = []
+    self.groups = []
+
+  # Measures the wall time of the enclosed block and records it under the name
+  # of the phase, e.g. "compile", "parse" or "match".
+  @contextmanager
+  def phase(self, name):
+    startTime = time.monotonic()
+    try:
+      yield
+    finally:
+      self.phases.append((name, time.monotonic() - startTime))
+
+  def addGroup(self, name, seconds, failure=None):
+    self.groups.append(TestReport.GroupResult(name, seconds, failure))
+
+  def failureCount(self):
+    return len([group for group in self.groups if not group.passed()])
+
+  def totalSeconds(self):
+    return sum(seconds for _, seconds in self.phases)
+
+  def toJson(self):
+    groups = []
+    for group in self.groups:
+      entry = { "name": group.name,
+                "status": "passed" if group.passed() else "failed",
+                "time": group.seconds }
+      if not group.passed():
+        entry["failure"] = group.failureInfo()
+      groups.append(entry)
+    return json.dumps({ "test": self.testName,
+                        "time": self.totalSeconds(),
+                        "phases": dict(self.phases),
+                        "groups": groups }, indent=2, sort_keys=True)
+
+  def toJUnitXml(self):
+    suite = ElementTree.Element("testsuite", {
+      "name": self.testName,
+      "tests": str(len(self.groups)),
+      "failures": str(self.failureCount()),
+      "errors": "0",
+      "time": "%.6f" % self.totalSeconds() })
+    properties = ElementTree.SubElement(suite, "properties")
+    for name, seconds in self.phases:
+      ElementTree.SubElement(properties, "property",
+                             { "name": "time." + name, "value": "%.6f" % seconds })
+    for group in self.groups:
+      case = ElementTree.SubElement(suite, "testcase", {
+        "classname": self.testName,
+        "name": group.name,
+        "time": "%.6f" % group.seconds })
+      if not group.passed():
+        info = group.failureInfo()
+        failure = ElementTree.SubElement(case, "failure", { "message": info["message"] })
+        if "checkLine" in info:
+          window = info["outputWindow"]
+          failure.text = "check line %d: %s\noutput lines %d-%d:\n%s" % (
+              info["checkLineNo"], info["checkLine"],
+              window["start"], window["end"], "\n".join(window["lines"]))
+    return ElementTree.tostring(suite, encoding="unicode")
+
+  def write(self, jsonFilename=None, junitFilename=None):
+    if jsonFilename:
+      with open(jsonFilename, "w") as jsonFile:
+        jsonFile.write(self.toJson() + "\n")
+    if junitFilename:
+      with open(junitFilename, "w") as junitFile:
+        junitFile.write(self.toJUnitXml() + "\n")
+
+
 def ParseArguments():
   parser = argparse.ArgumentParser()
   parser.add_argument("test_file", help="the source of the test with checking annotations")
@@ -589,6 +760,12 @@ def ParseArguments():
                       help="print a list of all groups found in the test output")
   parser.add_argument("--dump-group", dest="dump_group", metavar="GROUP",
                       help="print the contents of an output group")
+  parser.add_argument("--cache-dir", dest="cache_dir", metavar="DIR",
+                      help="cache parsed check files in the given folder")
+  parser.add_argument("--json-report", dest="json_report", metavar="FILE",
+                      help="write per-group results and timings as JSON")
+  parser.add_argument("--junit-report", dest="junit_report", metavar="FILE",
+                      help="write per-group results and timings as JUnit XML")
   return parser.parse_args()
 
 
@@ -643,23 +820,101 @@ def DumpGroup(outputFilename, groupName):
     raise Exception("Check group " + groupName + " not found in the output")
 
 
-def RunChecks(checkPrefix, checkFilename, outputFilename):
-  checkFile = CheckFile(checkPrefix, open(checkFilename, "r"))
-  outputFile = OutputFile(open(outputFilename, "r"))
-  checkFile.match(outputFile, True)
+# Returns the hash of the source of this module. It is part of the key of the
+# parse cache, so that entries pickled by another version of the parser are
+# never reused.
+def ParserDigest():
+  with open(os.path.abspath(__file__), "rb") as sourceStream:
+    return hashlib.sha1(sourceStream.read()).digest()
+
+
+# Parses the check lines of the given test file. If 'cacheDir' is provided,
+# the parsed groups are stored in that folder keyed by the hash of the file
+# content, the prefix and the parser so that subsequent runs on an unchanged
+# test file do not need to parse it again.
+def ParseCheckFile(checkPrefix, checkFilename, cacheDir=None):
+  if cacheDir is None:
+    with open(checkFilename, "r") as checkStream:
+      return CheckFile(checkPrefix, checkStream)
+
+  with open(checkFilename, "rb") as checkStream:
+    content = checkStream.read()
+  key = hashlib.sha1()
+  key.update(ParserDigest())
+  key.update(b"\0" + checkPrefix.encode("utf-8") + b"\0")
+  key.update(content)
+  cacheFile = os.path.join(cacheDir, key.hexdigest() + ".pickle")
+
+  try:
+    with open(cacheFile, "rb") as cacheStream:
+      checkFile = pickle.load(cacheStream)
+    if isinstance(checkFile, CheckFile):
+      return checkFile
+  except (IOError, OSError, EOFError, pickle.UnpicklingError):
+    pass
+
+  checkFile = CheckFile(checkPrefix, io.StringIO(content.decode("utf-8")))
+
+  # Write the cache entry to a temporary file first and rename it so that
+  # concurrent runs never observe a partially written entry. The cache only
+  # saves time, so a folder that cannot be written to is not an error.
+  tempCacheFile = None
+  try:
+    os.makedirs(cacheDir, exist_ok=True)
+    fd, tempCacheFile = tempfile.mkstemp(dir=cacheDir)
+    with os.fdopen(fd, "wb") as cacheStream:
+      pickle.dump(checkFile, cacheStream, pickle.HIGHEST_PROTOCOL)
+    os.replace(tempCacheFile, cacheFile)
+    tempCacheFile = None
+  except OSError:
+    pass
+  finally:
+    if tempCacheFile is not None:
+      try:
+        os.remove(tempCacheFile)
+      except OSError:
+        pass
+  return checkFile
+
+
+# Times the enclosed block as a phase of 'report', if a report is being made.
+@contextmanager
+def ReportPhase(report, name):
+  if report is None:
+    yield
+  else:
+    with report.phase(name):
+      yield
+
+
+# Matches the checks of the test file against the output. Without a 'report'
+# the first failing group stops the run; with one, every group is matched and
+# recorded in it.
+def RunChecks(checkPrefix, checkFilename, outputFilename, cacheDir=None, report=None):
+  with ReportPhase(report, "parse"):
+    checkFile = ParseCheckFile(checkPrefix, checkFilename, cacheDir)
+    outputFile = OutputFile(open(outputFilename, "r"))
+  with ReportPhase(report, "match"):
+    checkFile.match(outputFile, True, report)
 
 
 if __name__ == "__main__":
   args = ParseArguments()
   tempFolder = tempfile.mkdtemp()
+  report = None
+  if args.json_report or args.junit_report:
+    report = TestReport(args.test_file)
 
   try:
-    outputFile = CompileTest(args.test_file, tempFolder)
+    with ReportPhase(report, "compile"):
+      outputFile = CompileTest(args.test_file, tempFolder)
     if args.list_groups:
       ListGroups(outputFile)
     elif args.dump_group:
       DumpGroup(outputFile, args.dump_group)
     else:
-      RunChecks(args.check_prefix, args.test_file, outputFile)
+      RunChecks(args.check_prefix, args.test_file, outputFile, args.cache_dir, report)
   finally:
+    if report is not None:
+      report.write(args.json_report, args.junit_report)
     shutil.rmtree(tempFolder)
@@ -18,8 +18,14 @@
 # specific markup language implemented by Checker.
 
 import checker
+import contextlib
 import io
+import json
+import os
+import shutil
+import tempfile
 import unittest
+import xml.etree.ElementTree as ElementTree
 
 
 class TestCheckFile_PrefixExtraction(unittest.TestCase):
@@ -240,7 +246,7 @@ def prepareSingleCheck(line):
   if isinstance(line, str):
     return checker.CheckLine(line)
   else:
-    return checker.CheckLine(line[0], line[1])
+    return checker.CheckLine(*line)
 
 def prepareChecks(lines):
   if isinstance(lines, str):
@@ -423,7 +429,9 @@ class TestCheckFile_Parse(unittest.TestCase):
     self.__parsesTo("""// CHECK-START: Example Group
                        // CHECK:  foo
                        // CHECK:    bar""",
-                    [ checker.CheckGroup("Example Group", prepareChecks([ "foo", "bar" ])) ])
+                    [ checker.CheckGroup("Example Group",
+                                         prepareChecks([ ("foo", CheckVariant.InOrder, 2),
+                                                         ("bar", CheckVariant.InOrder, 3) ])) ])
 
   def test_MultipleGroups(self):
     self.__parsesTo("""// CHECK-START: Example Group1
@@ -432,8 +440,12 @@ class TestCheckFile_Parse(unittest.TestCase):
                        // CHECK-START: Example Group2
                        // CHECK: abc
                        // CHECK: def""",
-                    [ checker.CheckGroup("Example Group1", prepareChecks([ "foo", "bar" ])),
-                      checker.CheckGroup("Example Group2", prepareChecks([ "abc", "def" ])) ])
+                    [ checker.CheckGroup("Example Group1",
+                                         prepareChecks([ ("foo", CheckVariant.InOrder, 2),
+                                                         ("bar", CheckVariant.InOrder, 3) ])),
+                      checker.CheckGroup("Example Group2",
+                                         prepareChecks([ ("abc", CheckVariant.InOrder, 5),
+                                                         ("def", CheckVariant.InOrder, 6) ])) ])
 
   def test_CheckVariants(self):
     self.__parsesTo("""// CHECK-START: Example Group
@@ -442,10 +454,211 @@ class TestCheckFile_Parse(unittest.TestCase):
                        // CHECK-DAG: abc
                        // CHECK-DAG: def""",
                     [ checker.CheckGroup("Example Group",
-                                         prepareChecks([ ("foo", CheckVariant.InOrder),
-                                                         ("bar", CheckVariant.Not),
-                                                         ("abc", CheckVariant.DAG),
-                                                         ("def", CheckVariant.DAG) ])) ])
+                                         prepareChecks([ ("foo", CheckVariant.InOrder, 2),
+                                                         ("bar", CheckVariant.Not, 3),
+                                                         ("abc", CheckVariant.DAG, 4),
+                                                         ("def", CheckVariant.DAG, 5) ])) ])
+
+  def test_UnknownVariant(self):
+    self.__parsesTo("""// CHECK-START: Example Group
+                       // CHECK:     foo
+                       // CHECK-FOO: bar
+                       // CHECKS:    abc""",
+                    [ checker.CheckGroup("Example Group",
+                                         prepareChecks([ ("foo", CheckVariant.InOrder, 2) ])) ])
+
+class TestCheckFile_Report(unittest.TestCase):
+  def __match(self, checkString, outputString):
+    checkFile = checker.CheckFile("CHECK", io.StringIO(checkString))
+    outputFile = checker.OutputFile(io.StringIO(outputString))
+    report = checker.TestReport("MyTest")
+    try:
+      checkFile.match(outputFile, False, report)
+    except Exception:
+      pass
+    return report
+
+  def test_GroupStatus(self):
+    report = self.__match("""// CHECK-START: MyMethod pass1
+                             // CHECK: foo
+                             // CHECK-START: MyMethod pass2
+                             // CHECK: bar
+                             // CHECK-START: MyMethod pass3
+                             // CHECK: foo""",
+                          """begin_compilation
+                               method "MyMethod"
+                             end_compilation
+                             begin_cfg
+                               name "pass1"
+                               foo
+                             end_cfg
+                             begin_cfg
+                               name "pass2"
+                               foo
+                             end_cfg""")
+    self.assertEqual([ group.name for group in report.groups ],
+                     [ "MyMethod pass1", "MyMethod pass2", "MyMethod pass3" ])
+    self.assertEqual([ group.passed() for group in report.groups ], [ True, False, False ])
+    self.assertEqual(report.failureCount(), 2)
+
+  def test_FailureWindow(self):
+    report = self.__match("""// CHECK-START: MyMethod pass1
+                             // CHECK:     foo
+                             // CHECK-NOT: abc
+                             // CHECK:     bar""",
+                          """begin_compilation
+                               method "MyMethod"
+                             end_compilation
+                             begin_cfg
+                               name "pass1"
+                               xyz
+                               foo
+                               abc
+                               def
+                               bar
+                             end_cfg""")
+    info = report.groups[0].failureInfo()
+    self.assertEqual(info["checkLine"], "abc")
+    self.assertEqual(info["checkLineNo"], 3)
+    self.assertEqual(info["outputWindow"], { "start": 3, "end": 4, "lines": [ "abc", "def" ] })
+
+  def test_Serialization(self):
+    report = self.__match("""// CHECK-START: MyMethod pass1
+                             // CHECK: bar""",
+                          """begin_compilation
+                               method "MyMethod"
+                             end_compilation
+                             begin_cfg
+                               name "pass1"
+                               foo
+                             end_cfg""")
+    with report.phase("match"):
+      pass
+    self.assertEqual(json.loads(report.toJson())["groups"][0]["failure"]["checkLineNo"], 2)
+    suite = ElementTree.fromstring(report.toJUnitXml())
+    self.assertEqual(suite.get("tests"), "1")
+    self.assertEqual(suite.get("failures"), "1")
+    self.assertIsNotNone(suite.find("testcase/failure"))
+    self.assertIsNotNone(suite.find("properties/property[@name='time.match']"))
+
+  def test_RunChecksStopsAtFirstFailureWithoutReport(self):
+    tempFolder = tempfile.mkdtemp()
+    try:
+      checkFilename = os.path.join(tempFolder, "Main.java")
+      outputFilename = os.path.join(tempFolder, "art.cfg")
+      with open(checkFilename, "w") as checkStream:
+        checkStream.write("""// CHECK-START: MyMethod pass1
+                             // CHECK: bar
+                             // CHECK-START: MyMethod pass2
+                             // CHECK: foo""")
+      with open(outputFilename, "w") as outputStream:
+        outputStream.write("""begin_compilation
+                                method "MyMethod"
+                              end_compilation
+                              begin_cfg
+                                name "pass1"
+                                foo
+                              end_cfg
+                              begin_cfg
+                                name "pass2"
+                                foo
+                              end_cfg""")
+      output = io.StringIO()
+      with contextlib.redirect_stdout(output):
+        with self.assertRaises(checker.CheckFailedException):
+          checker.RunChecks("CHECK", checkFilename, outputFilename)
+      self.assertEqual(output.getvalue(), "TEST MyMethod pass1... FAILED!\n")
+
+      report = checker.TestReport("MyTest")
+      with contextlib.redirect_stdout(io.StringIO()):
+        with self.assertRaises(checker.CheckFailedException):
+          checker.RunChecks("CHECK", checkFilename, outputFilename, report=report)
+      self.assertEqual([ group.passed() for group in report.groups ], [ False, True ])
+      self.assertEqual([ name for name, _ in report.phases ], [ "parse", "match" ])
+    finally:
+      shutil.rmtree(tempFolder)
+
+class TestCheckFile_Cache(unittest.TestCase):
+  def setUp(self):
+    self.tempFolder = tempfile.mkdtemp()
+    self.cacheDir = os.path.join(self.tempFolder, "cache")
+    self.checkFilename = os.path.join(self.tempFolder, "Main.java")
+
+  def tearDown(self):
+    shutil.rmtree(self.tempFolder)
+
+  def __writeCheckFile(self, string):
+    with open(self.checkFilename, "w") as checkFile:
+      checkFile.write(string)
+
+  def __parse(self, prefix="CHECK"):
+    return checker.ParseCheckFile(prefix, self.checkFilename, self.cacheDir).groups
+
+  def test_CachedGroupsEqual(self):
+    self.__writeCheckFile("""// CHECK-START: Example Group
+                             // CHECK:     foo
+                             // CHECK-DAG: [[X:abc]]""")
+    expected = [ checker.CheckGroup("Example Group",
+                                    prepareChecks([ ("foo", CheckVariant.InOrder, 2),
+                                                    ("[[X:abc]]", CheckVariant.DAG, 3) ])) ]
+    self.assertEqual(self.__parse(), expected)
+    self.assertEqual(len(os.listdir(self.cacheDir)), 1)
+    self.assertEqual(self.__parse(), expected)
+    self.assertEqual(len(os.listdir(self.cacheDir)), 1)
+
+  def test_KeyedByContentAndPrefix(self):
+    self.__writeCheckFile("""// CHECK-START: Group1
+                             // CHECK: foo
+                             // XYZ-START: Group2
+                             // XYZ: bar""")
+    self.assertEqual(self.__parse()[0].name, "Group1")
+    self.assertEqual(self.__parse("XYZ")[0].name, "Group2")
+    self.__writeCheckFile("""// CHECK-START: Group3
+                             // CHECK: foo""")
+    self.assertEqual(self.__parse()[0].name, "Group3")
+    self.assertEqual(len(os.listdir(self.cacheDir)), 3)
+
+  def test_KeyedByParser(self):
+    self.__writeCheckFile("""// CHECK-START: Group1
+                             // CHECK: foo""")
+    self.__parse()
+    parserDigest = checker.ParserDigest
+    checker.ParserDigest = lambda: b"another parser"
+    try:
+      self.__parse()
+    finally:
+      checker.ParserDigest = parserDigest
+    self.assertEqual(len(os.listdir(self.cacheDir)), 2)
+
+  def test_NoTemporaryFileLeftOnError(self):
+    self.__writeCheckFile("""// CHECK-START: Group1
+                             // CHECK: foo""")
+    dump = checker.pickle.dump
+    def failingDump(obj, stream, protocol):
+      raise checker.pickle.PicklingError("cannot pickle")
+    checker.pickle.dump = failingDump
+    try:
+      with self.assertRaises(checker.pickle.PicklingError):
+        self.__parse()
+    finally:
+      checker.pickle.dump = dump
+    self.assertEqual(os.listdir(self.cacheDir), [])
+
+  def test_UnwritableCacheIgnored(self):
+    self.__writeCheckFile("""// CHECK-START: Group1
+                             // CHECK: foo""")
+    replace = checker.os.replace
+    def failingReplace(src, dst):
+      raise OSError("cannot rename")
+    checker.os.replace = failingReplace
+    try:
+      self.assertEqual(self.__parse()[0].name, "Group1")
+    finally:
+      checker.os.replace = replace
+    self.assertEqual(os.listdir(self.cacheDir), [])
+    os.rmdir(self.cacheDir)
+    open(self.cacheDir, "w").close()
+    self.assertEqual(self.__parse()[0].name, "Group1")
 
 if __name__ == '__main__':
   unittest.main()
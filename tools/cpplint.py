@@ -75,22 +75,59 @@ We do a small hack, which is to ignore //'s with "'s after them on the
 same line, but it is far from perfect (in either direction).
 """
 
+import bisect
 import codecs
 import copy
 import getopt
+import hashlib
+import itertools
+import json
+import marshal
 import math  # for log
 import os
 import re
-import sre_compile
 import string
+import subprocess
 import sys
+import tempfile
+import time
+import types
 import unicodedata
 
+try:
+  import cPickle as pickle  # Python 2
+except ImportError:
+  import pickle
+
+if sys.version_info < (3,):
+  import _sre
+  import sre_compile
+  import sre_parse
+  iteritems = dict.iteritems
+  itervalues = dict.itervalues
+  # Compiles a regexp without going through the small cache of the re module.
+  _RegexpCompile = sre_compile.compile
+else:
+  # sre_compile is deprecated and the code regexps compile to differs between
+  # versions of Python 3, so these never get a _RegexpBundle.
+  _sre = sre_compile = sre_parse = None
+  iteritems = dict.items
+  itervalues = dict.values
+  unicode = str
+  xrange = range
+  _RegexpCompile = re.compile
+
 
 _USAGE = """
-Syntax: cpplint.py [--verbose=#] [--output=vs7] [--filter=-x,+y,...]
-                   [--counting=total|toplevel|detailed]
+Syntax: cpplint.py [--verbose=#] [--output=vs7|eclipse|jsonl|sarif]
+                   [--filter=-x,+y,...]
+                   [--counting=total|toplevel|detailed] [--jobs=#]
+                   [--cache-dir=dir] [--stamp-dir=dir] [--diff=rev]
+                   [--profile=file] [--plugin=module] [--plugin-budget=ms]
+                   [--index=file]
         <file> [file] ...
+        cpplint.py [flags] --server
+        cpplint.py --include-graph=file [file|directory] ...
 
   The style guidelines this tries to follow are those in
     http://google-styleguide.googlecode.com/svn/trunk/cppguide.xml
@@ -103,14 +140,32 @@ Syntax: cpplint.py [--verbose=#] [--output=vs7] [--filter=-x,+y,...]
   'NOLINT(category)' comment to the line.  NOLINT or NOLINT(*)
   suppresses errors of all categories on that line.
 
-  The files passed in will be linted; at least one file must be provided.
+  The files passed in will be linted; at least one file must be provided,
+  unless --diff is given.
   Linted extensions are .cc, .cpp, and .h.  Other file types will be ignored.
 
+  Besides the checks of the style guide, some ART specific checks are run on
+  the directories they are meant for, such as runtime/arena_container for
+  std containers in compiler code that should allocate from an arena, and
+  runtime/heavy_copy for strings and containers copied where a reference
+  would do, and runtime/logging for strings built for VLOG even when verbose
+  logging is off.
+
   Flags:
 
-    output=vs7
+    output=vs7|eclipse|jsonl|sarif
       By default, the output is formatted to ease emacs parsing.  Visual Studio
-      compatible output (vs7) may also be used.  Other formats are unsupported.
+      compatible output (vs7) and Eclipse compatible output (eclipse) may also
+      be used.  Other formats are unsupported.
+
+      For tools, jsonl writes a JSON object per line: one for every error,
+      with its file, line, category, confidence and message, one for every
+      note about a skipped file or slow plugin, one for every file with the
+      seconds taken by the file and by each check run on its lines, and a
+      summary at the end.  sarif writes the same as a single SARIF 2.1.0 log
+      once all files are linted.  The files are reported in the order given,
+      also with --jobs, and "Done processing" lines are left out.  Neither
+      can be used with --server or --profile.
 
     verbose=#
       Specify a number 0-5 to restrict errors to certain verbosity levels.
@@ -152,6 +207,92 @@ Syntax: cpplint.py [--verbose=#] [--output=vs7] [--filter=-x,+y,...]
         No flag => CHROME_BROWSER_UI_BROWSER_H_
         --root=chrome => BROWSER_UI_BROWSER_H_
         --root=chrome/browser => UI_BROWSER_H_
+
+    jobs=#
+      The number of processes used to lint the files.  By default, files
+      are linted one at a time in the current process.  Errors and counts
+      are always reported in the order in which the files were given.
+
+    cache-dir=dir
+      Cache the results of linting each file in the given directory.  A file
+      is not linted again if its contents, the contents of the headers read
+      while linting it, the flags and cpplint itself have not changed since
+      its results were cached; its cached errors are reported instead.
+      The compiled regular expressions of cpplint are kept there as well,
+      which shortens the start up of later runs.
+
+    stamp-dir=dir
+      Write a stamp in the given directory for every file that is linted
+      and passes, and remove the stamp of every other file.  The stamp of
+      a/b/c.cc is dir/a__b__c.cc, and records the mtime and size of the
+      file.  Files whose mtime and size are those of their stamps are not
+      linted again.  This lets a build lint all of its out of date
+      files with a single cpplint process.
+
+    diff=rev
+      Only lint the files that changed since the given git revision, and
+      only report errors on their changed lines.  The checks of a whole file,
+      of its copyright notice, header guard and included headers, only run
+      if one of the lines they look at changed, and then report all of their
+      errors.  Deleting lines counts as changing the lines around them.  If
+      files are given as well, only the changed ones among them are linted.
+
+    profile=file
+      Time every check, and count the hits and misses of the cache of the
+      regular expressions used by the checks.  After the error counts, a
+      table of the checks ranked by their total time is printed, and the
+      same figures are written to the given file as JSON.  The time of a
+      check includes that of the checks it calls.  Files are linted one at a
+      time in the current process, ignoring --jobs and --cache-dir.
+
+    plugin=module
+      Also run the checks of a Python module, found on the Python path or in
+      the current directory, e.g. --plugin=art_checks.  May be repeated.
+      The module lists its checks as (function, categories, triggers)
+      tuples: LINE_CHECKS for functions called as
+      function(filename, clean_lines, linenum, error) on each line holding
+      one of the trigger substrings, and FILE_CHECKS for functions called as
+      function(filename, clean_lines, error) once per file holding one.
+      Checks with no triggers always run; checks whose categories are all
+      filtered out never do.  The time each plugin takes is printed after
+      the error counts.  Results are not cached.
+
+    plugin-budget=ms
+      The time a plugin may take on a file, 100 ms by default.  A plugin
+      taking longer is reported after the file's errors.
+
+    index=file
+      Keep an index of the includes, header guards, namespaces, classes and
+      functions of all the .h, .cc and .cpp files in the checkouts of the
+      linted files in the given file, and check the files against it.  The
+      index is brought up to date at the start of every run, scanning only
+      the files whose contents changed.  With an index, the headers paired
+      with .cc files are not read again for build/include_what_you_use,
+      headers sharing a header guard are reported, and so are functions
+      declared in a header but not defined in any indexed file, as
+      build/undefined_function.  Cannot be used with --server.
+
+    server
+      Instead of linting files given on the command line, lint the files
+      that an editor sends, until standard input is closed.  Each line of
+      input is a JSON request {"file": name, "contents": text}, answered by
+      a line {"file": name, "output": text, "error_count": count} holding
+      what cpplint would print for the file.  Files are relinted from where
+      they were edited, reusing the results for the rest of the file; add
+      "full": true to a request to lint the file from scratch instead, or
+      send {"file": name, "close": true} to forget it.
+
+    include-graph=file
+      Instead of linting, report what the headers of the ART tree cost the
+      build.  Starting from the given files and directories, or from
+      runtime/, compiler/ and dex2oat/ if none are given, follows the quoted
+      includes, resolved the way ART's makefiles set up the include path.
+      Writes file.json with the lines, bytes and includes of every file and
+      the files, lines and bytes of its transitive closure, and for each
+      header the number of translation units reaching it and the bytes they
+      would no longer preprocess if it included nothing, and file.dot with
+      the graph for Graphviz.  The headers whose slimming would save the
+      most bytes are printed.
 """
 
 # We categorize each error message we print.  Here are the categories.
@@ -173,6 +314,7 @@ _ERROR_CATEGORIES = [
   'build/namespaces',
   'build/printf_format',
   'build/storage_class',
+  'build/undefined_function',
   'legal/copyright',
   'readability/alt_tokens',
   'readability/braces',
@@ -188,12 +330,17 @@ _ERROR_CATEGORIES = [
   'readability/streams',
   'readability/todo',
   'readability/utf8',
+  'runtime/arena_container',
   'runtime/arrays',
   'runtime/casting',
+  'runtime/endl',
   'runtime/explicit',
+  'runtime/hash_container',
+  'runtime/heavy_copy',
   'runtime/int',
   'runtime/init',
   'runtime/invalid_increment',
+  'runtime/logging',
   'runtime/member_string_references',
   'runtime/memset',
   'runtime/operator',
@@ -295,6 +442,63 @@ for op, inv_replacement in [('==', 'NE'), ('!=', 'EQ'),
   _CHECK_REPLACEMENT['EXPECT_FALSE_M'][op] = 'EXPECT_%s_M' % inv_replacement
   _CHECK_REPLACEMENT['ASSERT_FALSE_M'][op] = 'ASSERT_%s_M' % inv_replacement
 
+# The compiled regular expressions of cpplint, by pattern, or by (pattern,
+# flags) for patterns with flags.  Every regular expression is compiled through
+# this cache, the first time it is used.
+_regexp_compile_cache = {}
+
+# The _RegexpBundle that regular expressions are compiled from, if any.
+_regexp_bundle = None
+
+
+def _CompileRegexp(pattern, flags=0, bundled=True):
+  """Returns the compiled regexp for the pattern, compiling it if needed.
+
+  Args:
+    pattern: The regular expression.
+    flags: The flags of the regular expression.
+    bundled: Whether the regexp may be kept in the _RegexpBundle.  Patterns
+      built from the names in the linted files must not be, as there is no
+      end to them.
+
+  Returns:
+    The compiled regexp.
+  """
+  key = (pattern, flags) if flags else pattern
+  compiled = _regexp_compile_cache.get(key)
+  if compiled is None:
+    if _regexp_bundle and bundled:
+      compiled = _regexp_bundle.Compile(pattern, flags)
+    else:
+      compiled = _RegexpCompile(pattern, flags)
+    _regexp_compile_cache[key] = compiled
+  return compiled
+
+
+class _Regexp(object):
+  """A module level regular expression, compiled when it is first used.
+
+  Module level patterns are declared with _Regexp instead of re.compile, so
+  that importing cpplint compiles none of them and a run only compiles those
+  its checks use.  The first use copies the methods of the compiled regexp to
+  the instance, so later uses cost the same as using the compiled regexp.
+  """
+
+  _METHODS = ('match', 'search', 'sub', 'subn', 'split', 'findall', 'finditer')
+
+  def __init__(self, pattern, flags=0):
+    self.pattern = pattern
+    self.flags = flags
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    compiled = _CompileRegexp(self.pattern, self.flags)
+    for method in self._METHODS:
+      setattr(self, method, getattr(compiled, method))
+    return getattr(compiled, name)
+
+
 # Alternative tokens and their replacements.  For full list, see section 2.5
 # Alternative tokens [lex.digraph] in the C++ standard.
 #
@@ -320,7 +524,7 @@ _ALT_TOKEN_REPLACEMENT = {
 # False positives include C-style multi-line comments (http://go/nsiut )
 # and multi-line strings (http://go/beujw ), but those have always been
 # troublesome for cpplint.
-_ALT_TOKEN_REPLACEMENT_PATTERN = re.compile(
+_ALT_TOKEN_REPLACEMENT_PATTERN = _Regexp(
     r'[ =()](' + ('|'.join(_ALT_TOKEN_REPLACEMENT.keys())) + r')(?=[ (]|$)')
 
 
@@ -339,29 +543,23 @@ _END_ASM = 2      # Last line of inline assembly block
 _BLOCK_ASM = 3    # The whole block is an inline assembly block
 
 # Match start of assembly blocks
-_MATCH_ASM = re.compile(r'^\s*(?:asm|_asm|__asm|__asm__)'
-                        r'(?:\s+(volatile|__volatile__))?'
-                        r'\s*[{(]')
+_MATCH_ASM = _Regexp(r'^\s*(?:asm|_asm|__asm|__asm__)'
+                     r'(?:\s+(volatile|__volatile__))?'
+                     r'\s*[{(]')
 
 
-_regexp_compile_cache = {}
-
 # Finds occurrences of NOLINT or NOLINT(...).
-_RE_SUPPRESSION = re.compile(r'\bNOLINT\b(\([^)]*\))?')
-
-# {str, set(int)}: a map from error categories to sets of linenumbers
-# on which those errors are expected and should be suppressed.
-_error_suppressions = {}
+_RE_SUPPRESSION = _Regexp(r'\bNOLINT\b(\([^)]*\))?')
 
 # The root directory used for deriving header guard CPP variable.
 # This is set by --root flag.
 _root = None
 
 def ParseNolintSuppressions(filename, raw_line, linenum, error):
-  """Updates the global list of error-suppressions.
+  """Updates the list of error-suppressions of the current file.
 
-  Parses any NOLINT comments on the current line, updating the global
-  error_suppressions store.  Reports an error if the NOLINT comment
+  Parses any NOLINT comments on the current line, updating the
+  error_suppressions store of the current _FileLintState.  Reports an error if the NOLINT comment
   was malformed.
 
   Args:
@@ -375,12 +573,13 @@ def ParseNolintSuppressions(filename, raw_line, linenum, error):
   if matched:
     category = matched.group(1)
     if category in (None, '(*)'):  # => "suppress all"
-      _error_suppressions.setdefault(None, set()).add(linenum)
+      _file_lint_state.error_suppressions.setdefault(None, set()).add(linenum)
     else:
       if category.startswith('(') and category.endswith(')'):
         category = category[1:-1]
         if category in _ERROR_CATEGORIES:
-          _error_suppressions.setdefault(category, set()).add(linenum)
+          _file_lint_state.error_suppressions.setdefault(category,
+                                                         set()).add(linenum)
         else:
           error(filename, linenum, 'readability/nolint', 5,
                 'Unknown NOLINT error category: %s' % category)
@@ -388,13 +587,13 @@ def ParseNolintSuppressions(filename, raw_line, linenum, error):
 
 def ResetNolintSuppressions():
   "Resets the set of NOLINT suppressions to empty."
-  _error_suppressions.clear()
+  _file_lint_state.error_suppressions.clear()
 
 
 def IsErrorSuppressedByNolint(category, linenum):
   """Returns true if the specified error category is suppressed on this line.
 
-  Consults the global error_suppressions map populated by
+  Consults the error_suppressions map of the current file populated by
   ParseNolintSuppressions/ResetNolintSuppressions.
 
   Args:
@@ -403,8 +602,9 @@ def IsErrorSuppressedByNolint(category, linenum):
   Returns:
     bool, True iff the error should be suppressed due to a NOLINT comment.
   """
-  return (linenum in _error_suppressions.get(category, set()) or
-          linenum in _error_suppressions.get(None, set()))
+  error_suppressions = _file_lint_state.error_suppressions
+  return (linenum in error_suppressions.get(category, set()) or
+          linenum in error_suppressions.get(None, set()))
 
 def Match(pattern, s):
   """Matches the string with the pattern, caching the compiled regexp."""
@@ -412,14 +612,14 @@ def Match(pattern, s):
   # performance reasons; factoring it out into a separate function turns out
   # to be noticeably expensive.
   if not pattern in _regexp_compile_cache:
-    _regexp_compile_cache[pattern] = sre_compile.compile(pattern)
+    _CompileRegexp(pattern)
   return _regexp_compile_cache[pattern].match(s)
 
 
 def Search(pattern, s):
   """Searches the string for the pattern, caching the compiled regexp."""
   if not pattern in _regexp_compile_cache:
-    _regexp_compile_cache[pattern] = sre_compile.compile(pattern)
+    _CompileRegexp(pattern)
   return _regexp_compile_cache[pattern].search(s)
 
 
@@ -556,18 +756,54 @@ class _CppLintState(object):
     self.error_count = 0    # global count of reported errors
     # filters to apply when emitting error messages
     self.filters = _DEFAULT_FILTERS[:]
+    self._filter_verdicts = {}  # memoised results of PassesFilters
     self.counting = 'total'  # In what way are we counting errors?
     self.errors_by_category = {}  # string to int dict storing error counts
+    self.jobs = 1  # number of processes used to lint the files
+    self.cache_dir = None  # directory of the lint result cache, if any
+    self.stamp_dir = None  # directory of the stamps of passing files, if any
+    # the mtime and size of the files to lint with --stamp-dir, by file
+    self.stamp_signatures = {}
+    self.server = False  # whether to lint the files an editor sends
+    # the changed lines of the files changed since --diff's revision, by file
+    self.changed_lines = None
+    self.profile = None  # file to write the --profile figures to, if any
+    self.plugins = []  # the names of the --plugin modules
+    self.plugin_budget = 0.1  # seconds a plugin may take on a file
+    self.plugin_seconds = {}  # the time each plugin took, by name
+    self.index = None  # file holding the --index, if any
+    self.include_graph = None  # where to write the --include-graph report
+
+    # the time each check took, by name, for --output=jsonl and sarif
+    self.check_seconds = {}
+    # the files reported so far for --output=sarif, as (filename, seconds,
+    # check_seconds) tuples, and their diagnostics and notes
+    self.sarif_files = []
+    self.sarif_diagnostics = []
+    self.sarif_notes = []
 
     # output format:
     # "emacs" - format that emacs can parse (default)
     # "vs7" - format that Microsoft Visual Studio 7 can parse
+    # "eclipse" - format that Eclipse can parse
+    # "jsonl" - one JSON object per error, note and file, and a summary
+    # "sarif" - a SARIF 2.1.0 log, written out once all files are linted
     self.output_format = 'emacs'
 
+  def ChangedLines(self, filename):
+    """Returns the set of lines to report errors on, None for all lines."""
+    if self.changed_lines is None:
+      return None
+    return self.changed_lines.get(os.path.normpath(filename), frozenset())
+
   def SetOutputFormat(self, output_format):
     """Sets the output format for errors."""
     self.output_format = output_format
 
+  def StructuredOutput(self):
+    """Returns whether errors are collected as data instead of text."""
+    return self.output_format in _STRUCTURED_OUTPUT_FORMATS
+
   def SetVerboseLevel(self, level):
     """Sets the module's verbosity, and returns the previous setting."""
     last_verbose_level = self.verbose_level
@@ -594,6 +830,7 @@ class _CppLintState(object):
     """
     # Default filters always have less priority than the flag ones.
     self.filters = _DEFAULT_FILTERS[:]
+    self._filter_verdicts = {}
     for filt in filters.split(','):
       clean_filt = filt.strip()
       if clean_filt:
@@ -603,31 +840,953 @@ class _CppLintState(object):
         raise ValueError('Every filter in --filters must start with + or -'
                          ' (%s does not)' % filt)
 
+  def PassesFilters(self, category):
+    """Returns whether the filters let errors of the given category through.
+
+    The verdict is worked out once per category and remembered until the
+    filters change.
+    """
+    verdict = self._filter_verdicts.get(category)
+    if verdict is None:
+      verdict = True
+      for one_filter in self.filters:
+        if one_filter.startswith('-'):
+          if category.startswith(one_filter[1:]):
+            verdict = False
+        elif one_filter.startswith('+'):
+          if category.startswith(one_filter[1:]):
+            verdict = True
+        else:
+          assert False  # should have been checked for in SetFilter.
+      self._filter_verdicts[category] = verdict
+    return verdict
+
+  def AnyCategoryPassesFilters(self, categories):
+    """Returns whether errors of any of the categories pass the filters."""
+    for category in categories:
+      if self.PassesFilters(category):
+        return True
+    return False
+
   def ResetErrorCounts(self):
     """Sets the module's error statistic back to zero."""
     self.error_count = 0
     self.errors_by_category = {}
 
-  def IncrementErrorCount(self, category):
+  def IncrementErrorCount(self, category, count=1):
     """Bumps the module's error statistic."""
-    self.error_count += 1
+    self.error_count += count
     if self.counting in ('toplevel', 'detailed'):
       if self.counting != 'detailed':
         category = category.split('/')[0]
       if category not in self.errors_by_category:
         self.errors_by_category[category] = 0
-      self.errors_by_category[category] += 1
+      self.errors_by_category[category] += count
+
+  def AddFileResults(self, file_state):
+    """Reports the results of linting a single file.
+
+    Writes the output collected for the file and adds its errors to the
+    module's error statistic.  With --output=sarif nothing is written until
+    PrintErrorCounts, as the log is a single JSON document.
+
+    Args:
+      file_state: The _FileLintState of the linted file.
+    """
+    if self.output_format == 'jsonl':
+      self._WriteJsonLines(file_state)
+    elif self.output_format == 'sarif':
+      index = len(self.sarif_files)
+      self.sarif_files.append((file_state.filename, file_state.seconds,
+                               file_state.check_seconds))
+      self.sarif_diagnostics.extend(
+          (index,) + diagnostic[1:] for diagnostic in file_state.diagnostics)
+      self.sarif_notes.extend(
+          (index, note) for note in file_state.Notes())
+    else:
+      sys.stderr.write(file_state.Output())
+    for category, count in iteritems(file_state.errors_by_category):
+      self.IncrementErrorCount(category, count)
+    for name, seconds in iteritems(file_state.plugin_seconds):
+      self.plugin_seconds[name] = self.plugin_seconds.get(name, 0.0) + seconds
+    for name, seconds in iteritems(file_state.check_seconds):
+      self.check_seconds[name] = self.check_seconds.get(name, 0.0) + seconds
+    if self.stamp_dir:
+      signature = None
+      if file_state.linted and file_state.error_count == 0:
+        signature = self.stamp_signatures.get(file_state.filename)
+      _UpdateStamp(self.stamp_dir, file_state.filename, signature)
+
+  def _WriteJsonLines(self, file_state):
+    """Writes the errors, notes and timing of a file for --output=jsonl."""
+    filename = file_state.filename
+    records = []
+    for _, linenum, category, confidence, message in file_state.diagnostics:
+      records.append({'type': 'error', 'file': filename, 'line': linenum,
+                      'category': category, 'confidence': confidence,
+                      'message': message})
+    for note in file_state.Notes():
+      records.append({'type': 'note', 'file': filename, 'message': note})
+    records.append({'type': 'file', 'file': filename,
+                    'errors': file_state.error_count,
+                    'seconds': file_state.seconds,
+                    'checks': file_state.check_seconds,
+                    'plugins': file_state.plugin_seconds})
+    sys.stderr.write(''.join(json.dumps(record, sort_keys=True) + '\n'
+                             for record in records))
+
+  def _SarifLog(self):
+    """Returns the --output=sarif log of the files reported so far."""
+    categories = sorted(set(
+        diagnostic[2] for diagnostic in self.sarif_diagnostics))
+    rule_index = dict((category, i) for i, category in enumerate(categories))
+    results = []
+    for index, linenum, category, confidence, message in (
+        self.sarif_diagnostics):
+      location = {'artifactLocation': {'uri': self.sarif_files[index][0],
+                                       'index': index}}
+      if linenum > 0:
+        # Errors about a whole file are reported on line 0.
+        location['region'] = {'startLine': linenum}
+      results.append({'ruleId': category,
+                      'ruleIndex': rule_index[category],
+                      'level': 'warning',
+                      'message': {'text': message},
+                      'locations': [{'physicalLocation': location}],
+                      'properties': {'confidence': confidence}})
+    notifications = [
+        {'level': 'note', 'message': {'text': note},
+         'locations': [{'physicalLocation': {'artifactLocation': {
+             'uri': self.sarif_files[index][0], 'index': index}}}]}
+        for index, note in self.sarif_notes]
+    artifacts = [
+        {'location': {'uri': filename},
+         'properties': {'seconds': seconds, 'checkSeconds': check_seconds}}
+        for filename, seconds, check_seconds in self.sarif_files]
+    return {
+        '$schema': 'https://json.schemastore.org/sarif-2.1.0.json',
+        'version': '2.1.0',
+        'runs': [{
+            'tool': {'driver': {
+                'name': 'cpplint',
+                'informationUri': 'http://google-styleguide.googlecode.com/'
+                                  'svn/trunk/cppguide.xml',
+                'rules': [{'id': category} for category in categories]}},
+            'invocations': [{
+                'executionSuccessful': True,
+                'toolExecutionNotifications': notifications,
+                'properties': {'checkSeconds': self.check_seconds,
+                               'pluginSeconds': self.plugin_seconds}}],
+            'artifacts': artifacts,
+            'results': results}]}
 
   def PrintErrorCounts(self):
     """Print a summary of errors by category, and the total."""
-    for category, count in self.errors_by_category.iteritems():
+    if self.output_format == 'jsonl':
+      sys.stderr.write(json.dumps(
+          {'type': 'summary', 'errors': self.error_count,
+           'categories': self.errors_by_category,
+           'checks': self.check_seconds,
+           'plugins': dict((name, self.plugin_seconds.get(name, 0.0))
+                           for name in self.plugins)},
+          sort_keys=True) + '\n')
+      return
+    if self.output_format == 'sarif':
+      sys.stderr.write(json.dumps(self._SarifLog(), indent=2,
+                                  separators=(',', ': '), sort_keys=True))
+      sys.stderr.write('\n')
+      return
+    for category, count in sorted(iteritems(self.errors_by_category)):
       sys.stderr.write('Category \'%s\' errors found: %d\n' %
                        (category, count))
     sys.stderr.write('Total errors found: %d\n' % self.error_count)
+    for name in self.plugins:
+      sys.stderr.write('Plugin %s took %.3f s\n' %
+                       (name, self.plugin_seconds.get(name, 0.0)))
+
+_STRUCTURED_OUTPUT_FORMATS = ('jsonl', 'sarif')
 
 _cpplint_state = _CppLintState()
 
 
+def _StampPath(stamp_dir, filename):
+  """Returns the path of the stamp of a file in the --stamp-dir."""
+  return os.path.join(stamp_dir, filename.replace('/', '__'))
+
+
+def _FileSignature(filename):
+  """Returns the mtime and size of a file as a string, None if it is missing.
+
+  Comparing these for equality, rather than comparing the mtimes of a file
+  and its stamp, also catches the edits made within the same tick of a
+  coarse mtime.
+  """
+  try:
+    stat = os.stat(filename)
+  except OSError:
+    return None
+  return '%r %d\n' % (stat.st_mtime, stat.st_size)
+
+
+def _UnstampedFiles(stamp_dir, filenames, signatures):
+  """Leaves out the files that passed since they last changed.
+
+  Args:
+    stamp_dir: The directory holding the stamps.
+    filenames: The names of the files to lint.
+    signatures: The dict to add the _FileSignature of every file to lint to,
+      taken before it is linted, by name.
+
+  Returns:
+    The files of filenames which have no stamp, or a stamp recording another
+    mtime or size than they have now.
+  """
+  unstamped = []
+  for filename in filenames:
+    if filename != '-':
+      signature = _FileSignature(filename)
+      try:
+        with open(_StampPath(stamp_dir, filename)) as stamp:
+          if signature is not None and stamp.read() == signature:
+            continue
+      except IOError:
+        pass
+      signatures[filename] = signature
+    unstamped.append(filename)
+  return unstamped
+
+
+def _UpdateStamp(stamp_dir, filename, signature):
+  """Writes or removes the stamp of a file.
+
+  Args:
+    stamp_dir: The directory holding the stamps.
+    filename: The name of the file.
+    signature: The _FileSignature of the file before it was linted, if it was
+      linted and no errors were reported for it, None otherwise.
+  """
+  stamp = _StampPath(stamp_dir, filename)
+  if signature is not None:
+    if not os.path.isdir(stamp_dir):
+      os.makedirs(stamp_dir)
+    _WriteFileAtomically(stamp, lambda f: f.write(signature), 'w')
+  elif os.path.exists(stamp):
+    os.remove(stamp)
+
+
+class _FileLintState(object):
+  """Maintains the state of linting a single file.
+
+  Holds the NOLINT suppressions found in the file, and collects the output
+  and the errors reported for it instead of writing them out immediately.
+  This keeps files independent of each other, so that they can be linted
+  in separate processes and their results merged in the original order.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    # {str, set(int)}: a map from error categories to sets of linenumbers
+    # on which those errors are expected and should be suppressed.
+    self.error_suppressions = {}
+    self.error_count = 0
+    self.errors_by_category = {}  # string to int dict, detailed categories
+    # Whether the file was linted, rather than skipped or ignored.
+    self.linted = False
+    # Digests of the files other than the linted one which were read while
+    # linting it, keyed by path.  A digest of None means it was not readable.
+    self.dependencies = {}
+    # The time each --plugin took on the file, by name.
+    self.plugin_seconds = {}
+    # With --output=jsonl or sarif, the errors reported for the file as
+    # (filename, linenum, category, confidence, message) tuples, the time
+    # taken by each line check and extra check function, by name, and the
+    # time taken to lint the whole file.
+    self.diagnostics = []
+    self.check_seconds = {}
+    self.seconds = 0.0
+    self._output = []
+
+  def AddDependency(self, path):
+    """Records that the results of the file depend on the contents of path."""
+    self.dependencies[path] = _FileDigest(path)
+
+  def IncrementErrorCount(self, category):
+    """Bumps the file's error statistic."""
+    self.error_count += 1
+    self.errors_by_category[category] = (
+        self.errors_by_category.get(category, 0) + 1)
+
+  def Write(self, message):
+    """Appends a message to the output of the file."""
+    self._output.append(message)
+
+  def Output(self):
+    """Returns everything written for the file so far."""
+    return ''.join(self._output)
+
+  def Notes(self):
+    """Returns the messages written for the file, without the progress line.
+
+    These are the notes about skipped files and slow plugins; with
+    --output=jsonl or sarif the errors are not among them.
+    """
+    return [message.rstrip('\n') for message in self._output
+            if not message.startswith('Done processing ')]
+
+
+class _UnattachedLintState(_FileLintState):
+  """The state of linting when no file is being linted by ProcessFile.
+
+  Callers that run ProcessFileData themselves with Error as the error
+  function get the errors written to stderr as they are found, and counted
+  in the totals of _cpplint_state, as they were before files had a state of
+  their own.
+  """
+
+  def __init__(self):
+    _FileLintState.__init__(self, '')
+
+  def IncrementErrorCount(self, category):
+    _FileLintState.IncrementErrorCount(self, category)
+    _cpplint_state.IncrementErrorCount(category)
+
+  def Write(self, message):
+    sys.stderr.write(message)
+
+# The state of the file being linted.  Replaced by ProcessFile for every file.
+_file_lint_state = _UnattachedLintState()
+
+
+def _FileDigest(path):
+  """Returns the SHA-1 hex digest of the contents of a file.
+
+  Args:
+    path: The path of the file.
+
+  Returns:
+    The digest, or None if the file could not be read.
+  """
+  try:
+    with open(path, 'rb') as f:
+      return hashlib.sha1(f.read()).hexdigest()
+  except (IOError, OSError):
+    return None
+
+
+# The umask of the process, read once: reading it means setting it, which is
+# not safe to do while other threads may be creating files.
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def _WriteFileAtomically(path, write, mode='wb'):
+  """Writes a file through a temporary file, so readers never see part of it.
+
+  The file gets the permissions the umask gives new files, rather than the
+  0600 of temporary files, so that the files in an output directory shared
+  by several users stay readable by all of them.
+
+  Args:
+    path: The path of the file.
+    write: The function to call with the temporary file, open for writing.
+    mode: The mode to open the temporary file with.
+
+  Raises:
+    IOError, OSError: The file could not be written.
+  """
+  fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+  try:
+    with os.fdopen(fd, mode) as f:
+      write(f)
+    os.chmod(temp_path, 0o666 & ~_umask)
+    os.rename(temp_path, path)
+  finally:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+
+
+_cpplint_version = None
+
+def _CpplintVersion():
+  """Returns a string identifying this version of cpplint."""
+  global _cpplint_version
+  if _cpplint_version is None:
+    source = __file__
+    if source.endswith(('.pyc', '.pyo')):
+      source = source[:-1]
+    _cpplint_version = '%s:%d.%d' % ((_FileDigest(source),) +
+                                     tuple(sys.version_info[:2]))
+  return _cpplint_version
+
+
+class _LintResultCache(object):
+  """On-disk cache of the _FileLintState of linted files.
+
+  Entries are keyed by the contents and the location of the linted file,
+  every flag which affects the reported errors, and the version of cpplint.
+  An entry is only used if the files it depends on, such as the header
+  opened by CheckForIncludeWhatYouUse, still have the same contents.
+  """
+
+  def __init__(self, directory):
+    self._directory = directory
+
+  def Key(self, filename, extra_check_functions=()):
+    """Returns the cache key of a file, or None if it cannot be read."""
+    digest = _FileDigest(filename)
+    if digest is None:
+      return None
+    changed_lines = _cpplint_state.ChangedLines(filename)
+    if changed_lines is None:
+      changed_lines = 'all'
+    else:
+      changed_lines = ','.join(str(line) for line in sorted(changed_lines))
+    key = hashlib.sha1()
+    for part in (_CpplintVersion(), filename, os.path.abspath(filename),
+                 digest, ','.join(_cpplint_state.filters),
+                 str(_cpplint_state.verbose_level),
+                 _cpplint_state.output_format, str(_root), changed_lines,
+                 ','.join(f.__name__ for f in extra_check_functions),
+                 _symbol_index and _symbol_index.Fingerprint(filename) or ''):
+      key.update(part.encode('utf8') + b'\0')
+    return key.hexdigest()
+
+  def _Path(self, key):
+    return os.path.join(self._directory, key + '.lint')
+
+  def Load(self, key):
+    """Returns the cached _FileLintState for the key if it is up to date."""
+    try:
+      with open(self._Path(key), 'rb') as f:
+        file_state = pickle.load(f)
+    except Exception:
+      # Missing, truncated or otherwise unusable entries are just misses.
+      return None
+    for path, digest in file_state.dependencies.items():
+      if _FileDigest(path) != digest:
+        return None
+    return file_state
+
+  def Store(self, key, file_state):
+    """Stores the _FileLintState for the key, replacing any old entry."""
+    try:
+      if not os.path.isdir(self._directory):
+        os.makedirs(self._directory)
+      # Concurrent readers never see a partially written entry.
+      _WriteFileAtomically(
+          self._Path(key),
+          lambda f: pickle.dump(file_state, f, pickle.HIGHEST_PROTOCOL))
+    except (IOError, OSError):
+      # Failing to cache only costs time on the next run.
+      pass
+
+
+def _SreCompileArgs(pattern, flags):
+  """Compiles a pattern into the arguments sre_compile passes to _sre.
+
+  Args:
+    pattern: The regular expression.
+    flags: The flags of the regular expression.
+
+  Returns:
+    A tuple of the arguments to pass to _sre.compile after the pattern, in
+    the form that sre_compile.compile of this version of Python uses.
+  """
+  parsed = sre_parse.parse(pattern, flags)
+  code = sre_compile._code(parsed, flags)
+  groupindex = parsed.pattern.groupdict
+  indexgroup = [None] * parsed.pattern.groups
+  for name, index in groupindex.items():
+    indexgroup[index] = name
+  return (flags | parsed.pattern.flags, code, parsed.pattern.groups - 1,
+          groupindex, indexgroup)
+
+
+class _RegexpBundle(object):
+  """The compiled regular expressions kept in the --cache-dir.
+
+  Compiling the regular expressions of the checks takes a good part of the
+  time taken to lint a single file.  The bundle keeps the code each of them
+  compiles to, so that later runs only have to hand it to the regexp engine.
+  The code depends on the version of Python, which names the bundle.
+  """
+
+  # Patterns are also built from the names found in the linted files, so the
+  # regexps a run does not use are dropped once there are more than this.
+  _MAX_SIZE = 1000
+
+  def __init__(self, directory):
+    """Loads the bundle.  Check IsSupported first."""
+    version = hashlib.sha1(
+        ('%s %s' % (sys.version, _sre.MAGIC)).encode('utf8')).hexdigest()
+    self._directory = directory
+    self._path = os.path.join(directory, 'regexps-%s.bundle' % version)
+    self._code = {}
+    self._used = set()
+    self._changed = False
+    try:
+      with open(self._path, 'rb') as f:
+        self._code = marshal.load(f)
+    except Exception:
+      # A missing or unusable bundle is just empty.
+      pass
+
+  @staticmethod
+  def IsSupported():
+    """Returns whether regexps can be compiled from their code here.
+
+    The bundle relies on the private sre_compile._code, and passes the code
+    to _sre.compile the way CPython 2 does.  Other versions and
+    implementations of Python compile every regexp with the re module.
+    """
+    if not _sre or not hasattr(sre_compile, '_code'):
+      return False
+    probe = r'(?P<first>a+)(b)?'
+    try:
+      compiled = _sre.compile(probe, *_SreCompileArgs(probe, re.I))
+      expected = _RegexpCompile(probe, re.I)
+      return (compiled.groupindex == expected.groupindex and
+              compiled.match('aAb').groups() == expected.match('aAb').groups())
+    except Exception:
+      return False
+
+  def Compile(self, pattern, flags):
+    """Compiles a pattern, from its code in the bundle if it is there."""
+    key = (pattern, flags)
+    self._used.add(key)
+    args = self._code.get(key)
+    if args is None:
+      args = self._code[key] = _SreCompileArgs(pattern, flags)
+      self._changed = True
+    return _sre.compile(pattern, *args)
+
+  def Store(self):
+    """Writes the bundle back if patterns were added to it."""
+    if not self._changed:
+      return
+    code = self._code
+    if len(code) > self._MAX_SIZE:
+      code = dict((key, code[key]) for key in self._used)
+    try:
+      if not os.path.isdir(self._directory):
+        os.makedirs(self._directory)
+      _WriteFileAtomically(self._path, lambda f: marshal.dump(code, f))
+    except (IOError, OSError):
+      pass
+
+
+# Words that can come right before a '(' without naming a function.
+_NOT_FUNCTION_NAMES = frozenset([
+    'alignas', 'alignof', 'decltype', 'defined', 'for', 'if', 'noexcept',
+    'return', 'sizeof', 'static_assert', 'switch', 'typeid', 'while'])
+
+# Words that keep the text before a '(' from declaring or defining a function.
+_NOT_FUNCTION_PREFIXES = frozenset([
+    'case', 'delete', 'else', 'friend', 'goto', 'new', 'operator', 'return',
+    'throw', 'typedef', 'using'])
+
+# Matches the return type and (qualified) name in front of the parameters of
+# a function declarator.
+_RE_PATTERN_FUNCTION_DECLARATOR = _Regexp(
+    r'\s*(?:template\s*<.*>\s*)?([\w\s:*&<>,]*?)\s*'
+    r'(~?[A-Za-z_]\w*(?:\s*::\s*~?[A-Za-z_]\w*)*)\s*$')
+_RE_PATTERN_MACRO_NAME = _Regexp(r'[A-Z0-9_]+$')
+_RE_PATTERN_MACRO_CALL = _Regexp(r'[A-Z][A-Z0-9_]*\(.*\)$')
+_RE_PATTERN_TEMPLATE_ARGUMENTS = _Regexp(r'<[^<>]*>')
+# Matches the rest of a qualified name whose qualifier began on an earlier
+# line, as in the definitions of the members of class templates.
+_RE_PATTERN_QUALIFIED_NAME_END = _Regexp(
+    r'(?:.*>)?\s*::\s*(~?[A-Za-z_]\w*)\s*$')
+# Matches the arguments of a variable constructed in its declaration, which
+# are expressions rather than parameters.
+_RE_PATTERN_CONSTRUCTOR_ARGUMENTS = _Regexp(r'[|+\-/%"\']|\b\d')
+_RE_PATTERN_DEFAULT_ARGUMENT = _Regexp(r'=[^,]*')
+_RE_PATTERN_NO_DEFINITION_NEEDED = _Regexp(r'.*=\s*(0|default|delete)\b')
+
+
+def _IsStatementStart(elided, linenum):
+  """Returns whether a statement or declaration starts on an elided line.
+
+  Preprocessor lines and lines holding nothing but an attribute macro, such
+  as ALWAYS_INLINE, are skipped, and lines holding nothing but a macro call,
+  which may expand to whole declarations, end the statement before.
+  """
+  for prev in xrange(linenum - 1, -1, -1):
+    line = elided[prev].strip()
+    if (not line or line.startswith('#') or
+        _RE_PATTERN_MACRO_NAME.match(line) or
+        (prev and elided[prev - 1].endswith('\\'))):
+      continue
+    return (line[-1] in ';{}' or
+            (line[-1] == ':' and not line.endswith('::')) or
+            (line[-1] == '>' and line.startswith('template')) or
+            bool(_RE_PATTERN_MACRO_CALL.match(line)))
+  return True
+
+
+def _DeclaresFunction(declarator):
+  """Tells a function declaration from a variable constructed in place.
+
+  Constants are declared constexpr or const, and functions which return a
+  constant return it through a pointer or reference.
+
+  Args:
+    declarator: The text before the parameters of a declaration.
+
+  Returns:
+    Whether the declaration ending in a ';' declares a function.
+  """
+  prefix = declarator.split()
+  return not (prefix and (prefix[0] == 'constexpr' or (
+      prefix[0] == 'const' and '*' not in declarator and
+      '&' not in declarator)))
+
+
+def _FunctionDeclarator(clean_lines, linenum, nesting_state):
+  """Finds a function declared or defined on a line at namespace scope.
+
+  Only the functions declared in namespaces, classes and the global scope
+  are looked at, on the line their declaration starts.
+
+  Args:
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to look at.
+    nesting_state: The _NestingState before the line.
+
+  Returns:
+    A tuple of the name of the function, qualified by its class if it has
+    one, and whether the line starts a definition, or None if the line does
+    not start a function declaration that needs a definition.
+  """
+  line = clean_lines.elided[linenum]
+  paren = line.find('(')
+  if paren < 0 or line.lstrip().startswith('#'):
+    return None
+  block = nesting_state.InnermostBlock()
+  if block is not None and not (
+      isinstance(block, _NamespaceInfo) or
+      (isinstance(block, _ClassInfo) and block.seen_open_brace)):
+    return None
+  declarator = line[:paren]
+  while '<' in declarator:
+    stripped = _RE_PATTERN_TEMPLATE_ARGUMENTS.sub('', declarator)
+    if stripped == declarator:
+      return None  # Inside template arguments.
+    declarator = stripped
+
+  match = _RE_PATTERN_QUALIFIED_NAME_END.match(declarator)
+  if match and (block is None or isinstance(block, _NamespaceInfo)):
+    # The class is named on an earlier line, and may be any class.
+    parts = ['', match.group(1)]
+  else:
+    match = _RE_PATTERN_FUNCTION_DECLARATOR.match(declarator)
+    if not match:
+      return None
+    prefix = match.group(1).split()
+    parts = match.group(2).replace(' ', '').split('::')
+    if (parts[-1] in _NOT_FUNCTION_NAMES or
+        _RE_PATTERN_MACRO_NAME.match(parts[-1]) or
+        not _NOT_FUNCTION_PREFIXES.isdisjoint(prefix)):
+      return None
+    classes = [block.name for block in nesting_state.stack
+               if isinstance(block, _ClassInfo)]
+    if classes:
+      parts = classes[-1:] + parts
+    if not prefix and not (parts[-1].startswith('~') or
+                           (len(parts) > 1 and parts[-1] == parts[-2])):
+      # Only constructors and destructors have no return type; anything else
+      # is a macro or a call.
+      return None
+    if not _IsStatementStart(clean_lines.elided, linenum):
+      return None
+
+  end = clean_lines.BracketIndex().ClosingPosition(linenum, paren)
+  if end is None:
+    return None
+  end_line, end_pos = end
+  if line[paren + 1:].lstrip()[:1] in ('*', '&'):
+    return None  # A pointer or reference to a function.
+  if end_line == linenum and _RE_PATTERN_CONSTRUCTOR_ARGUMENTS.search(
+      _RE_PATTERN_DEFAULT_ARGUMENT.sub('', line[paren + 1:end_pos - 1])):
+    return None  # A variable, constructed from the expressions.
+  rest = clean_lines.elided[end_line][end_pos:]
+  for following in xrange(end_line + 1,
+                          min(end_line + 10, clean_lines.NumLines())):
+    if ';' in rest or '{' in rest:
+      break
+    rest += ' ' + clean_lines.elided[following]
+  rest = rest.strip()
+  body = rest.find('{')
+  semicolon = rest.find(';')
+  if rest.startswith(':') and not rest.startswith('::'):
+    defined = True  # A constructor with an initializer list.
+  elif body >= 0 and (semicolon < 0 or body < semicolon):
+    defined = True
+  elif semicolon >= 0:
+    if (_RE_PATTERN_NO_DEFINITION_NEEDED.match(rest[:semicolon]) or
+        not parts[0] or not _DeclaresFunction(declarator)):
+      return None
+    defined = False
+  else:
+    return None
+  return '::'.join('::'.join(parts).split('::')[-2:]), defined
+
+
+def _FindIncludes(lines):
+  """Finds the includes of a file.
+
+  Args:
+    lines: The raw lines of the file.
+
+  Returns:
+    A list of (include, linenum) tuples, with line numbers starting at 1.
+  """
+  includes = []
+  for linenum, line in enumerate(lines, 1):
+    if '#' not in line:
+      continue
+    clean_line = CleanseComments(line)
+    match = _RE_PATTERN_INCLUDE.search(clean_line)
+    if match:
+      includes.append((match.group(2), linenum))
+  return includes
+
+
+def _ScanSymbols(filename, contents):
+  """Collects the facts about a file kept by the _SymbolIndex.
+
+  Args:
+    filename: The name of the file.
+    contents: The contents of the file, as unicode.
+
+  Returns:
+    A dict with the 'includes' of the file as [include, linenum] lists, its
+    header 'guard' as a [name, linenum] list or None, the qualified names of
+    the 'namespaces' and 'classes' it opens, the functions it declares
+    without defining them as [name, linenum] 'declarations', and the names
+    of the functions it defines as 'definitions'.
+  """
+  lines = (['// marker so line numbers and indices both start at 1'] +
+           _SplitLines(contents)[0] +
+           ['// marker so line numbers end in a known way'])
+  ignore_error = lambda *args: None
+
+  guard = None
+  ifndef = None
+  for linenum, line in enumerate(lines):
+    linesplit = line.split()
+    if len(linesplit) >= 2:
+      if not ifndef and linesplit[0] == '#ifndef':
+        ifndef = (linesplit[1], linenum)
+      elif linesplit[0] == '#define':
+        if ifndef and linesplit[1] == ifndef[0]:
+          guard = list(ifndef)
+        break
+
+  RemoveMultiLineComments(filename, lines, ignore_error)
+  clean_lines = CleansedLines(lines)
+  nesting_state = _NestingState()
+  namespaces = set()
+  classes = set()
+  declarations = []
+  definitions = set()
+  for linenum in xrange(clean_lines.NumLines()):
+    if '(' in clean_lines.elided[linenum]:
+      function = _FunctionDeclarator(clean_lines, linenum, nesting_state)
+      if function:
+        name, defined = function
+        if defined:
+          definitions.add(name)
+        else:
+          declarations.append([name, linenum])
+    nesting_state.Update(filename, clean_lines, linenum, ignore_error)
+    block = nesting_state.InnermostBlock()
+    if (isinstance(block, (_NamespaceInfo, _ClassInfo)) and
+        block.starting_linenum == linenum):
+      name = '::'.join(
+          outer.name for outer in nesting_state.stack
+          if isinstance(outer, (_NamespaceInfo, _ClassInfo)))
+      if isinstance(block, _ClassInfo):
+        classes.add(name)
+      else:
+        namespaces.add(name)
+
+  return {'includes': [list(include) for include in
+                       _FindIncludes(contents.splitlines())],
+          'guard': guard,
+          'namespaces': sorted(namespaces),
+          'classes': sorted(classes),
+          'declarations': declarations,
+          'definitions': sorted(definitions)}
+
+
+class _SymbolIndex(object):
+  """The --index of the C++ files of the checkouts being linted.
+
+  Keeps the includes, header guard, namespaces, classes and functions of
+  every .h, .cc and .cpp file, so that checks can ask about other files
+  without reading them.  The facts are stored by the digest of the contents
+  of each file, and a file is only scanned again when its modification time
+  or size changed and its digest is new.
+  """
+
+  def __init__(self, path):
+    self._path = path
+    # The [mtime, size, digest] of every indexed file, by absolute path.
+    self._files = {}
+    # The facts returned by _ScanSymbols, by digest.
+    self._records = {}
+    self._changed = False
+    self._guards = None
+    self._definitions = None
+    try:
+      with open(path) as f:
+        data = json.load(f)
+      if data['version'] == _CpplintVersion():
+        self._files = data['files']
+        self._records = data['records']
+    except Exception:
+      # A missing or unusable index is just empty.
+      pass
+
+  def Update(self, roots):
+    """Indexes the files below the roots which changed since the last run.
+
+    Args:
+      roots: The directories to index.
+    """
+    files = {}
+    for root in roots:
+      for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for name in filenames:
+          if os.path.splitext(name)[1] in ('.cc', '.h', '.cpp'):
+            path = os.path.join(dirpath, name)
+            entry = self._IndexFile(path)
+            if entry:
+              files[path] = entry
+    digests = set(entry[2] for entry in itervalues(files))
+    if len(files) != len(self._files) or len(digests) != len(self._records):
+      self._changed = True
+    self._files = files
+    self._records = dict((digest, self._records[digest])
+                         for digest in digests)
+    self._guards = self._definitions = None
+    if self._changed:
+      self._Store()
+
+  def _IndexFile(self, path):
+    try:
+      stat = os.stat(path)
+    except OSError:
+      return None
+    entry = self._files.get(path)
+    if (entry and entry[0] == stat.st_mtime and entry[1] == stat.st_size and
+        entry[2] in self._records):
+      return entry
+    try:
+      with open(path, 'rb') as f:
+        contents = f.read()
+    except (IOError, OSError):
+      return None
+    digest = hashlib.sha1(contents).hexdigest()
+    if digest not in self._records:
+      self._records[digest] = _ScanSymbols(
+          path, contents.decode('utf8', 'replace'))
+    self._changed = True
+    return [stat.st_mtime, stat.st_size, digest]
+
+  def _Store(self):
+    data = {'version': _CpplintVersion(), 'files': self._files,
+            'records': self._records}
+    try:
+      _WriteFileAtomically(
+          self._path, lambda f: json.dump(data, f, sort_keys=True), 'w')
+    except (IOError, OSError):
+      # Failing to store the index only costs time on the next run.
+      pass
+    self._changed = False
+
+  def Record(self, path):
+    """Returns the facts about a file, or None if it is not indexed."""
+    entry = self._files.get(os.path.abspath(path))
+    return entry and self._records[entry[2]]
+
+  def Digest(self, path):
+    """Returns the digest of an indexed file, or None if it is not indexed."""
+    entry = self._files.get(os.path.abspath(path))
+    return entry and entry[2]
+
+  def GuardUsers(self, guard):
+    """Returns the sorted paths of the headers using a header guard."""
+    if self._guards is None:
+      self._guards = {}
+      for path, entry in iteritems(self._files):
+        record = self._records[entry[2]]
+        if record['guard']:
+          self._guards.setdefault(record['guard'][0], []).append(path)
+      for paths in itervalues(self._guards):
+        paths.sort()
+    return self._guards.get(guard, [])
+
+  def IsDefined(self, name):
+    """Returns whether any indexed file defines a function of that name.
+
+    Members of class templates defined with the class on an earlier line
+    are indexed as '::' and their name, and define the members of that name
+    of any class.
+    """
+    if self._definitions is None:
+      self._definitions = set()
+      for record in itervalues(self._records):
+        self._definitions.update(record['definitions'])
+    return (name in self._definitions or
+            '::' + name.split('::')[-1] in self._definitions)
+
+  def Fingerprint(self, path):
+    """Returns a digest of what the other indexed files tell about a file.
+
+    The errors reported for a file only depend on the other files through
+    the headers that share its header guard and through which of the
+    functions it declares they define.  Results cached for the file stay
+    valid as long as those do not change, whatever else changes in the
+    index.
+
+    Args:
+      path: The path of the file.
+
+    Returns:
+      The digest, or '' if the file is not indexed.
+    """
+    record = self.Record(path)
+    if not record:
+      return ''
+    guard_users = record['guard'] and self.GuardUsers(record['guard'][0])
+    undefined = [name for name, _ in record['declarations']
+                 if not self.IsDefined(name)]
+    return hashlib.sha1(
+        json.dumps([guard_users, undefined]).encode('utf8')).hexdigest()
+
+
+def _IndexRoots(filenames):
+  """Returns the directories --index covers when linting the files.
+
+  These are the roots of the checkouts of the files, or the directories of
+  the files which are not in a checkout.
+  """
+  roots = set()
+  for filename in filenames:
+    if filename == '-':
+      continue
+    directory = os.path.dirname(os.path.abspath(filename))
+    root = _FindRepositoryRoot(directory)
+    roots.add(root[0] if root else directory)
+  return sorted(roots)
+
+# The --index, if any.
+_symbol_index = None
+
+
 def _OutputFormat():
   """Gets the module's output format."""
   return _cpplint_state.output_format
@@ -681,6 +1840,14 @@ class _FunctionState(object):
     self.in_a_function = False
     self.lines_in_function = 0
     self.current_function = ''
+    # A function start is only known to begin a body at the first line from
+    # there on with a ';', '{' or '}'.  Until then it is pending: these hold
+    # its name, the lines it started on, its text so far and the number of
+    # lines counted since it started.
+    self.pending_function = None
+    self.pending_linenums = []
+    self.pending_text = ''
+    self.pending_lines = 0
 
   def Begin(self, function_name):
     """Start analyzing function body.
@@ -692,10 +1859,42 @@ class _FunctionState(object):
     self.lines_in_function = 0
     self.current_function = function_name
 
+  def Expect(self, function_name, linenum):
+    """Start looking for the body of a function.
+
+    Args:
+      function_name: The name of the function, without parameters.
+      linenum: The number of the line the function starts on.
+    """
+    self.pending_function = function_name
+    self.pending_linenums.append(linenum)
+    self.pending_text = ''
+    self.pending_lines = 0
+
+  def BeginExpected(self, function_name):
+    """Start analyzing the body of the pending function.
+
+    The lines counted since the function started are part of its body.
+
+    Args:
+      function_name: The name of the function being tracked.
+    """
+    lines_in_function = self.pending_lines
+    self.Forget()
+    self.Begin(function_name)
+    self.lines_in_function = lines_in_function
+
+  def Forget(self):
+    """Stop looking for the body of the pending function."""
+    self.pending_function = None
+    self.pending_linenums = []
+
   def Count(self):
     """Count line in current function body."""
     if self.in_a_function:
       self.lines_in_function += 1
+    if self.pending_function is not None:
+      self.pending_lines += 1
 
   def Check(self, error, filename, linenum):
     """Report if too many lines in function body.
@@ -716,7 +1915,7 @@ class _FunctionState(object):
     trigger = base_trigger * 2**_VerboseLevel()
 
     if self.lines_in_function > trigger:
-      error_level = int(math.log(self.lines_in_function / base_trigger, 2))
+      error_level = int(math.log(self.lines_in_function // base_trigger, 2))
       # 50 => 0, 100 => 1, 200 => 2, 400 => 3, 800 => 4, 1600 => 5, ...
       if error_level > 5:
         error_level = 5
@@ -730,28 +1929,101 @@ class _FunctionState(object):
     """Stop analyzing function body."""
     self.in_a_function = False
 
+  def CheckBodyFound(self, filename, error):
+    """Report the function starts that no body followed.
+
+    Call this at the end of the file.
+
+    Args:
+      filename: The name of the current file.
+      error: The function to call with any errors found.
+    """
+    for linenum in self.pending_linenums:
+      # No body for the function (or evidence of a non-function) was found.
+      error(filename, linenum, 'readability/fn_size', 5,
+            'Lint failed to find start of function body.')
+
 
 class _IncludeError(Exception):
   """Indicates a problem with the include order in a file."""
   pass
 
 
+# Maps each directory that FileInfo.RepositoryName has looked at to the root
+# of the checkout containing it, see _FindRepositoryRoot.
+_repository_roots = {}
+
+
+def _FindRepositoryRoot(project_dir):
+  """Finds the root of the checkout that contains a directory.
+
+  The result is memoised per directory, so the directory tree is only walked
+  for the first file linted in each directory.
+
+  Args:
+    project_dir: The absolute path of a directory.
+
+  Returns:
+    A (root_dir, name_prefix) tuple, where name_prefix is prepended to the path
+    of a file relative to root_dir to form its repository name, or None if the
+    directory is not part of a checkout.
+  """
+  if project_dir in _repository_roots:
+    return _repository_roots[project_dir]
+
+  root = None
+  if os.path.exists(os.path.join(project_dir, ".svn")):
+    # If there's a .svn file in the current directory, we recursively look
+    # up the directory tree for the top of the SVN checkout
+    root_dir = project_dir
+    one_up_dir = os.path.dirname(root_dir)
+    while os.path.exists(os.path.join(one_up_dir, ".svn")):
+      root_dir = os.path.dirname(root_dir)
+      one_up_dir = os.path.dirname(one_up_dir)
+    root = (root_dir, '')
+  else:
+    # Not SVN <= 1.6? Try to find a git, hg, or svn top level directory by
+    # searching up from the current path.
+    root_dir = project_dir
+    while (root_dir != os.path.dirname(root_dir) and
+           not os.path.exists(os.path.join(root_dir, ".git")) and
+           not os.path.exists(os.path.join(root_dir, ".hg")) and
+           not os.path.exists(os.path.join(root_dir, ".svn"))):
+      root_dir = os.path.dirname(root_dir)
+
+    if (os.path.exists(os.path.join(root_dir, ".git")) or
+        os.path.exists(os.path.join(root_dir, ".hg")) or
+        os.path.exists(os.path.join(root_dir, ".svn"))):
+      # BEGIN android-changed
+      # root = (root_dir, '')
+      root = (root_dir, 'art/')
+      # END android-changed
+
+  _repository_roots[project_dir] = root
+  return root
+
+
 class FileInfo:
   """Provides utility functions for filenames.
 
   FileInfo provides easy access to the components of a file's path
-  relative to the project root.
+  relative to the project root.  The full and repository names are computed
+  once per instance.
   """
 
   def __init__(self, filename):
     self._filename = filename
+    self._full_name = None
+    self._repository_name = None
 
   def FullName(self):
     """Make Windows paths like Unix."""
-    return os.path.abspath(self._filename).replace('\\', '/')
+    if self._full_name is None:
+      self._full_name = os.path.abspath(self._filename).replace('\\', '/')
+    return self._full_name
 
   def RepositoryName(self):
-    """FullName after removing the local path to the repository.
+    r"""FullName after removing the local path to the repository.
 
     If we have a real absolute path name here we can try to do something smart:
     detecting the root of the checkout and truncating /path/to/checkout from
@@ -760,40 +2032,20 @@ class FileInfo:
     people on different computers who have checked the source out to different
     locations won't see bogus errors.
     """
+    if self._repository_name is None:
+      self._repository_name = self._ComputeRepositoryName()
+    return self._repository_name
+
+  def _ComputeRepositoryName(self):
     fullname = self.FullName()
 
     if os.path.exists(fullname):
       project_dir = os.path.dirname(fullname)
-
-      if os.path.exists(os.path.join(project_dir, ".svn")):
-        # If there's a .svn file in the current directory, we recursively look
-        # up the directory tree for the top of the SVN checkout
-        root_dir = project_dir
-        one_up_dir = os.path.dirname(root_dir)
-        while os.path.exists(os.path.join(one_up_dir, ".svn")):
-          root_dir = os.path.dirname(root_dir)
-          one_up_dir = os.path.dirname(one_up_dir)
-
+      root = _FindRepositoryRoot(project_dir)
+      if root:
+        root_dir, name_prefix = root
         prefix = os.path.commonprefix([root_dir, project_dir])
-        return fullname[len(prefix) + 1:]
-
-      # Not SVN <= 1.6? Try to find a git, hg, or svn top level directory by
-      # searching up from the current path.
-      root_dir = os.path.dirname(fullname)
-      while (root_dir != os.path.dirname(root_dir) and
-             not os.path.exists(os.path.join(root_dir, ".git")) and
-             not os.path.exists(os.path.join(root_dir, ".hg")) and
-             not os.path.exists(os.path.join(root_dir, ".svn"))):
-        root_dir = os.path.dirname(root_dir)
-
-      if (os.path.exists(os.path.join(root_dir, ".git")) or
-          os.path.exists(os.path.join(root_dir, ".hg")) or
-          os.path.exists(os.path.join(root_dir, ".svn"))):
-        prefix = os.path.commonprefix([root_dir, project_dir])
-        # BEGIN android-changed
-        # return fullname[len(prefix) + 1:]
-        return "art/" + fullname[len(prefix) + 1:]
-        # END android-changed
+        return name_prefix + fullname[len(prefix) + 1:]
 
     # Don't know what to do; header guard warnings may be wrong...
     return fullname
@@ -829,6 +2081,52 @@ class FileInfo:
     return self.Extension()[1:] in ('c', 'cc', 'cpp', 'cxx')
 
 
+class _FileContext(object):
+  """Facts about the file being linted, computed once per file.
+
+  Checks use these instead of deriving them from the filename on every line,
+  which would touch the filesystem each time.
+
+  Attributes:
+    filename: The name of the file, as given on the command line.
+    file_info: A FileInfo instance for the file.
+    full_name: The absolute path of the file.
+    repository_name: The path of the file relative to its checkout.
+    extension: The extension (without the dot) of the file.
+    header_guard: The header guard variable of a header file, None otherwise.
+    is_test: Whether the file is a test.
+    line_checks: The checks of _LINE_CHECKS that can report an error which
+      passes the filters.
+    state_checks: The checks of line_checks that carry state from line to
+      line, which have to run on every line.
+    changed_lines: The set of lines to report errors on, None for all lines.
+    check_seconds: The dict to add the time taken by each check to, by name,
+      or None if the checks are not timed.
+  """
+
+  def __init__(self, filename, file_extension):
+    self.filename = filename
+    self.file_info = FileInfo(filename)
+    self.full_name = self.file_info.FullName()
+    self.repository_name = self.file_info.RepositoryName()
+    self.extension = file_extension
+    if file_extension == 'h':
+      self.header_guard = GetHeaderGuardCPPVariable(filename)
+    else:
+      self.header_guard = None
+    self.is_test = _IsTestFilename(filename)
+    self.line_checks = tuple(
+        check for check in _LINE_CHECKS + _plugin_line_checks
+        if _cpplint_state.AnyCategoryPassesFilters(check.categories))
+    self.state_checks = tuple(
+        check for check in self.line_checks if check.carries_state)
+    self.changed_lines = _cpplint_state.ChangedLines(filename)
+    if _cpplint_state.StructuredOutput():
+      self.check_seconds = _file_lint_state.check_seconds
+    else:
+      self.check_seconds = None
+
+
 def _ShouldPrintError(category, confidence, linenum):
   """If confidence >= verbose, category passes filter and is not suppressed."""
 
@@ -840,20 +2138,7 @@ def _ShouldPrintError(category, confidence, linenum):
   if confidence < _cpplint_state.verbose_level:
     return False
 
-  is_filtered = False
-  for one_filter in _Filters():
-    if one_filter.startswith('-'):
-      if category.startswith(one_filter[1:]):
-        is_filtered = True
-    elif one_filter.startswith('+'):
-      if category.startswith(one_filter[1:]):
-        is_filtered = False
-    else:
-      assert False  # should have been checked for in SetFilter.
-  if is_filtered:
-    return False
-
-  return True
+  return _cpplint_state.PassesFilters(category)
 
 
 def Error(filename, linenum, category, confidence, message):
@@ -865,7 +2150,7 @@ def Error(filename, linenum, category, confidence, message):
 
   False positives can be suppressed by the use of
   "cpplint(category)"  comments on the offending line.  These are
-  parsed into _error_suppressions.
+  parsed into the error_suppressions of the current _FileLintState.
 
   Args:
     filename: The name of the file containing the error.
@@ -879,25 +2164,36 @@ def Error(filename, linenum, category, confidence, message):
     message: The error message.
   """
   if _ShouldPrintError(category, confidence, linenum):
-    _cpplint_state.IncrementErrorCount(category)
-    if _cpplint_state.output_format == 'vs7':
-      sys.stderr.write('%s(%s):  %s  [%s] [%d]\n' % (
-          filename, linenum, message, category, confidence))
-    elif _cpplint_state.output_format == 'eclipse':
-      sys.stderr.write('%s:%s: warning: %s  [%s] [%d]\n' % (
-          filename, linenum, message, category, confidence))
+    _file_lint_state.IncrementErrorCount(category)
+    if (_cpplint_state.StructuredOutput() and
+        not isinstance(_file_lint_state, _UnattachedLintState)):
+      _file_lint_state.diagnostics.append(
+          (filename, linenum, category, confidence, message))
     else:
-      sys.stderr.write('%s:%s:  %s  [%s] [%d]\n' % (
-          filename, linenum, message, category, confidence))
+      _file_lint_state.Write(
+          _FormatError(filename, linenum, category, confidence, message))
+
+
+def _FormatError(filename, linenum, category, confidence, message):
+  """Formats an error the way --output asks for; see Error for the args."""
+  if _cpplint_state.output_format == 'vs7':
+    return '%s(%s):  %s  [%s] [%d]\n' % (
+        filename, linenum, message, category, confidence)
+  elif _cpplint_state.output_format == 'eclipse':
+    return '%s:%s: warning: %s  [%s] [%d]\n' % (
+        filename, linenum, message, category, confidence)
+  else:
+    return '%s:%s:  %s  [%s] [%d]\n' % (
+        filename, linenum, message, category, confidence)
 
 
 # Matches standard C++ escape esequences per 2.13.2.3 of the C++ standard.
-_RE_PATTERN_CLEANSE_LINE_ESCAPES = re.compile(
+_RE_PATTERN_CLEANSE_LINE_ESCAPES = _Regexp(
     r'\\([abfnrtv?"\\\']|\d+|x[0-9a-fA-F]+)')
 # Matches strings.  Escape codes should already be removed by ESCAPES.
-_RE_PATTERN_CLEANSE_LINE_DOUBLE_QUOTES = re.compile(r'"[^"]*"')
+_RE_PATTERN_CLEANSE_LINE_DOUBLE_QUOTES = _Regexp(r'"[^"]*"')
 # Matches characters.  Escape codes should already be removed by ESCAPES.
-_RE_PATTERN_CLEANSE_LINE_SINGLE_QUOTES = re.compile(r"'.'")
+_RE_PATTERN_CLEANSE_LINE_SINGLE_QUOTES = _Regexp(r"'.'")
 # Matches multi-line C++ comments.
 # This RE is a little bit more complicated than one might expect, because we
 # have to take care of space removals tools so we can handle comments inside
@@ -906,11 +2202,20 @@ _RE_PATTERN_CLEANSE_LINE_SINGLE_QUOTES = re.compile(r"'.'")
 # end of the line. Otherwise, we try to remove spaces from the right side,
 # if this doesn't work we try on left side but only if there's a non-character
 # on the right.
-_RE_PATTERN_CLEANSE_LINE_C_COMMENTS = re.compile(
+_RE_PATTERN_CLEANSE_LINE_C_COMMENTS = _Regexp(
     r"""(\s*/\*.*\*/\s*$|
             /\*.*\*/\s+|
          \s+/\*.*\*/(?=\W)|
             /\*.*\*/)""", re.VERBOSE)
+# Match from the first comment marker, or the first character that
+# _CollapseStrings acts on, to the end of the line.  FindMatchingLines uses
+# them to pick the few lines that the per-line cleansing may change.
+_RE_PATTERN_COMMENT_LINE = _Regexp(r'(//|/\*).*')
+_RE_PATTERN_STRING_LINE = _Regexp(r'[\\\'"].*')
+_RE_PATTERN_COMMENT_START_LINE = _Regexp(r'/\*.*')
+_RE_PATTERN_COMMENT_END_LINE = _Regexp(r'\*/.*')
+# Matches a line break, along with the '\r' of a CRLF line ending.
+_RE_PATTERN_LINE_BREAK = _Regexp(r'\r*\n')
 
 
 def IsCppString(line):
@@ -930,24 +2235,34 @@ def IsCppString(line):
   return ((line.count('"') - line.count(r'\"') - line.count("'\"'")) & 1) == 1
 
 
-def FindNextMultiLineCommentStart(lines, lineix):
-  """Find the beginning marker for a multiline comment."""
-  while lineix < len(lines):
-    if lines[lineix].strip().startswith('/*'):
-      # Only return this marker if the comment goes beyond this line
-      if lines[lineix].strip().find('*/', 2) < 0:
-        return lineix
-    lineix += 1
-  return len(lines)
+def FindMatchingLines(regexp, text):
+  """Finds the lines of a file where a regular expression matches.
+
+  Scanning the whole file at once lets the regular expression engine skip
+  quickly over lines without a match, instead of running on each line.
+
+  Args:
+    regexp: A compiled regular expression that matches up to the end of the
+            line, without matching the line break itself.
+    text: All the lines of the file, joined with '\\n'.
+
+  Returns:
+    The list of the indices of the lines with a match, in increasing order.
+  """
+  linenums = []
+  linenum = 0
+  offset = 0
+  for match in regexp.finditer(text):
+    linenum += text.count('\n', offset, match.start())
+    offset = match.start()
+    linenums.append(linenum)
+  return linenums
 
 
-def FindNextMultiLineCommentEnd(lines, lineix):
-  """We are inside a comment, find the end marker."""
-  while lineix < len(lines):
-    if lines[lineix].strip().endswith('*/'):
-      return lineix
-    lineix += 1
-  return len(lines)
+def IsMultiLineCommentStart(line):
+  """Checks if a line opens a /* comment that goes beyond the line."""
+  line = line.strip()
+  return line.startswith('/*') and line.find('*/', 2) < 0
 
 
 def RemoveMultiLineCommentsFromRange(lines, begin, end):
@@ -960,18 +2275,26 @@ def RemoveMultiLineCommentsFromRange(lines, begin, end):
 
 def RemoveMultiLineComments(filename, lines, error):
   """Removes multiline (c-style) comments from lines."""
-  lineix = 0
-  while lineix < len(lines):
-    lineix_begin = FindNextMultiLineCommentStart(lines, lineix)
-    if lineix_begin >= len(lines):
-      return
-    lineix_end = FindNextMultiLineCommentEnd(lines, lineix_begin)
-    if lineix_end >= len(lines):
+  text = '\n'.join(lines)
+  begins = [lineix
+            for lineix in FindMatchingLines(_RE_PATTERN_COMMENT_START_LINE, text)
+            if IsMultiLineCommentStart(lines[lineix])]
+  if not begins:
+    return
+  ends = iter([lineix
+               for lineix in FindMatchingLines(_RE_PATTERN_COMMENT_END_LINE, text)
+               if lines[lineix].strip().endswith('*/')])
+  lineix_end = -1
+  for lineix_begin in begins:
+    if lineix_begin <= lineix_end:
+      continue
+    # The comment ends on the next line ending with */.
+    lineix_end = next((end for end in ends if end >= lineix_begin), None)
+    if lineix_end is None:
       error(filename, lineix_begin + 1, 'readability/multiline_comment', 5,
             'Could not find end of multi-line comment')
       return
     RemoveMultiLineCommentsFromRange(lines, lineix_begin, lineix_end + 1)
-    lineix = lineix_end + 1
 
 
 def CleanseComments(line):
@@ -997,22 +2320,69 @@ class CleansedLines(object):
   2) lines member contains lines without comments, and
   3) raw_lines member contains all the lines without processing.
   All these three members are of <type 'list'>, and of the same length.
+  Lines that processing leaves alone are shared between the three.
   """
 
   def __init__(self, lines):
-    self.elided = []
-    self.lines = []
     self.raw_lines = lines
     self.num_lines = len(lines)
-    for linenum in range(len(lines)):
-      self.lines.append(CleanseComments(lines[linenum]))
+    self._bracket_index = None
+    self._type_table = None
+    # Most lines have no comments or strings, so rather than cleansing every
+    # line, find the ones that need it in passes over the whole file.
+    text = '\n'.join(lines)
+    self.lines = list(lines)
+    for linenum in FindMatchingLines(_RE_PATTERN_COMMENT_LINE, text):
+      self.lines[linenum] = CleanseComments(lines[linenum])
+    self.elided = list(self.lines)
+    for linenum in FindMatchingLines(_RE_PATTERN_STRING_LINE, text):
       elided = self._CollapseStrings(lines[linenum])
-      self.elided.append(CleanseComments(elided))
+      self.elided[linenum] = CleanseComments(elided)
 
   def NumLines(self):
     """Returns the number of lines represented."""
     return self.num_lines
 
+  def BracketIndex(self):
+    """Returns the _BracketIndex for these lines, building it on first use."""
+    if self._bracket_index is None:
+      self._bracket_index = _BracketIndex(self)
+    return self._bracket_index
+
+  def TypeTable(self):
+    """Returns the _TypeTable for these lines, building it on first use."""
+    if self._type_table is None:
+      self._type_table = _TypeTable(self)
+    return self._type_table
+
+  def Splice(self, lines, begin, end, new_end):
+    """Returns the CleansedLines of an edited version of these lines.
+
+    Only the edited lines are cleansed; the others are shared with self.
+    The result answers bracket queries with a _BracketScanner, since the
+    few lines that an incremental relint processes are not worth indexing
+    the whole file for.
+
+    Args:
+      lines: The edited lines.  lines[begin:new_end] replaced
+             raw_lines[begin:end]; the other lines are unchanged.
+      begin: The number of the first edited line.
+      end: The end of the edited range in raw_lines.
+      new_end: The end of the edited range in lines.
+
+    Returns:
+      A CleansedLines instance for lines.
+    """
+    edited = CleansedLines(lines[begin:new_end])
+    spliced = CleansedLines.__new__(CleansedLines)
+    spliced.raw_lines = lines
+    spliced.num_lines = len(lines)
+    spliced.lines = self.lines[:begin] + edited.lines + self.lines[end:]
+    spliced.elided = self.elided[:begin] + edited.elided + self.elided[end:]
+    spliced._bracket_index = _BracketScanner(spliced)
+    spliced._type_table = None
+    return spliced
+
   @staticmethod
   def _CollapseStrings(elided):
     """Collapses strings and chars on a line to simple "" or '' blocks.
@@ -1035,6 +2405,405 @@ class CleansedLines(object):
     return elided
 
 
+# Delimiters tracked by _BracketIndex.  Template brackets get passes of their
+# own since '<' and '>' are also comparison and shift operators.
+_RE_PATTERN_BRACKET = _Regexp(r'[()\[\]{}]')
+_RE_PATTERN_ANGLE_BRACKET_TOKEN = _Regexp(r'[<>(),;\[\]]')
+_OPENING_BRACKET = {')': '(', ']': '[', '}': '{'}
+_CLOSING_BRACKET = {'(': ')', '[': ']', '{': '}'}
+
+
+class _BracketIndex(object):
+  """Matches delimiters across a whole file instead of once per query.
+
+  CloseExpression, the template bracket searches and the end of class search
+  used to rescan the following (or preceding) lines on every call, which is
+  quadratic in the length of big initializers and class bodies.  This class
+  tokenises the file once per kind of query and answers from tables.  Each
+  table is built the first time a check asks for it, so a file that never
+  needs one does not pay for it.
+  """
+
+  def __init__(self, clean_lines):
+    self._clean_lines = clean_lines
+    self._closing = None
+    self._closing_angle = None
+    self._opening_angle = None
+    self._block_end = None
+
+  def ClosingPosition(self, linenum, pos):
+    """Finds the partner of the '(', '[' or '{' at linenum/pos.
+
+    Args:
+      linenum: The number of the line holding the opening bracket.
+      pos: The position of the opening bracket in the elided line.
+
+    Returns:
+      A tuple (linenum, pos) pointing just past the closing bracket, or None
+      if the bracket is never closed.
+    """
+    if self._closing is None:
+      self._closing = self._MatchBrackets()
+    return self._closing.get((linenum, pos))
+
+  def HasClosingAngleBracket(self, linenum, pos):
+    """Returns whether the '<' at linenum/pos is closed by a template '>'.
+
+    This is the answer FindNextMatchingAngleBracket gives when scanning
+    forward from just after the '<'.
+    """
+    if self._closing_angle is None:
+      self._closing_angle = self._MatchAngleBracketsForward()
+    return self._closing_angle[(linenum, pos)]
+
+  def HasOpeningAngleBracket(self, linenum, pos):
+    """Returns whether the '>' at linenum/pos is opened by a template '<'.
+
+    This is the answer FindPreviousMatchingAngleBracket gives when scanning
+    backward from just before the '>'.
+    """
+    if self._opening_angle is None:
+      self._opening_angle = self._MatchAngleBracketsBackward()
+    return self._opening_angle[(linenum, pos)]
+
+  def BlockEnd(self, linenum):
+    """Finds the line where the braces opened from linenum balance out.
+
+    Args:
+      linenum: The first line of the block.
+
+    Returns:
+      The first line at or after linenum where as many '}' as '{' have been
+      seen since the start of linenum, or None if there is no such line.
+    """
+    if self._block_end is None:
+      self._block_end = self._FindBlockEnds()
+    return self._block_end[linenum]
+
+  def _MatchBrackets(self):
+    closing = {}
+    stacks = {'(': [], '[': [], '{': []}
+    for linenum, line in enumerate(self._clean_lines.elided):
+      for match in _RE_PATTERN_BRACKET.finditer(line):
+        char = match.group()
+        if char in stacks:
+          stacks[char].append((linenum, match.start()))
+        else:
+          stack = stacks[_OPENING_BRACKET[char]]
+          if stack:
+            closing[stack.pop()] = (linenum, match.end())
+    return closing
+
+  def _MatchAngleBracketsForward(self):
+    # Runs all the forward scans of FindNextMatchingAngleBracket at once.
+    # The stack holds '(' and '[' markers and the positions of the '<' whose
+    # scans are still undecided; a ',' or a stray closer decides all of them.
+    result = {}
+    stack = []
+    for linenum, line in enumerate(self._clean_lines.elided):
+      for match in _RE_PATTERN_ANGLE_BRACKET_TOKEN.finditer(line):
+        operator = match.group()
+        if operator == '<':
+          stack.append((linenum, match.start()))
+        elif not stack:
+          pass
+        elif stack[-1] in ('(', '['):
+          if operator in ('(', '['):
+            stack.append(operator)
+          elif operator in (')', ']'):
+            stack.pop()
+        elif operator in ('(', '['):
+          stack.append(operator)
+        elif operator == '>':
+          result[stack.pop()] = True
+        else:
+          found = operator == ','
+          for frame in stack:
+            if frame not in ('(', '['):
+              result[frame] = found
+          stack = []
+    for frame in stack:
+      if frame not in ('(', '['):
+        result[frame] = True
+    return result
+
+  def _MatchAngleBracketsBackward(self):
+    # The mirror image of _MatchAngleBracketsForward, for the scans of
+    # FindPreviousMatchingAngleBracket.
+    result = {}
+    stack = []
+    elided = self._clean_lines.elided
+    for linenum in xrange(len(elided) - 1, -1, -1):
+      tokens = list(_RE_PATTERN_ANGLE_BRACKET_TOKEN.finditer(elided[linenum]))
+      for match in reversed(tokens):
+        operator = match.group()
+        if operator == '>':
+          stack.append((linenum, match.start()))
+        elif not stack:
+          pass
+        elif stack[-1] in (')', ']'):
+          if operator in (')', ']'):
+            stack.append(operator)
+          elif operator in ('(', '['):
+            stack.pop()
+        elif operator in (')', ']'):
+          stack.append(operator)
+        elif operator == '<':
+          result[stack.pop()] = True
+        else:
+          found = operator == ','
+          for frame in stack:
+            if frame not in (')', ']'):
+              result[frame] = found
+          stack = []
+    for frame in stack:
+      if frame not in (')', ']'):
+        result[frame] = False
+    return result
+
+  def _FindBlockEnds(self):
+    # The braces opened from line i balance out on the first line j >= i
+    # where the running brace depth is back to what it was before line i.
+    elided = self._clean_lines.elided
+    depths = []
+    depth = 0
+    for line in elided:
+      depth += line.count('{') - line.count('}')
+      depths.append(depth)
+    block_end = [None] * len(elided)
+    nearest = {}
+    for i in xrange(len(elided) - 1, -1, -1):
+      nearest[depths[i]] = i
+      block_end[i] = nearest.get(depths[i - 1] if i else 0)
+    return block_end
+
+
+class _BracketScanner(object):
+  """Answers the queries of a _BracketIndex by scanning from the query.
+
+  Each query scans the lines after (or before) the bracket it is about,
+  like the checks did before there was an index, and gives the same
+  answer as the index would.
+  """
+
+  def __init__(self, clean_lines):
+    self._clean_lines = clean_lines
+
+  def ClosingPosition(self, linenum, pos):
+    """See _BracketIndex.ClosingPosition."""
+    elided = self._clean_lines.elided
+    startchar = elided[linenum][pos]
+    endchar = _CLOSING_BRACKET[startchar]
+    depth = 0
+    for end_linenum in xrange(linenum, len(elided)):
+      line = elided[end_linenum]
+      end_pos = FindEndOfExpressionInLine(line, pos, depth, startchar, endchar)
+      if end_pos > -1:
+        return (end_linenum, end_pos)
+      depth += line.count(startchar, pos) - line.count(endchar, pos)
+      pos = 0
+    return None
+
+  def HasClosingAngleBracket(self, linenum, pos):
+    """See _BracketIndex.HasClosingAngleBracket."""
+    elided = self._clean_lines.elided
+    stack = ['<']
+    start = pos + 1
+    for line in itertools.islice(elided, linenum, None):
+      for match in _RE_PATTERN_ANGLE_BRACKET_TOKEN.finditer(line, start):
+        operator = match.group()
+        if operator == '<':
+          stack.append(operator)
+        elif stack[-1] in ('(', '['):
+          if operator in ('(', '['):
+            stack.append(operator)
+          elif operator in (')', ']'):
+            stack.pop()
+        elif operator in ('(', '['):
+          stack.append(operator)
+        elif operator == '>':
+          stack.pop()
+          if not stack:
+            return True
+        else:
+          return operator == ','
+      start = 0
+    return True
+
+  def HasOpeningAngleBracket(self, linenum, pos):
+    """See _BracketIndex.HasOpeningAngleBracket."""
+    elided = self._clean_lines.elided
+    stack = ['>']
+    for line in itertools.islice(reversed(elided), len(elided) - 1 - linenum,
+                                 None):
+      if pos is None:
+        pos = len(line)
+      tokens = list(_RE_PATTERN_ANGLE_BRACKET_TOKEN.finditer(line, 0, pos))
+      for match in reversed(tokens):
+        operator = match.group()
+        if operator == '>':
+          stack.append(operator)
+        elif stack[-1] in (')', ']'):
+          if operator in (')', ']'):
+            stack.append(operator)
+          elif operator in ('(', '['):
+            stack.pop()
+        elif operator in (')', ']'):
+          stack.append(operator)
+        elif operator == '<':
+          stack.pop()
+          if not stack:
+            return True
+        else:
+          return operator == ','
+      pos = None
+    return False
+
+  def BlockEnd(self, linenum):
+    """See _BracketIndex.BlockEnd."""
+    elided = self._clean_lines.elided
+    depth = 0
+    for end_linenum in xrange(linenum, len(elided)):
+      line = elided[end_linenum]
+      depth += line.count('{') - line.count('}')
+      if depth == 0:
+        return end_linenum
+    return None
+
+
+# The declarations recorded by _TypeTable.  A declared type is a possibly
+# qualified name, whose template arguments are matched separately, and is
+# followed by the declared name.
+_RE_PATTERN_TYPEDEF = _Regexp(r'\btypedef\s+(.*\S)\s+(\w+)\s*;')
+_RE_PATTERN_USING_ALIAS = _Regexp(r'\busing\s+(\w+)\s*=\s*(.*\S)\s*;')
+_RE_PATTERN_DECLARED_TYPE = _Regexp(
+    r'(?:^|[(,;{])\s*(?:(?:const|static|mutable|volatile)\s+)*'
+    r'((?:[A-Za-z_]\w*::)*[A-Za-z_]\w*)\s*(<)?')
+_RE_PATTERN_DECLARED_NAME = _Regexp(
+    r'\s*(?:const\b)?\s*([&*]*)\s*(?:const\s+)?([a-z_]\w*)\s*[;=({,)[]')
+_RE_PATTERN_CONST = _Regexp(r'\bconst\b')
+_NOT_TYPES = frozenset([
+    'case', 'delete', 'else', 'goto', 'new', 'return', 'sizeof', 'throw',
+    'typedef', 'typename', 'using'])
+
+
+class _TypeTable(object):
+  """The types of the names declared in a file, found in one pass.
+
+  Checks that need the type of a variable, member or parameter declared
+  elsewhere in the file look it up here instead of searching the file for
+  its declaration on every line.  Names are not scoped: a name declared
+  with different types in different places has no type.  Types are spelt
+  without spaces or const qualifiers, e.g. 'std::vector<std::string>'.
+
+  The typedefs and aliases are found when the table is built, the other
+  declarations only when a type is first looked up.
+  """
+
+  def __init__(self, clean_lines):
+    self._clean_lines = clean_lines
+    self._aliases = {}
+    self._types = None
+    self._patterns = {}
+    for line in clean_lines.elided:
+      if 'typedef' in line or 'using' in line:
+        match = _RE_PATTERN_TYPEDEF.search(line)
+        if match:
+          self._aliases[match.group(2)] = _TypeSpelling(match.group(1))
+          continue
+        match = _RE_PATTERN_USING_ALIAS.search(line)
+        if match:
+          self._aliases[match.group(1)] = _TypeSpelling(match.group(2))
+
+  def _FindDeclarations(self):
+    self._types = {}
+    for line in self._clean_lines.elided:
+      for match in _RE_PATTERN_DECLARED_TYPE.finditer(line):
+        if match.group(1) in _NOT_TYPES:
+          continue
+        end = match.end()
+        if match.group(2):
+          end = _TemplateArgumentsEnd(line, end - 1)
+          if end is None:
+            continue
+        name = _RE_PATTERN_DECLARED_NAME.match(line, end)
+        if name and '*' not in name.group(1):
+          self._Declare(name.group(2),
+                        _TypeSpelling(line[match.start(1):end]))
+
+  def _Declare(self, name, declared_type):
+    if self._types.get(name, declared_type) != declared_type:
+      declared_type = None
+    self._types[name] = declared_type
+
+  def Resolve(self, declared_type):
+    """Returns a type with the typedefs and aliases of the file expanded."""
+    for _ in xrange(8):
+      alias = self._aliases.get(declared_type)
+      if alias is None:
+        break
+      declared_type = alias
+    return declared_type
+
+  def Type(self, name):
+    """Returns the resolved type of a name, or None if it is not known."""
+    if self._types is None:
+      self._FindDeclarations()
+    declared_type = self._types.get(name)
+    return declared_type and self.Resolve(declared_type)
+
+  def NamesPattern(self, kinds):
+    """Returns a regexp matching the names of some kinds of types.
+
+    Args:
+      kinds: A frozenset of kinds of types, e.g. 'std::vector'.
+
+    Returns:
+      A compiled regexp matching the kinds and the aliases for types of
+      those kinds, as whole words.
+    """
+    pattern = self._patterns.get(kinds)
+    if pattern is None:
+      names = set(kinds)
+      names.update(
+          alias for alias in self._aliases
+          if _TemplateArguments(self.Resolve(alias))[0] in kinds)
+      pattern = self._patterns[kinds] = _CompileRegexp(
+          r'\b(?:%s)\b' % '|'.join(re.escape(name) for name in sorted(names)),
+          bundled=False)
+    return pattern
+
+
+def _TypeSpelling(text):
+  """Returns the spelling of a type used by _TypeTable."""
+  return ''.join(_RE_PATTERN_CONST.sub('', text).split())
+
+
+def _TemplateArguments(spelling):
+  """Splits a type spelt by _TypeSpelling into its template and arguments.
+
+  For example, 'SafeMap<int,std::vector<int>>' is split into 'SafeMap' and
+  ['int', 'std::vector<int>'].
+  """
+  start = spelling.find('<')
+  if start < 0 or not spelling.endswith('>'):
+    return spelling, []
+  arguments = []
+  depth = 0
+  begin = start + 1
+  for i in xrange(begin, len(spelling) - 1):
+    char = spelling[i]
+    if char == '<':
+      depth += 1
+    elif char == '>':
+      depth -= 1
+    elif char == ',' and not depth:
+      arguments.append(spelling[begin:i])
+      begin = i + 1
+  arguments.append(spelling[begin:-1])
+  return spelling[:start], arguments
+
+
 def FindEndOfExpressionInLine(line, startpos, depth, startchar, endchar):
   """Find the position just after the matching endchar.
 
@@ -1080,6 +2849,7 @@ def CloseExpression(clean_lines, linenum, pos):
   startchar = line[pos]
   if startchar not in '({[':
     return (line, clean_lines.NumLines(), -1)
+
   if startchar == '(': endchar = ')'
   if startchar == '[': endchar = ']'
   if startchar == '{': endchar = '}'
@@ -1088,19 +2858,17 @@ def CloseExpression(clean_lines, linenum, pos):
   end_pos = FindEndOfExpressionInLine(line, pos, 0, startchar, endchar)
   if end_pos > -1:
     return (line, linenum, end_pos)
-  tail = line[pos:]
-  num_open = tail.count(startchar) - tail.count(endchar)
-  while linenum < clean_lines.NumLines() - 1:
-    linenum += 1
-    line = clean_lines.elided[linenum]
-    delta = line.count(startchar) - line.count(endchar)
-    if num_open + delta <= 0:
-      return (line, linenum,
-              FindEndOfExpressionInLine(line, 0, num_open, startchar, endchar))
-    num_open += delta
+
+  closing = clean_lines.BracketIndex().ClosingPosition(linenum, pos)
+  if closing:
+    end_linenum, end_pos = closing
+    return (clean_lines.elided[end_linenum], end_linenum, end_pos)
 
   # Did not find endchar before end of file, give up
-  return (line, clean_lines.NumLines(), -1)
+  return (clean_lines.elided[-1], clean_lines.NumLines(), -1)
+
+_RE_PATTERN_COPYRIGHT = _Regexp(r'Copyright', re.I)
+
 
 def CheckForCopyright(filename, lines, error):
   """Logs an error if no Copyright message appears at the top of the file."""
@@ -1108,13 +2876,18 @@ def CheckForCopyright(filename, lines, error):
   # We'll say it should occur by line 10. Don't forget there's a
   # dummy line at the front.
   for line in xrange(1, min(len(lines), 11)):
-    if re.search(r'Copyright', lines[line], re.I): break
+    if _RE_PATTERN_COPYRIGHT.search(lines[line]): break
   else:                       # means no copyright line was found
     error(filename, 0, 'legal/copyright', 5,
           'No copyright message found.  '
           'You should have a line: "Copyright [year] <Copyright Owner>"')
 
 
+_RE_PATTERN_FLYMAKE_HEADER = _Regexp(r'_flymake\.h$')
+_RE_PATTERN_FLYMAKE_DIRECTORY = _Regexp(r'/\.flymake/([^/]*)$')
+_RE_PATTERN_CPP_VARIABLE_SEPARATOR = _Regexp(r'[-./\s]')
+
+
 def GetHeaderGuardCPPVariable(filename):
   """Returns the CPP variable that should be used as a header guard.
 
@@ -1129,14 +2902,16 @@ def GetHeaderGuardCPPVariable(filename):
 
   # Restores original filename in case that cpplint is invoked from Emacs's
   # flymake.
-  filename = re.sub(r'_flymake\.h$', '.h', filename)
-  filename = re.sub(r'/\.flymake/([^/]*)$', r'/\1', filename)
+  filename = _RE_PATTERN_FLYMAKE_HEADER.sub('.h', filename)
+  filename = _RE_PATTERN_FLYMAKE_DIRECTORY.sub(r'/\1', filename)
 
   fileinfo = FileInfo(filename)
   file_path_from_root = fileinfo.RepositoryName()
   if _root:
-    file_path_from_root = re.sub('^' + _root + os.sep, '', file_path_from_root)
-  return re.sub(r'[-./\s]', '_', file_path_from_root).upper() + '_'
+    file_path_from_root = _CompileRegexp('^' + _root + os.sep).sub(
+        '', file_path_from_root)
+  return _RE_PATTERN_CPP_VARIABLE_SEPARATOR.sub(
+      '_', file_path_from_root).upper() + '_'
 
 
 def CheckForHeaderGuard(filename, lines, error):
@@ -1335,7 +3110,7 @@ def CheckPosixThreading(filename, clean_lines, linenum, error):
 
 # Matches invalid increment: *count++, which moves pointer instead of
 # incrementing a value.
-_RE_PATTERN_INVALID_INCREMENT = re.compile(
+_RE_PATTERN_INVALID_INCREMENT = _Regexp(
     r'^\s*\*\w+(\+\+|--);')
 
 
@@ -1361,6 +3136,53 @@ def CheckInvalidIncrement(filename, clean_lines, linenum, error):
           'Changing pointer instead of value (or unused value of operator*).')
 
 
+_RE_PATTERN_BLOCK_KEYWORD = _Regexp(r'.*\b(do|else|try)\s*$')
+_RE_PATTERN_CONDITION_KEYWORD = _Regexp(r'.*\b(for|while|if|switch|catch)\s*$')
+
+
+def _BlockStatement(clean_lines, linenum, pos):
+  """Finds the statement that a block is the body of.
+
+  Args:
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line holding the opening brace of the block.
+    pos: The position of the opening brace in the elided line.
+
+  Returns:
+    A tuple (keyword, condition): the keyword of the statement, such as 'for'
+    or 'else', and the text between its parentheses, if any.  The keyword is
+    None for function bodies and other blocks.
+  """
+  elided = clean_lines.elided
+  text = elided[linenum][:pos].rstrip()
+  if not text and linenum:
+    # The brace is on a line of its own.
+    linenum -= 1
+    text = elided[linenum].rstrip()
+  if not text.endswith(')'):
+    match = _RE_PATTERN_BLOCK_KEYWORD.match(text)
+    return (match and match.group(1), '')
+  # Find the parenthesis opening the condition, which may be a few lines up.
+  depth = 0
+  parts = []
+  for linenum in xrange(linenum, max(linenum - 10, -1), -1):
+    if parts:
+      text = elided[linenum]
+    for i in xrange(len(text) - 1, -1, -1):
+      char = text[i]
+      if char == ')':
+        depth += 1
+      elif char == '(':
+        depth -= 1
+        if not depth:
+          parts.append(text[i + 1:])
+          match = _RE_PATTERN_CONDITION_KEYWORD.match(text[:i])
+          condition = ' '.join(reversed(parts))[:-1]
+          return (match and match.group(1), condition)
+    parts.append(text)
+  return (None, '')
+
+
 class _BlockInfo(object):
   """Stores information about a generic block of code."""
 
@@ -1368,6 +3190,10 @@ class _BlockInfo(object):
     self.seen_open_brace = seen_open_brace
     self.open_parentheses = 0
     self.inline_asm = _NO_ASM
+    # The (linenum, pos) of the opening brace of a generic block, and the
+    # statement it is the body of, found by _BlockStatement on first use.
+    self.open_position = None
+    self.statement = None
 
   def CheckBegin(self, filename, clean_lines, linenum, error):
     """Run checks that applies to text up to the opening brace.
@@ -1416,14 +3242,7 @@ class _ClassInfo(_BlockInfo):
     #   } *x = { ...
     #
     # But it's still good enough for CheckSectionSpacing.
-    self.last_line = 0
-    depth = 0
-    for i in range(linenum, clean_lines.NumLines()):
-      line = clean_lines.elided[i]
-      depth += line.count('{') - line.count('}')
-      if not depth:
-        self.last_line = i
-        break
+    self.last_line = clean_lines.BracketIndex().BlockEnd(linenum) or 0
 
   def CheckBegin(self, filename, clean_lines, linenum, error):
     # Look for a bare ':'
@@ -1472,9 +3291,10 @@ class _NamespaceInfo(_BlockInfo):
     # expected namespace.  Example: http://go/ldkdc, http://cl/23548205
     if self.name:
       # Named namespace
-      if not Match((r'};*\s*(//|/\*).*\bnamespace\s+' + re.escape(self.name) +
-                    r'[\*/\.\\\s]*$'),
-                   line):
+      expected = _CompileRegexp(r'};*\s*(//|/\*).*\bnamespace\s+' +
+                                re.escape(self.name) + r'[\*/\.\\\s]*$',
+                                bundled=False)
+      if not expected.match(line):
         error(filename, linenum, 'readability/namespace', 5,
               'Namespace should be terminated with "// namespace %s"' %
               self.name)
@@ -1485,15 +3305,37 @@ class _NamespaceInfo(_BlockInfo):
               'Namespace should be terminated with "// namespace"')
 
 
+class _NestingFrame(object):
+  """A frame of the persistent nesting stack of a _NestingState.
+
+  Frames are never changed once created, so a whole stack is described by its
+  top frame, and saving or restoring a stack only copies a reference.  The
+  block of a frame is only modified in place while it belongs to the current
+  generation of its _NestingState; otherwise it is copied first.
+
+  Attributes:
+    block: The _BlockInfo of this frame.
+    parent: The frame below this one, or None at the bottom of the stack.
+    generation: The generation of the _NestingState that created the frame.
+  """
+
+  __slots__ = ('block', 'parent', 'generation')
+
+  def __init__(self, block, parent, generation):
+    self.block = block
+    self.parent = parent
+    self.generation = generation
+
+
 class _PreprocessorInfo(object):
   """Stores checkpoints of nesting stacks when #if/#else is seen."""
 
   def __init__(self, stack_before_if):
-    # The entire nesting stack before #if
+    # The top _NestingFrame of the nesting stack before #if
     self.stack_before_if = stack_before_if
 
-    # The entire nesting stack up to #else
-    self.stack_before_else = []
+    # The top _NestingFrame of the nesting stack up to #else
+    self.stack_before_else = None
 
     # Whether we have already seen #else or #elif
     self.seen_else = False
@@ -1503,17 +3345,73 @@ class _NestingState(object):
   """Holds states related to parsing braces."""
 
   def __init__(self):
-    # Stack for tracking all braces.  An object is pushed whenever we
-    # see a "{", and popped when we see a "}".  Only 3 types of
-    # objects are possible:
+    # Top _NestingFrame of the stack for tracking all braces, or None if
+    # the stack is empty.  An object is pushed whenever we see a "{", and
+    # popped when we see a "}".  Only 3 types of objects are possible:
     # - _ClassInfo: a class or struct.
     # - _NamespaceInfo: a namespace.
     # - _BlockInfo: some other type of block.
-    self.stack = []
+    self._top = None
+
+    # Incremented whenever the stack is saved or restored, so that a block
+    # shared with a saved stack is copied before it is modified.
+    self._generation = 0
 
     # Stack of _PreprocessorInfo objects.
     self.pp_stack = []
 
+  @property
+  def stack(self):
+    """The blocks of the nesting stack, innermost last, as a new list."""
+    blocks = []
+    frame = self._top
+    while frame:
+      blocks.append(frame.block)
+      frame = frame.parent
+    blocks.reverse()
+    return blocks
+
+  def InnermostBlock(self):
+    """Get the block on the top of the stack.
+
+    Returns:
+      The innermost _BlockInfo, or None if the stack is empty.
+    """
+    if self._top:
+      return self._top.block
+    return None
+
+  def _MutableInnermostBlock(self):
+    """Get the block on the top of the stack for modifying it.
+
+    The block is copied first if it is shared with a saved stack.
+
+    Returns:
+      The innermost _BlockInfo.
+    """
+    frame = self._top
+    if frame.generation != self._generation:
+      frame = _NestingFrame(copy.copy(frame.block), frame.parent,
+                            self._generation)
+      self._top = frame
+    return frame.block
+
+  def _Push(self, block):
+    self._top = _NestingFrame(block, self._top, self._generation)
+
+  def _Pop(self):
+    self._top = self._top.parent
+
+  def _SaveStack(self):
+    """Returns a checkpoint of the stack for _RestoreStack, in O(1)."""
+    self._generation += 1
+    return self._top
+
+  def _RestoreStack(self, checkpoint):
+    """Restores a stack saved by _SaveStack, in O(1)."""
+    self._generation += 1
+    self._top = checkpoint
+
   def SeenOpenBrace(self):
     """Check if we have seen the opening brace for the innermost block.
 
@@ -1521,7 +3419,7 @@ class _NestingState(object):
       True if we have seen the opening brace, False if the innermost
       block is still expecting an opening brace.
     """
-    return (not self.stack) or self.stack[-1].seen_open_brace
+    return (not self._top) or self._top.block.seen_open_brace
 
   def InNamespaceBody(self):
     """Check if we are currently one level inside a namespace body.
@@ -1529,7 +3427,7 @@ class _NestingState(object):
     Returns:
       True if top of the stack is a namespace block, False otherwise.
     """
-    return self.stack and isinstance(self.stack[-1], _NamespaceInfo)
+    return self._top and isinstance(self._top.block, _NamespaceInfo)
 
   def UpdatePreprocessor(self, line):
     """Update preprocessor stack.
@@ -1556,7 +3454,7 @@ class _NestingState(object):
     if Match(r'^\s*#\s*(if|ifdef|ifndef)\b', line):
       # Beginning of #if block, save the nesting stack here.  The saved
       # stack will allow us to restore the parsing state in the #else case.
-      self.pp_stack.append(_PreprocessorInfo(copy.deepcopy(self.stack)))
+      self.pp_stack.append(_PreprocessorInfo(self._SaveStack()))
     elif Match(r'^\s*#\s*(else|elif)\b', line):
       # Beginning of #else block
       if self.pp_stack:
@@ -1565,10 +3463,10 @@ class _NestingState(object):
           # whole nesting stack up to this point.  This is what we
           # keep after the #endif.
           self.pp_stack[-1].seen_else = True
-          self.pp_stack[-1].stack_before_else = copy.deepcopy(self.stack)
+          self.pp_stack[-1].stack_before_else = self._SaveStack()
 
         # Restore the stack to how it was before the #if
-        self.stack = copy.deepcopy(self.pp_stack[-1].stack_before_if)
+        self._RestoreStack(self.pp_stack[-1].stack_before_if)
       else:
         # TODO(unknown): unexpected #else, issue warning?
         pass
@@ -1579,9 +3477,7 @@ class _NestingState(object):
         # stack to its former state before the #else, otherwise we
         # will just continue from where we left off.
         if self.pp_stack[-1].seen_else:
-          # Here we can just use a shallow copy since we are the last
-          # reference to it.
-          self.stack = self.pp_stack[-1].stack_before_else
+          self._RestoreStack(self.pp_stack[-1].stack_before_else)
         # Drop the corresponding #if
         self.pp_stack.pop()
       else:
@@ -1604,8 +3500,8 @@ class _NestingState(object):
 
     # Count parentheses.  This is to avoid adding struct arguments to
     # the nesting stack.
-    if self.stack:
-      inner_block = self.stack[-1]
+    if self._top:
+      inner_block = self._MutableInnermostBlock()
       depth_change = line.count('(') - line.count(')')
       inner_block.open_parentheses += depth_change
 
@@ -1638,7 +3534,7 @@ class _NestingState(object):
         break
 
       new_namespace = _NamespaceInfo(namespace_decl_match.group(1), linenum)
-      self.stack.append(new_namespace)
+      self._Push(new_namespace)
 
       line = namespace_decl_match.group(2)
       if line.find('{') != -1:
@@ -1668,11 +3564,11 @@ class _NestingState(object):
     # To avoid these cases, we ignore classes that are followed by '=' or '>'
     class_decl_match = Match(
         r'\s*(template\s*<[\w\s<>,:]*>\s*)?'
-        '(class|struct)\s+([A-Z_]+\s+)*(\w+(?:::\w+)*)'
+        r'(class|struct)\s+([A-Z_]+\s+)*(\w+(?:::\w+)*)'
         '(([^=>]|<[^<>]*>)*)$', line)
     if (class_decl_match and
-        (not self.stack or self.stack[-1].open_parentheses == 0)):
-      self.stack.append(_ClassInfo(
+        (not self._top or self._top.block.open_parentheses == 0)):
+      self._Push(_ClassInfo(
           class_decl_match.group(4), class_decl_match.group(2),
           clean_lines, linenum))
       line = class_decl_match.group(5)
@@ -1680,13 +3576,14 @@ class _NestingState(object):
     # If we have not yet seen the opening brace for the innermost block,
     # run checks here.
     if not self.SeenOpenBrace():
-      self.stack[-1].CheckBegin(filename, clean_lines, linenum, error)
+      self._MutableInnermostBlock().CheckBegin(filename, clean_lines, linenum,
+                                               error)
 
     # Update access control if we are inside a class/struct
-    if self.stack and isinstance(self.stack[-1], _ClassInfo):
+    if self._top and isinstance(self._top.block, _ClassInfo):
       access_match = Match(r'\s*(public|private|protected)\s*:', line)
       if access_match:
-        self.stack[-1].access = access_match.group(1)
+        self._MutableInnermostBlock().access = access_match.group(1)
 
     # Consume braces or semicolons from what's left of the line
     while True:
@@ -1701,11 +3598,15 @@ class _NestingState(object):
         # namespace/class head as complete.  Push a new block onto the
         # stack otherwise.
         if not self.SeenOpenBrace():
-          self.stack[-1].seen_open_brace = True
+          self._MutableInnermostBlock().seen_open_brace = True
         else:
-          self.stack.append(_BlockInfo(True))
+          block = _BlockInfo(True)
+          block.open_position = (
+              linenum,
+              len(clean_lines.elided[linenum]) - len(line) + matched.start(1))
+          self._Push(block)
           if _MATCH_ASM.match(line):
-            self.stack[-1].inline_asm = _BLOCK_ASM
+            self._top.block.inline_asm = _BLOCK_ASM
       elif token == ';' or token == ')':
         # If we haven't seen an opening brace yet, but we already saw
         # a semicolon, this is probably a forward declaration.  Pop
@@ -1716,24 +3617,46 @@ class _NestingState(object):
         # function arguments with extra "class" or "struct" keywords.
         # Also pop these stack for these.
         if not self.SeenOpenBrace():
-          self.stack.pop()
+          self._Pop()
       else:  # token == '}'
         # Perform end of block checks and pop the stack.
-        if self.stack:
-          self.stack[-1].CheckEnd(filename, clean_lines, linenum, error)
-          self.stack.pop()
+        if self._top:
+          self._top.block.CheckEnd(filename, clean_lines, linenum, error)
+          self._Pop()
       line = matched.group(2)
 
+  def EnclosingStatements(self, clean_lines):
+    """Lists the statements whose bodies hold the current line.
+
+    Args:
+      clean_lines: A CleansedLines instance containing the file.
+
+    Returns:
+      The (keyword, condition) pairs that _BlockStatement finds for the
+      generic blocks of the stack, innermost first.
+    """
+    statements = []
+    frame = self._top
+    while frame:
+      block = frame.block
+      if block.open_position:
+        if block.statement is None:
+          block.statement = _BlockStatement(clean_lines, *block.open_position)
+        statements.append(block.statement)
+      frame = frame.parent
+    return statements
+
   def InnermostClass(self):
     """Get class info on the top of the stack.
 
     Returns:
       A _ClassInfo object if we are inside a class, or None otherwise.
     """
-    for i in range(len(self.stack), 0, -1):
-      classinfo = self.stack[i - 1]
-      if isinstance(classinfo, _ClassInfo):
-        return classinfo
+    frame = self._top
+    while frame:
+      if isinstance(frame.block, _ClassInfo):
+        return frame.block
+      frame = frame.parent
     return None
 
   def CheckClassFinished(self, filename, error):
@@ -1754,35 +3677,15 @@ class _NestingState(object):
               obj.name)
 
 
-def CheckForNonStandardConstructs(filename, clean_lines, linenum,
-                                  nesting_state, error):
-  """Logs an error if we see certain non-ANSI constructs ignored by gcc-2.
-
-  Complain about several constructs which gcc-2 accepts, but which are
-  not standard C++.  Warning about these in lint is one way to ease the
-  transition to new compilers.
-  - put storage class first (e.g. "static const" instead of "const static").
-  - "%lld" instead of %qd" in printf-type functions.
-  - "%1$d" is non-standard in printf-type functions.
-  - "\%" is an undefined character escape sequence.
-  - text after #endif is not allowed.
-  - invalid inner-style forward declaration.
-  - >? and <? operators, and their >?= and <?= cousins.
-
-  Additionally, check for constructor/destructor style violations and reference
-  members, as it is very convenient to do so while checking for
-  gcc-2 compliance.
+def CheckPrintfFormatStrings(filename, clean_lines, linenum, error):
+  """Logs an error for non-standard printf formats and character escapes.
 
   Args:
     filename: The name of the current file.
     clean_lines: A CleansedLines instance containing the file.
     linenum: The number of the line to check.
-    nesting_state: A _NestingState instance which maintains information about
-                   the current stack of nested blocks being parsed.
-    error: A callable to which errors are reported, which takes 4 arguments:
-           filename, line number, error level, and message
+    error: The function to call with any errors found.
   """
-
   # Remove comments from the line, but leave in strings for now.
   line = clean_lines.lines[linenum]
 
@@ -1801,7 +3704,17 @@ def CheckForNonStandardConstructs(filename, clean_lines, linenum,
     error(filename, linenum, 'build/printf_format', 3,
           '%, [, (, and { are undefined character escapes.  Unescape them.')
 
-  # For the rest, work with both comments and strings removed.
+
+def CheckNonStandardDeclarations(filename, clean_lines, linenum, error):
+  """Logs an error for declarations and operators that gcc-2 accepted.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  # Work with both comments and strings removed.
   line = clean_lines.elided[linenum]
 
   if Search(r'\b(const|volatile|void|char|short|int|long'
@@ -1837,7 +3750,21 @@ def CheckForNonStandardConstructs(filename, clean_lines, linenum,
           'const string& members are dangerous. It is much better to use '
           'alternatives, such as pointers or simple constants.')
 
-  # Everything else in this function operates on class declarations.
+
+def CheckExplicitConstructors(filename, clean_lines, linenum, nesting_state,
+                              error):
+  """Logs an error for single-argument constructors not marked explicit.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    nesting_state: A _NestingState instance which maintains information about
+                   the current stack of nested blocks being parsed.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Return early if the top of the nesting stack is not a class, or if
   # the class head is not completed yet.
   classinfo = nesting_state.InnermostClass()
@@ -1850,13 +3777,13 @@ def CheckForNonStandardConstructs(filename, clean_lines, linenum,
 
   # Look for single-argument constructors that aren't marked explicit.
   # Technically a valid construct, but against style.
-  args = Match(r'\s+(?:inline\s+)?%s\s*\(([^,()]+)\)'
-               % re.escape(base_classname),
-               line)
+  name = re.escape(base_classname)
+  args = _CompileRegexp(r'\s+(?:inline\s+)?%s\s*\(([^,()]+)\)' % name,
+                        bundled=False).match(line)
   if (args and
       args.group(1) != 'void' and
-      not Match(r'(const\s+)?%s\s*(?:<\w+>\s*)?&' % re.escape(base_classname),
-                args.group(1).strip())):
+      not _CompileRegexp(r'(const\s+)?%s\s*(?:<\w+>\s*)?&' % name,
+                         bundled=False).match(args.group(1).strip())):
     error(filename, linenum, 'runtime/explicit', 5,
           'Single-argument constructors should be marked explicit.')
 
@@ -1962,6 +3889,11 @@ def CheckForFunctionLengths(filename, clean_lines, linenum,
   of vertical space and comments just to get through a lint check.
   NOLINT *on the last line of a function* disables this check.
 
+  Whether a function start begins a body is decided at the first line from
+  there on with a ';', '{' or '}', as the lines come, so that nothing is
+  read ahead.  Function starts that are never decided are reported by
+  _FunctionState.CheckBodyFound at the end of the file.
+
   Args:
     filename: The name of the current file.
     clean_lines: A CleansedLines instance containing the file.
@@ -1973,7 +3905,6 @@ def CheckForFunctionLengths(filename, clean_lines, linenum,
   line = lines[linenum]
   raw = clean_lines.raw_lines
   raw_line = raw[linenum]
-  joined_line = ''
 
   starting_func = False
   regexp = r'(\w(\w|::|\*|\&|\s)*)\('  # decls * & space::name( ...
@@ -1987,36 +3918,29 @@ def CheckForFunctionLengths(filename, clean_lines, linenum,
       starting_func = True
 
   if starting_func:
-    body_found = False
-    for start_linenum in xrange(linenum, clean_lines.NumLines()):
-      start_line = lines[start_linenum]
-      joined_line += ' ' + start_line.lstrip()
-      if Search(r'(;|})', start_line):  # Declarations and trivial functions
-        body_found = True
-        break                              # ... ignore
-      elif Search(r'{', start_line):
-        body_found = True
-        function = Search(r'((\w|:)*)\(', line).group(1)
-        if Match(r'TEST', function):    # Handle TEST... macros
-          parameter_regexp = Search(r'(\(.*\))', joined_line)
-          if parameter_regexp:             # Ignore bad syntax
-            function += parameter_regexp.group(1)
-        else:
-          function += '()'
-        function_state.Begin(function)
-        break
-    if not body_found:
-      # No body for the function (or evidence of a non-function) was found.
-      error(filename, linenum, 'readability/fn_size', 5,
-            'Lint failed to find start of function body.')
+    function_state.Expect(Search(r'((\w|:)*)\(', line).group(1), linenum)
   elif Match(r'^\}\s*$', line):  # function end
     function_state.Check(error, filename, linenum)
     function_state.End()
   elif not Match(r'^\s*$', line):
     function_state.Count()  # Count non-blank/non-comment lines.
 
+  if function_state.pending_function is not None:
+    function_state.pending_text += ' ' + line.lstrip()
+    if Search(r'(;|})', line):
+      function_state.Forget()  # Declarations and trivial functions are ignored.
+    elif '{' in line:
+      function = function_state.pending_function
+      if Match(r'TEST', function):    # Handle TEST... macros
+        parameter_regexp = Search(r'(\(.*\))', function_state.pending_text)
+        if parameter_regexp:             # Ignore bad syntax
+          function += parameter_regexp.group(1)
+      else:
+        function += '()'
+      function_state.BeginExpected(function)
+
 
-_RE_PATTERN_TODO = re.compile(r'^//(\s*)TODO(\(.+?\))?:?(\s|$)?')
+_RE_PATTERN_TODO = _Regexp(r'^//(\s*)TODO(\(.+?\))?:?(\s|$)?')
 
 
 def CheckComment(comment, filename, linenum, error):
@@ -2066,8 +3990,9 @@ def CheckAccess(filename, clean_lines, linenum, nesting_state, error):
                    r'DISALLOW_IMPLICIT_CONSTRUCTORS)'), line)
   if not matched:
     return
-  if nesting_state.stack and isinstance(nesting_state.stack[-1], _ClassInfo):
-    if nesting_state.stack[-1].access != 'private':
+  block = nesting_state.InnermostBlock()
+  if isinstance(block, _ClassInfo):
+    if block.access != 'private':
       error(filename, linenum, 'readability/constructors', 3,
             '%s must be in the private: section' % matched.group(1))
 
@@ -2090,6 +4015,14 @@ def FindNextMatchingAngleBracket(clean_lines, linenum, init_suffix):
   Returns:
     True if a matching bracket exists.
   """
+  # The answer only depends on the text after the '<', so when the suffix
+  # is the tail of the elided line, a search that runs past the current
+  # line can be answered by the bracket index.  Callers that have edited
+  # the line (e.g. to drop '->') get a scan.
+  line = clean_lines.elided[linenum]
+  pos = len(line) - len(init_suffix) - 1
+  indexed = pos >= 0 and line[pos] == '<' and line.endswith(init_suffix)
+
   line = init_suffix
   nesting_stack = ['<']
   while True:
@@ -2137,6 +4070,9 @@ def FindNextMatchingAngleBracket(clean_lines, linenum, init_suffix):
           nesting_stack.pop()
 
     else:
+      if indexed:
+        return clean_lines.BracketIndex().HasClosingAngleBracket(linenum, pos)
+
       # Scan the next line
       linenum += 1
       if linenum >= len(clean_lines.elided):
@@ -2160,6 +4096,12 @@ def FindPreviousMatchingAngleBracket(clean_lines, linenum, init_prefix):
   Returns:
     True if a matching bracket exists.
   """
+  # See FindNextMatchingAngleBracket.
+  line = clean_lines.elided[linenum]
+  pos = len(init_prefix)
+  indexed = (pos < len(line) and line[pos] == '>' and
+             line.startswith(init_prefix))
+
   line = init_prefix
   nesting_stack = ['>']
   while True:
@@ -2196,6 +4138,9 @@ def FindPreviousMatchingAngleBracket(clean_lines, linenum, init_prefix):
           nesting_stack.pop()
 
     else:
+      if indexed:
+        return clean_lines.BracketIndex().HasOpeningAngleBracket(linenum, pos)
+
       # Scan the previous line
       linenum -= 1
       if linenum < 0:
@@ -2224,8 +4169,52 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
     error: The function to call with any errors found.
   """
 
-  raw = clean_lines.raw_lines
-  line = raw[linenum]
+  CheckBlankLines(filename, clean_lines, linenum, nesting_state, error)
+  CheckCommentSpacing(filename, clean_lines, linenum, error)
+  line = GetSpacingLine(clean_lines, linenum)
+  CheckOperatorSpacing(filename, clean_lines, line, linenum, error)
+  CheckControlParenSpacing(filename, line, linenum, error)
+  CheckCommaSpacing(filename, line, linenum, error)
+  CheckSpacingForFunctionCall(filename, line, linenum, error)
+  CheckBraceSpacing(filename, line, linenum, error)
+  CheckSemicolonSpacing(filename, line, linenum, error)
+
+
+_RE_PATTERN_OPERATOR_METHOD = _Regexp(r'operator(==|!=|<|<<|<=|>=|>>|>)\(')
+
+
+def GetSpacingLine(clean_lines, linenum):
+  """Returns the line that the spacing checks work on.
+
+  This is the line with comments and strings removed, and with the names of
+  operator methods shortened so that they are not taken for operators.
+
+  Args:
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line.
+
+  Returns:
+    The line to check.
+  """
+  line = clean_lines.elided[linenum]  # get rid of comments and strings
+
+  # Don't try to do spacing checks for operator methods
+  return _RE_PATTERN_OPERATOR_METHOD.sub(r'operator\(', line)
+
+
+def CheckBlankLines(filename, clean_lines, linenum, nesting_state, error):
+  """Checks for blank lines at the start or end of a block.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    nesting_state: A _NestingState instance which maintains information about
+                   the current stack of nested blocks being parsed.
+    error: The function to call with any errors found.
+  """
+
+  line = clean_lines.raw_lines[linenum]
 
   # Before nixing comments, check if the line is blank for no good
   # reason.  This includes the first line after a block is opened, and
@@ -2288,7 +4277,7 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
     #     // Something else
     #   }
     if linenum + 1 < clean_lines.NumLines():
-      next_line = raw[linenum + 1]
+      next_line = clean_lines.raw_lines[linenum + 1]
       if (next_line
           and Match(r'\s*}', next_line)
           and next_line.find('} else ') == -1):
@@ -2300,6 +4289,19 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
       error(filename, linenum, 'whitespace/blank_line', 3,
             'Do not leave a blank line after "%s:"' % matched.group(1))
 
+
+def CheckCommentSpacing(filename, clean_lines, linenum, error):
+  """Checks the spacing around // comments.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+
+  line = clean_lines.raw_lines[linenum]
+
   # Next, we complain if there's a comment too near the text
   commentpos = line.find('//')
   if commentpos != -1:
@@ -2333,17 +4335,24 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
                 'Should have a space between // and comment')
       CheckComment(line[commentpos:], filename, linenum, error)
 
-  line = clean_lines.elided[linenum]  # get rid of comments and strings
 
-  # Don't try to do spacing checks for operator methods
-  line = re.sub(r'operator(==|!=|<|<<|<=|>=|>>|>)\(', 'operator\(', line)
+def CheckOperatorSpacing(filename, clean_lines, line, linenum, error):
+  """Checks for missing or extra spaces around operators.
 
-  # We allow no-spaces around = within an if: "if ( (a=Foo()) == 0 )".
-  # Otherwise not.  Note we only check for non-spaces on *both* sides;
-  # sometimes people put non-spaces on one side when aligning ='s among
-  # many lines (not that this is behavior that I approve of...)
-  if Search(r'[\w.]=[\w.]', line) and not Search(r'\b(if|while) ', line):
-    error(filename, linenum, 'whitespace/operators', 4,
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    line: The text of the line to check, as returned by GetSpacingLine.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+
+  # We allow no-spaces around = within an if: "if ( (a=Foo()) == 0 )".
+  # Otherwise not.  Note we only check for non-spaces on *both* sides;
+  # sometimes people put non-spaces on one side when aligning ='s among
+  # many lines (not that this is behavior that I approve of...)
+  if Search(r'[\w.]=[\w.]', line) and not Search(r'\b(if|while) ', line):
+    error(filename, linenum, 'whitespace/operators', 4,
           'Missing spaces around =')
 
   # It's ok not to have spaces around binary operators like + - * /, but if
@@ -2411,6 +4420,17 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
     error(filename, linenum, 'whitespace/operators', 4,
           'Extra space for operator %s' % match.group(1))
 
+
+def CheckControlParenSpacing(filename, line, linenum, error):
+  """Checks the spacing around the parens of if/for/while/switch.
+
+  Args:
+    filename: The name of the current file.
+    line: The text of the line to check, as returned by GetSpacingLine.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+
   # A pet peeve of mine: no spaces after an if, while, switch, or for
   match = Search(r' (if\(|for\(|while\(|switch\()', line)
   if match:
@@ -2437,6 +4457,17 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
             'Should have zero or one spaces inside ( and ) in %s' %
             match.group(1))
 
+
+def CheckCommaSpacing(filename, line, linenum, error):
+  """Checks for missing spaces after commas and semicolons.
+
+  Args:
+    filename: The name of the current file.
+    line: The text of the line to check, as returned by GetSpacingLine.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+
   # You should always have a space after a comma (either as fn arg or operator)
   if Search(r',[^\s]', line):
     error(filename, linenum, 'whitespace/comma', 3,
@@ -2450,8 +4481,16 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
     error(filename, linenum, 'whitespace/semicolon', 3,
           'Missing space after ;')
 
-  # Next we will look for issues with function calls.
-  CheckSpacingForFunctionCall(filename, line, linenum, error)
+
+def CheckBraceSpacing(filename, line, linenum, error):
+  """Checks the spacing around braces and brackets.
+
+  Args:
+    filename: The name of the current file.
+    line: The text of the line to check, as returned by GetSpacingLine.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
 
   # Except after an opening paren, or after another opening brace (in case of
   # an initializer list, for instance), you should have spaces before your
@@ -2472,6 +4511,17 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
     error(filename, linenum, 'whitespace/braces', 5,
           'Extra space before [')
 
+
+def CheckSemicolonSpacing(filename, line, linenum, error):
+  """Checks for empty statements and for spaces before semicolons.
+
+  Args:
+    filename: The name of the current file.
+    line: The text of the line to check, as returned by GetSpacingLine.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+
   # You shouldn't have a space before a semicolon at the end of the line.
   # There's a special case for "for" since the style guide allows space before
   # the semicolon there.
@@ -2490,8 +4540,8 @@ def CheckSpacing(filename, clean_lines, linenum, nesting_state, error):
 
   # In range-based for, we wanted spaces before and after the colon, but
   # not around "::" tokens that might appear.
-  if (Search('for *\(.*[^:]:[^: ]', line) or
-      Search('for *\(.*[^: ]:[^:]', line)):
+  if (Search(r'for *\(.*[^:]:[^: ]', line) or
+      Search(r'for *\(.*[^: ]:[^:]', line)):
     error(filename, linenum, 'whitespace/forcolon', 2,
           'Missing space around colon in range-based for loop')
 
@@ -2777,6 +4827,10 @@ def CheckAltTokens(filename, clean_lines, linenum, error):
               _ALT_TOKEN_REPLACEMENT[match.group(1)], match.group(1)))
 
 
+# Matches a character outside of ASCII.
+_RE_PATTERN_NON_ASCII = _Regexp(u'[^\x00-\x7f]')
+
+
 def GetLineWidth(line):
   """Determines the width of the line in column positions.
 
@@ -2788,6 +4842,9 @@ def GetLineWidth(line):
     combining characters and wide characters.
   """
   if isinstance(line, unicode):
+    if not _RE_PATTERN_NON_ASCII.search(line):
+      # Every ASCII character takes up one column.
+      return len(line)
     width = 0
     for uc in unicodedata.normalize('NFC', line):
       if unicodedata.east_asian_width(uc) in ('W', 'F'):
@@ -2799,23 +4856,21 @@ def GetLineWidth(line):
     return len(line)
 
 
-def CheckStyle(filename, clean_lines, linenum, file_extension, nesting_state,
-               error):
-  """Checks rules from the 'C++ style rules' section of cppguide.html.
-
-  Most of these rules are hard to test (naming, comment style), but we
-  do what we can.  In particular we check for 2-space indents, line lengths,
-  tab usage, spaces inside code, etc.
+def CheckLineFormat(filename, clean_lines, linenum, file_extension, error,
+                    file_context=None):
+  """Checks tabs, indentation, line length and commands per line.
 
   Args:
     filename: The name of the current file.
     clean_lines: A CleansedLines instance containing the file.
     linenum: The number of the line to check.
     file_extension: The extension (without the dot) of the filename.
-    nesting_state: A _NestingState instance which maintains information about
-                   the current stack of nested blocks being parsed.
     error: The function to call with any errors found.
+    file_context: A _FileContext instance with the facts about the current
+                  file, created from filename and file_extension if not given.
   """
+  if file_context is None:
+    file_context = _FileContext(filename, file_extension)
 
   raw_lines = clean_lines.raw_lines
   line = raw_lines[linenum]
@@ -2861,8 +4916,8 @@ def CheckStyle(filename, clean_lines, linenum, file_extension, nesting_state,
 
   # Check if the line is a header guard.
   is_header_guard = False
-  if file_extension == 'h':
-    cppvar = GetHeaderGuardCPPVariable(filename)
+  if file_context.extension == 'h':
+    cppvar = file_context.header_guard
     if (line.startswith('#ifndef %s' % cppvar) or
         line.startswith('#define %s' % cppvar) or
         line.startswith('#endif  // %s' % cppvar)):
@@ -2898,26 +4953,32 @@ def CheckStyle(filename, clean_lines, linenum, file_extension, nesting_state,
     error(filename, linenum, 'whitespace/newline', 0,
           'More than one command on the same line')
 
-  # Some more style checks
-  CheckBraces(filename, clean_lines, linenum, error)
-  CheckEmptyLoopBody(filename, clean_lines, linenum, error)
-  CheckAccess(filename, clean_lines, linenum, nesting_state, error)
-  CheckSpacing(filename, clean_lines, linenum, nesting_state, error)
-  CheckCheck(filename, clean_lines, linenum, error)
-  CheckAltTokens(filename, clean_lines, linenum, error)
+
+def CheckClassSectionSpacing(filename, clean_lines, linenum, nesting_state,
+                             error):
+  """Checks section spacing if the line is inside a class declaration.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    nesting_state: A _NestingState instance which maintains information about
+                   the current stack of nested blocks being parsed.
+    error: The function to call with any errors found.
+  """
   classinfo = nesting_state.InnermostClass()
   if classinfo:
     CheckSectionSpacing(filename, clean_lines, classinfo, linenum, error)
 
 
-_RE_PATTERN_INCLUDE_NEW_STYLE = re.compile(r'#include +"[^/]+\.h"')
-_RE_PATTERN_INCLUDE = re.compile(r'^\s*#\s*include\s*([<"])([^>"]*)[>"].*$')
+_RE_PATTERN_INCLUDE_NEW_STYLE = _Regexp(r'#include +"[^/]+\.h"')
+_RE_PATTERN_INCLUDE = _Regexp(r'^\s*#\s*include\s*([<"])([^>"]*)[>"].*$')
 # Matches the first component of a filename delimited by -s and _s. That is:
 #  _RE_FIRST_COMPONENT.match('foo').group(0) == 'foo'
 #  _RE_FIRST_COMPONENT.match('foo.cc').group(0) == 'foo'
 #  _RE_FIRST_COMPONENT.match('foo-bar_baz.cc').group(0) == 'foo'
 #  _RE_FIRST_COMPONENT.match('foo_bar-baz.cc').group(0) == 'foo'
-_RE_FIRST_COMPONENT = re.compile(r'^[^-_.]+')
+_RE_FIRST_COMPONENT = _Regexp(r'^[^-_.]+')
 
 
 def _DropCommonSuffixes(filename):
@@ -3025,12 +5086,13 @@ def _ClassifyInclude(fileinfo, include, is_system):
 
 
 
-def CheckIncludeLine(filename, clean_lines, linenum, include_state, error):
+def CheckIncludeLine(filename, clean_lines, linenum, include_state, error,
+                     file_context=None):
   """Check rules that are applicable to #include lines.
 
   Strings on #include lines are NOT removed from elided line, to make
   certain tasks easier. However, to prevent false positives, checks
-  applicable to #include lines in CheckLanguage must be put here.
+  of the language rules applicable to #include lines must be put here.
 
   Args:
     filename: The name of the current file.
@@ -3038,8 +5100,12 @@ def CheckIncludeLine(filename, clean_lines, linenum, include_state, error):
     linenum: The number of the line to check.
     include_state: An _IncludeState instance in which the headers are inserted.
     error: The function to call with any errors found.
+    file_context: A _FileContext instance with the facts about the current
+                  file, created from filename if not given.
   """
-  fileinfo = FileInfo(filename)
+  if file_context is None:
+    file_context = _FileContext(filename, FileInfo(filename).Extension()[1:])
+  fileinfo = file_context.file_info
 
   line = clean_lines.lines[linenum]
 
@@ -3089,13 +5155,13 @@ def CheckIncludeLine(filename, clean_lines, linenum, include_state, error):
     include = match.group(2)
     if Match(r'(f|ind|io|i|o|parse|pf|stdio|str|)?stream$', include):
       # Many unit tests use cout, so we exempt them.
-      if not _IsTestFilename(filename):
+      if not file_context.is_test:
         error(filename, linenum, 'readability/streams', 3,
               'Streams are highly discouraged.')
 
 
 def _GetTextInside(text, start_pattern):
-  """Retrieves all the text between matching open and close parentheses.
+  r"""Retrieves all the text between matching open and close parentheses.
 
   Given a string of lines and a regular expression string, retrieve all the text
   following the expression and between opening punctuation symbols like
@@ -3119,10 +5185,10 @@ def _GetTextInside(text, start_pattern):
 
   # Give opening punctuations to get the matching close-punctuations.
   matching_punctuation = {'(': ')', '{': '}', '[': ']'}
-  closing_punctuation = set(matching_punctuation.itervalues())
+  closing_punctuation = set(itervalues(matching_punctuation))
 
   # Find the position to start extracting text.
-  match = re.search(start_pattern, text, re.M)
+  match = _CompileRegexp(start_pattern, re.M).search(text)
   if not match:  # start_pattern not found in text.
     return None
   start_position = match.end(0)
@@ -3150,44 +5216,26 @@ def _GetTextInside(text, start_pattern):
   return text[start_position:position - 1]
 
 
-def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
-                  error):
-  """Checks rules from the 'C++ language rules' section of cppguide.html.
+# Parameters passed by reference, and those among them that are const.
+_RE_PATTERN_REFERENCE_PARAMETER = _Regexp(
+    r'\([^()]*\b(?:[\w:]|<[^()]*>)+(\s?&|&\s?)\w+')
+_RE_PATTERN_CONST_FIRST_REFERENCE_PARAMETER = _Regexp(
+    r'\([^()]*\bconst\s+(?:typename\s+)?(?:struct\s+)?'
+    r'(?:[\w:]|<[^()]*>)+(\s?&|&\s?)\w+')
+_RE_PATTERN_CONST_LAST_REFERENCE_PARAMETER = _Regexp(
+    r'\([^()]*\b(?:[\w:]|<[^()]*>)+\s+const(\s?&|&\s?)[\w]+')
+
 
-  Some of these rules are hard to test (function overloading, using
-  uint32 inappropriately), but we do the best we can.
+def CheckNonConstReferences(filename, clean_lines, linenum, error):
+  """Checks for non-const references in function parameters.
 
   Args:
     filename: The name of the current file.
     clean_lines: A CleansedLines instance containing the file.
     linenum: The number of the line to check.
-    file_extension: The extension (without the dot) of the filename.
-    include_state: An _IncludeState instance in which the headers are inserted.
     error: The function to call with any errors found.
   """
-  # If the line is empty or consists of entirely a comment, no need to
-  # check it.
   line = clean_lines.elided[linenum]
-  if not line:
-    return
-
-  match = _RE_PATTERN_INCLUDE.search(line)
-  if match:
-    CheckIncludeLine(filename, clean_lines, linenum, include_state, error)
-    return
-
-  # Create an extended_line, which is the concatenation of the current and
-  # next lines, for more effective checking of code that may span more than one
-  # line.
-  if linenum + 1 < clean_lines.NumLines():
-    extended_line = line + clean_lines.elided[linenum + 1]
-  else:
-    extended_line = line
-
-  # Make Windows paths like Unix.
-  fullname = os.path.abspath(filename).replace('\\', '/')
-
-  # TODO(unknown): figure out if they're using default arguments in fn proto.
 
   # Check for non-const references in functions.  This is tricky because &
   # is also used to take the address of something.  We allow <> for templates,
@@ -3197,11 +5245,9 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
   # version, we're willing for const to be before typename or after
   # Don't check the implementation on same line.
   fnline = line.split('{', 1)[0]
-  if (len(re.findall(r'\([^()]*\b(?:[\w:]|<[^()]*>)+(\s?&|&\s?)\w+', fnline)) >
-      len(re.findall(r'\([^()]*\bconst\s+(?:typename\s+)?(?:struct\s+)?'
-                     r'(?:[\w:]|<[^()]*>)+(\s?&|&\s?)\w+', fnline)) +
-      len(re.findall(r'\([^()]*\b(?:[\w:]|<[^()]*>)+\s+const(\s?&|&\s?)[\w]+',
-                     fnline))):
+  if (len(_RE_PATTERN_REFERENCE_PARAMETER.findall(fnline)) >
+      len(_RE_PATTERN_CONST_FIRST_REFERENCE_PARAMETER.findall(fnline)) +
+      len(_RE_PATTERN_CONST_LAST_REFERENCE_PARAMETER.findall(fnline))):
 
     # We allow non-const references in a few standard places, like functions
     # called "swap()" or iostream operators like "<<" or ">>". We also filter
@@ -3214,6 +5260,18 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
             'Is this a non-const reference? '
             'If so, make const or use a pointer.')
 
+
+def CheckCasts(filename, clean_lines, linenum, error):
+  """Checks for C-style and function-style casts.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Check to see if they're using an conversion function cast.
   # I just try to capture the most common basic types, though there are more.
   # Parameterless conversion functions, such as bool(), are allowed as they are
@@ -3270,6 +5328,18 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
            'This is dangerous: could be a temp var.  '
            'Take the address before doing the cast, rather than after'))
 
+
+def CheckGlobalStrings(filename, clean_lines, linenum, error):
+  """Checks for static or global STL strings.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Check for people declaring static/global STL strings at the top level.
   # This is dangerous because the C++ language does not guarantee that
   # globals with constructors are initialized before the first access.
@@ -3286,24 +5356,54 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
           '"%schar %s[]".' %
           (match.group(1), match.group(2)))
 
+
+def CheckRtti(filename, clean_lines, linenum, file_context, error):
+  """Checks that RTTI is not used outside of testing code.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    file_context: A _FileContext instance with the facts about the current
+                  file.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Check that we're not using RTTI outside of testing code.
-  if Search(r'\bdynamic_cast<', line) and not _IsTestFilename(filename):
+  if Search(r'\bdynamic_cast<', line) and not file_context.is_test:
     error(filename, linenum, 'runtime/rtti', 5,
           'Do not use dynamic_cast<>.  If you need to cast within a class '
           "hierarchy, use static_cast<> to upcast.  Google doesn't support "
           'RTTI.')
 
+
+def CheckSelfInitialization(filename, clean_lines, linenum, error):
+  """Checks for member variables initialized with themselves.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   if Search(r'\b([A-Za-z0-9_]*_)\(\1\)', line):
     error(filename, linenum, 'runtime/init', 4,
           'You seem to be initializing a member variable with itself.')
 
-  if file_extension == 'h':
-    # TODO(unknown): check that 1-arg constructors are explicit.
-    #                How to tell it's a constructor?
-    #                (handled in CheckForNonStandardConstructs for now)
-    # TODO(unknown): check that classes have DISALLOW_EVIL_CONSTRUCTORS
-    #                (level 1 error)
-    pass
+
+def CheckIntegerTypes(filename, clean_lines, linenum, error):
+  """Checks for the C integer types that have a fixed-width replacement.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
 
   # Check if people are using the verboten C basic types.  The only exception
   # we regularly allow is "unsigned short port" for port.
@@ -3317,6 +5417,18 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
       error(filename, linenum, 'runtime/int', 4,
             'Use int16/int64/etc, rather than the C type %s' % match.group(1))
 
+
+def CheckUnsafeFunctions(filename, clean_lines, linenum, error):
+  """Checks for calls to the unsafe string functions of the C library.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # When snprintf is used, the second argument shouldn't be a literal.
   match = Search(r'snprintf\s*\(([^,]*),\s*([0-9]*)\s*,', line)
   if match and match.group(2) != '0':
@@ -3338,6 +5450,18 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
     error(filename, linenum, 'runtime/printf', 1,
           'sscanf can be ok, but is slow and can overflow buffers.')
 
+
+def CheckUnaryOperatorAmpersand(filename, clean_lines, linenum, error):
+  """Checks for overloads of the unary operator&.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Check if some verboten operator overloading is going on
   # TODO(unknown): catch out-of-line unary operator&:
   #   class X {};
@@ -3348,12 +5472,39 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
     error(filename, linenum, 'runtime/operator', 4,
           'Unary operator& is dangerous.  Do not use it.')
 
+
+def CheckIfAfterBrace(filename, clean_lines, linenum, error):
+  """Checks for an "if" that follows a closing brace.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Check for suspicious usage of "if" like
   # } if (a == b) {
   if Search(r'\}\s*if\s*\(', line):
     error(filename, linenum, 'readability/braces', 4,
           'Did you mean "else if"? If not, start a new line for "if".')
 
+
+_RE_PATTERN_PRINTF_NAME = _Regexp(r'\b((?:string)?printf)\s*\(', re.I)
+
+
+def CheckPrintfFormatArgument(filename, clean_lines, linenum, error):
+  """Checks for printf calls whose format is not a literal.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Check for potential format string bugs like printf(foo).
   # We constrain the pattern not to pick things like DocidForPrintf(foo).
   # Not perfect but it can catch printf(foo.c_str()) and printf(foo->c_str())
@@ -3365,12 +5516,23 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
   if printf_args:
     match = Match(r'([\w.\->()]+)$', printf_args)
     if match and match.group(1) != '__VA_ARGS__':
-      function_name = re.search(r'\b((?:string)?printf)\s*\(',
-                                line, re.I).group(1)
+      function_name = _RE_PATTERN_PRINTF_NAME.search(line).group(1)
       error(filename, linenum, 'runtime/printf', 4,
             'Potential format string bug. Do %s("%%s", %s) instead.'
             % (function_name, match.group(1)))
 
+
+def CheckMemsetArguments(filename, clean_lines, linenum, error):
+  """Checks for memset calls with swapped arguments.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Check for potential memset bugs like memset(buf, sizeof(buf), 0).
   match = Search(r'memset\s*\(([^,]*),\s*([^,]*),\s*0\s*\)', line)
   if match and not Match(r"^''|-?[0-9]+|0x[0-9A-Fa-f]$", match.group(2)):
@@ -3378,11 +5540,38 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
           'Did you mean "memset(%s, 0, %s)"?'
           % (match.group(1), match.group(2)))
 
+
+def CheckUsingDirectives(filename, clean_lines, linenum, error):
+  """Checks for namespace using-directives.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   if Search(r'\busing namespace\b', line):
     error(filename, linenum, 'build/namespaces', 5,
           'Do not use namespace using-directives.  '
           'Use using-declarations instead.')
 
+
+_RE_PATTERN_ARRAY_SIZE_DELIMITER = _Regexp(r'\s|\+|\-|\*|\/|<<|>>]')
+
+
+def CheckVariableLengthArrays(filename, clean_lines, linenum, error):
+  """Checks for variable-length arrays.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Detect variable-length arrays.
   match = Match(r'\s*(.+::)?(\w+) [a-z]\w*\[(.+)];', line)
   if (match and match.group(2) != 'return' and match.group(2) != 'delete' and
@@ -3390,7 +5579,7 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
     # Split the size using space and arithmetic operators as delimiters.
     # If any of the resulting tokens are not compile time constants then
     # report the error.
-    tokens = re.split(r'\s|\+|\-|\*|\/|<<|>>]', match.group(3))
+    tokens = _RE_PATTERN_ARRAY_SIZE_DELIMITER.split(match.group(3))
     is_const = True
     skip_next = False
     for tok in tokens:
@@ -3422,6 +5611,18 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
             'Do not use variable-length arrays.  Use an appropriately named '
             "('k' followed by CamelCase) compile-time constant for the size.")
 
+
+def CheckDisallowMacroPosition(filename, clean_lines, linenum, error):
+  """Checks that DISALLOW_* macros end the class declaration.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # If DISALLOW_EVIL_CONSTRUCTORS, DISALLOW_COPY_AND_ASSIGN, or
   # DISALLOW_IMPLICIT_CONSTRUCTORS is present, then it should be the last thing
   # in the class declaration.
@@ -3442,6 +5643,20 @@ def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
       error(filename, linenum, 'readability/constructors', 3,
             match.group(1) + ' should be the last thing in the class')
 
+
+def CheckUnnamedNamespaces(filename, clean_lines, linenum, file_extension,
+                           error):
+  """Checks for unnamed namespaces in header files.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    file_extension: The extension (without the dot) of the filename.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+
   # Check for use of unnamed namespaces in header files.  Registration
   # macros are typically OK, so we allow use of "namespace {" on lines
   # that end with backslashes.
@@ -3559,7 +5774,7 @@ _HEADERS_CONTAINING_TEMPLATES = (
     ('<slist>', ('slist',)),
     )
 
-_RE_PATTERN_STRING = re.compile(r'\bstring\b')
+_RE_PATTERN_STRING = _Regexp(r'\bstring\b')
 
 _re_pattern_algorithm_header = []
 for _template in ('copy', 'max', 'min', 'min_element', 'sort', 'swap',
@@ -3567,7 +5782,7 @@ for _template in ('copy', 'max', 'min', 'min_element', 'sort', 'swap',
   # Match max<type>(..., ...), max(..., ...), but not foo->max, foo.max or
   # type::max().
   _re_pattern_algorithm_header.append(
-      (re.compile(r'[^>.]\b' + _template + r'(<.*?>)?\([^\)]'),
+      (_Regexp(r'[^>.]\b' + _template + r'(<.*?>)?\([^\)]'),
        _template,
        '<algorithm>'))
 
@@ -3575,7 +5790,7 @@ _re_pattern_templates = []
 for _header, _templates in _HEADERS_CONTAINING_TEMPLATES:
   for _template in _templates:
     _re_pattern_templates.append(
-        (re.compile(r'(\<|\b)' + _template + r'\s*\<'),
+        (_Regexp(r'(\<|\b)' + _template + r'\s*\<'),
          _template + '<>',
          _header))
 
@@ -3635,6 +5850,48 @@ def FilesBelongToSameModule(filename_cc, filename_h):
   return files_belong_to_same_module, common_path
 
 
+# Maps the path of each header read by UpdateIncludeState to its modification
+# time and its includes, so that a header shared by several files is only
+# parsed once per process, see _ReadHeaderIncludes.
+_header_includes = {}
+
+
+def _ReadHeaderIncludes(filename, io):
+  """Finds the files that a header includes.
+
+  Headers read from disk are cached in _header_includes until they change.
+
+  Args:
+    filename: the name of the header to read.
+    io: The io factory to use to read the file.
+
+  Returns:
+    A list of (include, linenum) tuples, or None if the file can't be read.
+  """
+  mtime = None
+  if io is codecs:
+    try:
+      mtime = os.path.getmtime(filename)
+    except OSError:
+      return None
+    cached = _header_includes.get(filename)
+    if cached and cached[0] == mtime:
+      return cached[1]
+
+  try:
+    headerfile = io.open(filename, 'r', 'utf8', 'replace')
+  except IOError:
+    return None
+  try:
+    includes = _FindIncludes(headerfile)
+  finally:
+    headerfile.close()
+
+  if mtime is not None:
+    _header_includes[filename] = (mtime, includes)
+  return includes
+
+
 def UpdateIncludeState(filename, include_state, io=codecs):
   """Fill up the include_state with new includes found from the file.
 
@@ -3646,30 +5903,69 @@ def UpdateIncludeState(filename, include_state, io=codecs):
   Returns:
     True if a header was succesfully added. False otherwise.
   """
-  headerfile = None
-  try:
-    headerfile = io.open(filename, 'r', 'utf8', 'replace')
-  except IOError:
+  record = None
+  if _symbol_index and io is codecs:
+    record = _symbol_index.Record(filename)
+  if record:
+    # The header is indexed, so it need not be read.
+    _file_lint_state.dependencies[filename] = _symbol_index.Digest(filename)
+    includes = record['includes']
+  else:
+    _file_lint_state.AddDependency(filename)
+    includes = _ReadHeaderIncludes(filename, io)
+  if includes is None:
     return False
-  linenum = 0
-  for line in headerfile:
-    linenum += 1
-    clean_line = CleanseComments(line)
-    match = _RE_PATTERN_INCLUDE.search(clean_line)
-    if match:
-      include = match.group(2)
-      # The value formatting is cute, but not really used right now.
-      # What matters here is that the key is in include_state.
-      include_state.setdefault(include, '%s:%d' % (filename, linenum))
+  for include, linenum in includes:
+    # The value formatting is cute, but not really used right now.
+    # What matters here is that the key is in include_state.
+    include_state.setdefault(include, '%s:%d' % (filename, linenum))
   return True
 
 
-def CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error,
-                              io=codecs):
-  """Reports for missing stl includes.
+def _RequiredHeaders(line):
+  """Finds the headers required by the STL names used on a line.
 
-  This function will output warnings to make sure you are including the headers
-  necessary for the stl containers and functions that you use. We only give one
+  Args:
+    line: An elided line.
+
+  Returns:
+    A tuple of (header, template entity) pairs, in the order in which they
+    were found.
+  """
+  if not line or line[0] == '#':
+    return ()
+  required = []
+
+  # String is special -- it is a non-templatized type in STL.
+  matched = _RE_PATTERN_STRING.search(line)
+  if matched:
+    # Don't warn about strings in non-STL namespaces:
+    # (We check only the first match per line; good enough.)
+    prefix = line[:matched.start()]
+    if prefix.endswith('std::') or not prefix.endswith('::'):
+      required.append(('<string>', 'string'))
+
+  for pattern, template, header in _re_pattern_algorithm_header:
+    if pattern.search(line):
+      required.append((header, template))
+
+  # The following function is just a speed up, no semantics are changed.
+  if '<' in line:  # Reduces the cpu time usage by skipping lines.
+    for pattern, template, header in _re_pattern_templates:
+      if pattern.search(line):
+        required.append((header, template))
+  return tuple(required)
+
+
+_RE_PATTERN_FLYMAKE_SOURCE = _Regexp(r'_flymake\.cc$')
+
+
+def CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error,
+                              io=codecs, line_requirements=None):
+  """Reports for missing stl includes.
+
+  This function will output warnings to make sure you are including the headers
+  necessary for the stl containers and functions that you use. We only give one
   reason to include a header. For example, if you use both equal_to<> and
   less<> in a .h file, only one (the latter in the file) of these will be
   reported as a reason to include the <functional>.
@@ -3681,35 +5977,21 @@ def CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error,
     error: The function to call with any errors found.
     io: The IO factory to use to read the header file. Provided for unittest
         injection.
+    line_requirements: A dict from elided lines to their _RequiredHeaders,
+        used and filled in by repeated calls on versions of the same file.
   """
   required = {}  # A map of header name to linenumber and the template entity.
                  # Example of required: { '<functional>': (1219, 'less<>') }
 
-  for linenum in xrange(clean_lines.NumLines()):
-    line = clean_lines.elided[linenum]
-    if not line or line[0] == '#':
-      continue
-
-    # String is special -- it is a non-templatized type in STL.
-    matched = _RE_PATTERN_STRING.search(line)
-    if matched:
-      # Don't warn about strings in non-STL namespaces:
-      # (We check only the first match per line; good enough.)
-      prefix = line[:matched.start()]
-      if prefix.endswith('std::') or not prefix.endswith('::'):
-        required['<string>'] = (linenum, 'string')
-
-    for pattern, template, header in _re_pattern_algorithm_header:
-      if pattern.search(line):
-        required[header] = (linenum, template)
-
-    # The following function is just a speed up, no semantics are changed.
-    if not '<' in line:  # Reduces the cpu time usage by skipping lines.
-      continue
-
-    for pattern, template, header in _re_pattern_templates:
-      if pattern.search(line):
-        required[header] = (linenum, template)
+  for linenum, line in enumerate(clean_lines.elided):
+    if line_requirements is None:
+      headers = _RequiredHeaders(line)
+    else:
+      headers = line_requirements.get(line)
+      if headers is None:
+        headers = line_requirements[line] = _RequiredHeaders(line)
+    for header, template in headers:
+      required[header] = (linenum, template)
 
   # The policy is that if you #include something in foo.h you don't need to
   # include it again in foo.cc. Here, we will look at possible includes.
@@ -3729,11 +6011,11 @@ def CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error,
   # found.
   # e.g. If the file name is 'foo_flymake.cc', we should search for 'foo.h'
   # instead of 'foo_flymake.h'
-  abs_filename = re.sub(r'_flymake\.cc$', '.cc', abs_filename)
+  abs_filename = _RE_PATTERN_FLYMAKE_SOURCE.sub('.cc', abs_filename)
 
   # include_state is modified during iteration, so we iterate over a copy of
   # the keys.
-  header_keys = include_state.keys()
+  header_keys = list(include_state.keys())
   for header in header_keys:
     (same_module, common_path) = FilesBelongToSameModule(abs_filename, header)
     fullpath = common_path + header
@@ -3748,8 +6030,11 @@ def CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error,
   if filename.endswith('.cc') and not header_found:
     return
 
-  # All the lines have been processed, report the errors found.
-  for required_header_unstripped in required:
+  # All the lines have been processed, report the errors found, in the order
+  # of their lines rather than in that of the dict, which depends on the
+  # version of Python.
+  for required_header_unstripped in sorted(
+      required, key=lambda header: (required[header][0], header)):
     template = required[required_header_unstripped][1]
     if required_header_unstripped.strip('<>"') not in include_state:
       error(filename, required[required_header_unstripped][0],
@@ -3757,7 +6042,39 @@ def CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error,
             'Add #include ' + required_header_unstripped + ' for ' + template)
 
 
-_RE_PATTERN_EXPLICIT_MAKEPAIR = re.compile(r'\bmake_pair\s*<')
+def CheckAgainstSymbolIndex(filename, file_extension, error):
+  """Checks a file against the other files of the --index.
+
+  Reports header guards used by more than one header, and functions declared
+  in a header but not defined in any indexed file.
+
+  Args:
+    filename: The name of the current file.
+    file_extension: The extension (dot not included) of the file.
+    error: The function to call with any errors found.
+  """
+  record = _symbol_index.Record(filename)
+  if not record or file_extension != 'h':
+    return
+
+  if record['guard'] and _cpplint_state.PassesFilters('build/header_guard'):
+    guard, linenum = record['guard']
+    path = os.path.abspath(filename)
+    for other in _symbol_index.GuardUsers(guard):
+      if other != path:
+        error(filename, linenum, 'build/header_guard', 5,
+              'Header guard %s is also used by %s' %
+              (guard, os.path.relpath(other)))
+        break
+
+  if _cpplint_state.PassesFilters('build/undefined_function'):
+    for name, linenum in record['declarations']:
+      if not _symbol_index.IsDefined(name):
+        error(filename, linenum, 'build/undefined_function', 2,
+              '%s is declared but not defined in any indexed file' % name)
+
+
+_RE_PATTERN_EXPLICIT_MAKEPAIR = _Regexp(r'\bmake_pair\s*<')
 
 
 def CheckMakePairUsesDeduction(filename, clean_lines, linenum, error):
@@ -3782,9 +6099,517 @@ def CheckMakePairUsesDeduction(filename, clean_lines, linenum, error):
           ' OR use pair directly OR if appropriate, construct a pair directly')
 
 
+# Matches the identifiers, keywords and numbers of a line.
+_RE_PATTERN_WORD = _Regexp(r'\w+')
+
+
+# ART logging.  VLOG only evaluates its message if VLOG_IS_ON, but the calls
+# that build strings for it before it, or for VLOG_STREAM, are always made.
+_EXPENSIVE_LOG_ARGUMENTS = frozenset([
+    'PrettyClass', 'PrettyDescriptor', 'PrettyField', 'PrettyMethod',
+    'PrettyTypeOf', 'StringPrintf', 'ostringstream'])
+
+# The directories where logging costs are reported, with the calls that are
+# too expensive to make for a message that may not be logged.
+_LOGGING_COST_DIRECTORIES = {
+    'compiler/': _EXPENSIVE_LOG_ARGUMENTS,
+    'runtime/': _EXPENSIVE_LOG_ARGUMENTS,
+    }
+
+_RE_PATTERN_LOG_STRING_DECLARATION = _Regexp(
+    r'^\s*(?:std::string|std::ostringstream)\s+([a-z_]\w*)\s*[;=(]')
+# The header of a statement whose body has no braces, on a line of its own.
+_RE_PATTERN_CONTROL_HEADER = _Regexp(
+    r'^\s*(?:else\s+)?(if|for|while)\s*\((.*)\)\s*$')
+
+
+def _StatementStart(clean_lines, linenum):
+  """Returns the first line of the statement that linenum is part of."""
+  elided = clean_lines.elided
+  start = linenum
+  while start > max(linenum - 10, 0):
+    previous = elided[start - 1].rstrip()
+    if (not previous or previous[-1] in ';{}' or previous.startswith('#') or
+        _RE_PATTERN_CONTROL_HEADER.match(previous)):
+      break
+    start -= 1
+  return start
+
+
+def _LoggingContext(clean_lines, linenum, nesting_state):
+  """Finds out whether a line is guarded by VLOG_IS_ON and is in a loop.
+
+  Args:
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line.
+    nesting_state: A _NestingState instance, updated up to the line.
+
+  Returns:
+    A tuple of whether an enclosing if tests VLOG_IS_ON, and whether the line
+    is in the body of a loop.  The statements without braces just before the
+    line count too.
+  """
+  statements = nesting_state.EnclosingStatements(clean_lines)
+  start = _StatementStart(clean_lines, linenum)
+  while start:
+    header = _RE_PATTERN_CONTROL_HEADER.match(clean_lines.elided[start - 1])
+    if not header:
+      break
+    statements.append(header.groups())
+    start -= 1
+  guarded = in_loop = False
+  for keyword, condition in statements:
+    if keyword == 'if' and 'VLOG_IS_ON' in condition:
+      guarded = True
+    elif keyword in ('for', 'while', 'do'):
+      in_loop = True
+  return guarded, in_loop
+
+
+def _IsOnlyLogged(clean_lines, linenum, name):
+  """Returns whether a variable is only used in VLOG statements.
+
+  Args:
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line declaring the variable.
+    name: The name of the variable.
+
+  Returns:
+    True if the variable is used before the end of the enclosing block, and
+    all of its uses are in statements starting with VLOG.
+  """
+  elided = clean_lines.elided
+  used = False
+  depth = 0
+  pattern = _CompileRegexp(r'\b%s\b' % name, bundled=False)
+  for i in xrange(linenum + 1, min(linenum + 200, len(elided))):
+    line = elided[i]
+    if pattern.search(line):
+      statement = elided[_StatementStart(clean_lines, i)]
+      if 'VLOG(' not in statement and 'VLOG_STREAM(' not in statement:
+        return False
+      used = True
+    depth += line.count('{') - line.count('}')
+    if depth < 0:
+      break
+  return used
+
+
+def CheckLoggingCost(filename, clean_lines, linenum, nesting_state, error):
+  """Checks for logging that costs time even when nothing is logged.
+
+  In the directories of _LOGGING_COST_DIRECTORIES, this reports strings built
+  with expensive calls only to be logged with VLOG, and expensive calls in
+  VLOG_STREAM messages, unless they are guarded by VLOG_IS_ON.  It also
+  reports std::endl, which flushes the stream.  The messages tell whether
+  the site is in a loop.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    nesting_state: A _NestingState instance which maintains information about
+                   the current stack of nested blocks being parsed.
+    error: The function to call with any errors found.
+  """
+  expensive = _DirectoryEntry(filename, _LOGGING_COST_DIRECTORIES)
+  if expensive is None or _IsArtTestFilename(filename):
+    return
+  line = clean_lines.elided[linenum]
+
+  if 'std::endl' in line:
+    in_loop = _LoggingContext(clean_lines, linenum, nesting_state)[1]
+    error(filename, linenum, 'runtime/endl', 3,
+          'std::endl flushes the stream%s; use "\\n" instead.'
+          % (' on every iteration of the loop' if in_loop else ''))
+
+  if 'VLOG_STREAM' in line:
+    statement = line
+    end = linenum
+    while ';' not in statement and end + 1 < min(linenum + 10,
+                                                  clean_lines.NumLines()):
+      end += 1
+      statement += clean_lines.elided[end]
+    calls = sorted(expensive.intersection(_RE_PATTERN_WORD.findall(statement)))
+  else:
+    match = _RE_PATTERN_LOG_STRING_DECLARATION.match(line)
+    calls = match and sorted(
+        expensive.intersection(_RE_PATTERN_WORD.findall(line)))
+    if calls and not _IsOnlyLogged(clean_lines, linenum, match.group(1)):
+      calls = None
+  if calls:
+    guarded, in_loop = _LoggingContext(clean_lines, linenum, nesting_state)
+    if not guarded:
+      error(filename, linenum, 'runtime/logging', 3,
+            '%s is called for a VLOG message even when verbose logging is '
+            'off%s; guard it with if (VLOG_IS_ON(...)).'
+            % (' and '.join(calls),
+               ', on every iteration of the loop' if in_loop else ''))
+
+
+class _LineScan(object):
+  """The views of a line that the line checks are triggered on.
+
+  ProcessLine builds one _LineScan per line, so that the line is split into
+  words once and each check in _LINE_CHECKS is gated by plain substring and
+  set membership tests instead of running its regular expressions.
+
+  Attributes:
+    views: Maps the name of a view to its text: 'raw' and 'lines' are the raw
+      line and the line without comments, 'elided' is the line without
+      comments and strings, 'code' and 'include' are the elided line if it is
+      a line of code, or an #include, respectively, and '' otherwise.
+    words: The set of words (\\w+ runs) of the elided line.
+  """
+
+  def __init__(self, clean_lines, linenum):
+    elided = clean_lines.elided[linenum]
+    if elided and _RE_PATTERN_INCLUDE.search(elided):
+      code, include = '', elided
+    else:
+      code, include = elided, ''
+    self.views = {
+        'raw': clean_lines.raw_lines[linenum],
+        'lines': clean_lines.lines[linenum],
+        'elided': elided,
+        'code': code,
+        'include': include,
+        }
+    self.words = frozenset(_RE_PATTERN_WORD.findall(elided))
+
+
+class _LineCheck(object):
+  """A check that ProcessLine runs on the lines that trigger it.
+
+  A check without triggers runs on every line.  Otherwise it only runs if its
+  view of the line contains one of the trigger substrings, or if the elided
+  line contains one of the trigger words.  Triggers must be necessary for every
+  error the check can report, so that skipping a check never changes the
+  output; trigger words may only be used for identifiers the check matches as
+  whole words.
+
+  A check is not run at all if the filters reject all of its categories, so
+  these must include every category the check reports, and the categories of
+  the checks that depend on the state it updates.  Checks which update state
+  still run on the lines that --diff leaves out.
+
+  Attributes:
+    function: The check function.
+    args: The names of the arguments to pass to the function, in order: the
+      names of the arguments of ProcessLine, with 'linenum' for the number of
+      the line and 'spacing_line' for the line returned by GetSpacingLine.
+    categories: A tuple of the error categories the check can report.
+    view: The name of the _LineScan view that triggers are looked up in.
+    triggers: A tuple of substrings that trigger the check.
+    words: A frozenset of words that trigger the check.
+    carries_state: Whether the check updates the include or function state.
+  """
+
+  def __init__(self, function, args, categories, view='elided', triggers=(),
+               words=()):
+    self.function = function
+    self.args = args
+    self.categories = categories
+    self.view = view
+    self.triggers = tuple(triggers)
+    self.words = frozenset(words)
+    self.always = not self.triggers and not self.words
+    self.carries_state = 'include_state' in args or 'function_state' in args
+
+  def IsTriggered(self, scan):
+    """Returns whether the check has to run on the scanned line."""
+    if self.always:
+      return True
+    text = scan.views[self.view]
+    if not text:
+      return False
+    for trigger in self.triggers:
+      if trigger in text:
+        return True
+    return not self.words.isdisjoint(scan.words)
+
+
+_CHECK_ARGS = ('filename', 'clean_lines', 'linenum', 'error')
+_SPACING_ARGS = ('filename', 'spacing_line', 'linenum', 'error')
+
+# The per-line checks run by ProcessLine, in the order their errors are
+# reported.
+_LINE_CHECKS = (
+    _LineCheck(CheckForFunctionLengths,
+               ('filename', 'clean_lines', 'linenum', 'function_state',
+                'error'),
+               categories=('readability/fn_size',)),
+    _LineCheck(CheckForMultilineCommentsAndStrings, _CHECK_ARGS,
+               triggers=('/*', '"', '\\'),
+               categories=('readability/multiline_comment',
+                           'readability/multiline_string')),
+    # Rules from the 'C++ style rules' section of cppguide.html.
+    _LineCheck(CheckLineFormat,
+               ('filename', 'clean_lines', 'linenum', 'file_extension',
+                'error', 'file_context'),
+               categories=('whitespace/end_of_line', 'whitespace/indent',
+                           'whitespace/labels', 'whitespace/line_length',
+                           'whitespace/newline', 'whitespace/tab')),
+    _LineCheck(CheckBraces, _CHECK_ARGS, triggers=('{', 'else', 'do'),
+               categories=('readability/braces', 'whitespace/braces',
+                           'whitespace/newline')),
+    _LineCheck(CheckEmptyLoopBody, _CHECK_ARGS, triggers=('for', 'while'),
+               categories=('whitespace/empty_loop_body',)),
+    _LineCheck(CheckAccess,
+               ('filename', 'clean_lines', 'linenum', 'nesting_state',
+                'error'),
+               triggers=('DISALLOW_',),
+               categories=('readability/constructors',)),
+    _LineCheck(CheckBlankLines,
+               ('filename', 'clean_lines', 'linenum', 'nesting_state',
+                'error'),
+               categories=('whitespace/blank_line',)),
+    _LineCheck(CheckCommentSpacing, _CHECK_ARGS, view='raw',
+               triggers=('//',),
+               categories=('readability/todo', 'whitespace/comments',
+                           'whitespace/todo')),
+    _LineCheck(CheckOperatorSpacing,
+               ('filename', 'clean_lines', 'spacing_line', 'linenum', 'error'),
+               triggers=('=', '<', '>', '!', '~', '--', '++'),
+               categories=('whitespace/operators',)),
+    _LineCheck(CheckControlParenSpacing, _SPACING_ARGS, triggers=('(',),
+               categories=('whitespace/parens',)),
+    _LineCheck(CheckCommaSpacing, _SPACING_ARGS, triggers=(',', ';'),
+               categories=('whitespace/comma', 'whitespace/semicolon')),
+    _LineCheck(CheckSpacingForFunctionCall, _SPACING_ARGS,
+               triggers=('(', ')'),
+               categories=('whitespace/parens',)),
+    _LineCheck(CheckBraceSpacing, _SPACING_ARGS,
+               triggers=('{', 'else', '['),
+               categories=('whitespace/braces',)),
+    _LineCheck(CheckSemicolonSpacing, _SPACING_ARGS, triggers=(';', 'for'),
+               categories=('whitespace/forcolon', 'whitespace/semicolon')),
+    _LineCheck(CheckCheck, _CHECK_ARGS, view='raw', triggers=_CHECK_MACROS,
+               categories=('readability/check',)),
+    _LineCheck(CheckAltTokens, _CHECK_ARGS,
+               words=_ALT_TOKEN_REPLACEMENT.keys(),
+               categories=('readability/alt_tokens',)),
+    _LineCheck(CheckClassSectionSpacing,
+               ('filename', 'clean_lines', 'linenum', 'nesting_state',
+                'error'),
+               view='lines', triggers=('public', 'protected', 'private'),
+               categories=('whitespace/blank_line',)),
+    # Rules from the 'C++ language rules' section of cppguide.html.
+    # The includes recorded in include_state are also used by
+    # CheckForIncludeWhatYouUse.
+    _LineCheck(CheckIncludeLine,
+               ('filename', 'clean_lines', 'linenum', 'include_state',
+                'error', 'file_context'),
+               view='include', triggers=('include',),
+               categories=('build/include', 'build/include_alpha',
+                           'build/include_order', 'build/include_what_you_use',
+                           'readability/streams')),
+    _LineCheck(CheckNonConstReferences, _CHECK_ARGS, view='code',
+               triggers=('&',),
+               categories=('runtime/references',)),
+    _LineCheck(CheckCasts, _CHECK_ARGS, view='code', triggers=('*', '&'),
+               words=('int', 'float', 'double', 'bool', 'char', 'int16',
+                      'int32', 'int64', 'uint16', 'uint32', 'uint64'),
+               categories=('readability/casting', 'readability/function',
+                           'runtime/casting', 'runtime/sizeof')),
+    _LineCheck(CheckGlobalStrings, _CHECK_ARGS, view='code',
+               triggers=('string',),
+               categories=('runtime/string',)),
+    _LineCheck(CheckRtti,
+               ('filename', 'clean_lines', 'linenum', 'file_context', 'error'),
+               view='code', triggers=('dynamic_cast<',),
+               categories=('runtime/rtti',)),
+    _LineCheck(CheckSelfInitialization, _CHECK_ARGS, view='code',
+               triggers=('_(',),
+               categories=('runtime/init',)),
+    _LineCheck(CheckIntegerTypes, _CHECK_ARGS, view='code',
+               words=('short', 'long'),
+               categories=('runtime/int',)),
+    _LineCheck(CheckUnsafeFunctions, _CHECK_ARGS, view='code',
+               triggers=('printf', 'strcpy', 'strcat', 'sscanf'),
+               categories=('runtime/printf',)),
+    _LineCheck(CheckUnaryOperatorAmpersand, _CHECK_ARGS, view='code',
+               triggers=('operator',),
+               categories=('runtime/operator',)),
+    _LineCheck(CheckIfAfterBrace, _CHECK_ARGS, view='code', triggers=('}',),
+               categories=('readability/braces',)),
+    # The format check matches printf case-insensitively.
+    _LineCheck(CheckPrintfFormatArgument, _CHECK_ARGS, view='code',
+               triggers=('(',),
+               categories=('runtime/printf',)),
+    _LineCheck(CheckMemsetArguments, _CHECK_ARGS, view='code',
+               triggers=('memset',),
+               categories=('runtime/memset',)),
+    _LineCheck(CheckUsingDirectives, _CHECK_ARGS, view='code',
+               triggers=('using namespace',),
+               categories=('build/namespaces',)),
+    _LineCheck(CheckVariableLengthArrays, _CHECK_ARGS, view='code',
+               triggers=('[',),
+               categories=('runtime/arrays',)),
+    _LineCheck(CheckDisallowMacroPosition, _CHECK_ARGS, view='code',
+               triggers=('DISALLOW_',),
+               categories=('readability/constructors',)),
+    _LineCheck(CheckUnnamedNamespaces,
+               ('filename', 'clean_lines', 'linenum', 'file_extension',
+                'error'),
+               view='code', triggers=('namespace',),
+               categories=('build/namespaces',)),
+    # Constructs which gcc-2 accepts but which are not standard C++, along with
+    # the constructor style checks.
+    _LineCheck(CheckPrintfFormatStrings, _CHECK_ARGS, view='lines',
+               triggers=('printf', '\\'),
+               categories=('build/printf_format', 'runtime/printf_format')),
+    _LineCheck(CheckNonStandardDeclarations, _CHECK_ARGS,
+               triggers=('endif', 'class', '<?', '>?', 'string'),
+               words=('register', 'static', 'extern', 'typedef'),
+               categories=('build/deprecated', 'build/endif_comment',
+                           'build/forward_decl', 'build/storage_class',
+                           'runtime/member_string_references')),
+    _LineCheck(CheckExplicitConstructors,
+               ('filename', 'clean_lines', 'linenum', 'nesting_state',
+                'error'),
+               triggers=('(',),
+               categories=('runtime/explicit',)),
+    _LineCheck(CheckPosixThreading, _CHECK_ARGS,
+               triggers=[function for function, _ in threading_list],
+               categories=('runtime/threadsafe_fn',)),
+    _LineCheck(CheckInvalidIncrement, _CHECK_ARGS, triggers=('++', '--'),
+               categories=('runtime/invalid_increment',)),
+    _LineCheck(CheckMakePairUsesDeduction, _CHECK_ARGS, view='raw',
+               triggers=('make_pair',),
+               categories=('build/explicit_make_pair',)),
+    # An ART check, run here rather than as an extra check function as it
+    # needs the nesting state.
+    _LineCheck(CheckLoggingCost,
+               ('filename', 'clean_lines', 'linenum', 'nesting_state',
+                'error'),
+               view='code', triggers=('std::endl', 'VLOG_STREAM'),
+               words=frozenset().union(*_LOGGING_COST_DIRECTORIES.values()),
+               categories=('runtime/endl', 'runtime/logging')),
+    )
+
+
+# The checks of _LINE_CHECKS that CheckStyle, CheckLanguage and
+# CheckForNonStandardConstructs run, by name.
+_STYLE_CHECKS = frozenset([
+    'CheckLineFormat', 'CheckBraces', 'CheckEmptyLoopBody', 'CheckAccess',
+    'CheckBlankLines', 'CheckCommentSpacing', 'CheckOperatorSpacing',
+    'CheckControlParenSpacing', 'CheckCommaSpacing',
+    'CheckSpacingForFunctionCall', 'CheckBraceSpacing',
+    'CheckSemicolonSpacing', 'CheckCheck', 'CheckAltTokens',
+    'CheckClassSectionSpacing'])
+_LANGUAGE_CHECKS = frozenset([
+    'CheckIncludeLine', 'CheckNonConstReferences', 'CheckCasts',
+    'CheckGlobalStrings', 'CheckRtti', 'CheckSelfInitialization',
+    'CheckIntegerTypes', 'CheckUnsafeFunctions', 'CheckUnaryOperatorAmpersand',
+    'CheckIfAfterBrace', 'CheckPrintfFormatArgument', 'CheckMemsetArguments',
+    'CheckUsingDirectives', 'CheckVariableLengthArrays',
+    'CheckDisallowMacroPosition', 'CheckUnnamedNamespaces'])
+_NON_STANDARD_CHECKS = frozenset([
+    'CheckPrintfFormatStrings', 'CheckNonStandardDeclarations',
+    'CheckExplicitConstructors'])
+
+
+def _RunLineChecks(names, args):
+  """Runs the checks of _LINE_CHECKS with the given names on a line.
+
+  The checks run in the order of _LINE_CHECKS, and only if they are
+  triggered by the line, as they would be by ProcessLine.
+
+  Args:
+    names: The names of the check functions to run.
+    args: The arguments to pass to the checks, by the names used in the args
+      of _LineCheck.
+  """
+  scan = _LineScan(args['clean_lines'], args['linenum'])
+  for check in _LINE_CHECKS:
+    if check.function.__name__ in names and check.IsTriggered(scan):
+      check.function(*[args[name] for name in check.args])
+
+
+def CheckStyle(filename, clean_lines, linenum, file_extension, nesting_state,
+               error):
+  """Checks rules from the 'C++ style rules' section of cppguide.html.
+
+  ProcessLine runs these checks from _LINE_CHECKS; this runs the same ones
+  on a single line.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    file_extension: The extension (without the dot) of the filename.
+    nesting_state: A _NestingState instance which maintains information about
+                   the current stack of nested blocks being parsed.
+    error: The function to call with any errors found.
+  """
+  _RunLineChecks(_STYLE_CHECKS, {
+      'filename': filename,
+      'file_extension': file_extension,
+      'file_context': _FileContext(filename, file_extension),
+      'clean_lines': clean_lines,
+      'linenum': linenum,
+      'spacing_line': GetSpacingLine(clean_lines, linenum),
+      'nesting_state': nesting_state,
+      'error': error,
+      })
+
+
+def CheckLanguage(filename, clean_lines, linenum, file_extension, include_state,
+                  error):
+  """Checks rules from the 'C++ language rules' section of cppguide.html.
+
+  ProcessLine runs these checks from _LINE_CHECKS; this runs the same ones
+  on a single line.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    file_extension: The extension (without the dot) of the filename.
+    include_state: An _IncludeState instance in which the headers are inserted.
+    error: The function to call with any errors found.
+  """
+  _RunLineChecks(_LANGUAGE_CHECKS, {
+      'filename': filename,
+      'file_extension': file_extension,
+      'file_context': _FileContext(filename, file_extension),
+      'clean_lines': clean_lines,
+      'linenum': linenum,
+      'include_state': include_state,
+      'error': error,
+      })
+
+
+def CheckForNonStandardConstructs(filename, clean_lines, linenum,
+                                  nesting_state, error):
+  """Logs an error if we see certain non-ANSI constructs ignored by gcc-2.
+
+  These are the checks of CheckPrintfFormatStrings and
+  CheckNonStandardDeclarations, along with the constructor style checks of
+  CheckExplicitConstructors.  ProcessLine runs them from _LINE_CHECKS; this
+  runs the same ones on a single line.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    nesting_state: A _NestingState instance which maintains information about
+                   the current stack of nested blocks being parsed.
+    error: The function to call with any errors found.
+  """
+  _RunLineChecks(_NON_STANDARD_CHECKS, {
+      'filename': filename,
+      'clean_lines': clean_lines,
+      'linenum': linenum,
+      'nesting_state': nesting_state,
+      'error': error,
+      })
+
+
 def ProcessLine(filename, file_extension, clean_lines, line,
                 include_state, function_state, nesting_state, error,
-                extra_check_functions=[]):
+                extra_check_functions=[], file_context=None):
   """Processes a single line in the file.
 
   Args:
@@ -3802,24 +6627,61 @@ def ProcessLine(filename, file_extension, clean_lines, line,
     extra_check_functions: An array of additional check functions that will be
                            run on each source line. Each function takes 4
                            arguments: filename, clean_lines, line, error
+    file_context: A _FileContext instance for the file, created from filename
+                  and file_extension if not given.
   """
   raw_lines = clean_lines.raw_lines
   ParseNolintSuppressions(filename, raw_lines[line], line, error)
   nesting_state.Update(filename, clean_lines, line, error)
-  if nesting_state.stack and nesting_state.stack[-1].inline_asm != _NO_ASM:
+  block = nesting_state.InnermostBlock()
+  if block and block.inline_asm != _NO_ASM:
     return
-  CheckForFunctionLengths(filename, clean_lines, line, function_state, error)
-  CheckForMultilineCommentsAndStrings(filename, clean_lines, line, error)
-  CheckStyle(filename, clean_lines, line, file_extension, nesting_state, error)
-  CheckLanguage(filename, clean_lines, line, file_extension, include_state,
-                error)
-  CheckForNonStandardConstructs(filename, clean_lines, line,
-                                nesting_state, error)
-  CheckPosixThreading(filename, clean_lines, line, error)
-  CheckInvalidIncrement(filename, clean_lines, line, error)
-  CheckMakePairUsesDeduction(filename, clean_lines, line, error)
-  for check_fn in extra_check_functions:
-    check_fn(filename, clean_lines, line, error)
+  if file_context is None:
+    file_context = _FileContext(filename, file_extension)
+  line_checks = file_context.line_checks
+  if (file_context.changed_lines is not None and
+      line not in file_context.changed_lines):
+    # Nothing is reported on unchanged lines, but the state has to be kept.
+    line_checks = file_context.state_checks
+    extra_check_functions = []
+  scan = _LineScan(clean_lines, line)
+  args = {
+      'filename': filename,
+      'file_extension': file_extension,
+      'file_context': file_context,
+      'clean_lines': clean_lines,
+      'linenum': line,
+      'spacing_line': GetSpacingLine(clean_lines, line),
+      'include_state': include_state,
+      'function_state': function_state,
+      'nesting_state': nesting_state,
+      'error': error,
+      }
+  check_seconds = file_context.check_seconds
+  if check_seconds is None:
+    for check in line_checks:
+      if check.IsTriggered(scan):
+        check.function(*[args[name] for name in check.args])
+    for check_fn in extra_check_functions:
+      check_fn(filename, clean_lines, line, error)
+  else:
+    for check in line_checks:
+      if check.IsTriggered(scan):
+        _TimedCall(check_seconds, check.function,
+                   [args[name] for name in check.args])
+    for check_fn in extra_check_functions:
+      _TimedCall(check_seconds, check_fn,
+                 (filename, clean_lines, line, error))
+
+
+def _TimedCall(check_seconds, function, args):
+  """Calls a check function, adding the time it takes to check_seconds."""
+  start = time.time()
+  try:
+    function(*args)
+  finally:
+    name = function.__name__
+    check_seconds[name] = check_seconds.get(name, 0.0) + time.time() - start
 
 def ProcessFileData(filename, file_extension, lines, error,
                     extra_check_functions=[]):
@@ -3842,29 +6704,545 @@ def ProcessFileData(filename, file_extension, lines, error,
   include_state = _IncludeState()
   function_state = _FunctionState()
   nesting_state = _NestingState()
+  file_context = _FileContext(filename, file_extension)
+
+  # With --diff only the errors on changed lines are reported, and the checks
+  # of the whole file only run if a line they look at changed.
+  changed_lines = file_context.changed_lines
+  if changed_lines is None:
+    line_error = error
+  else:
+    def line_error(filename, linenum, category, confidence, message):
+      if linenum in changed_lines:
+        error(filename, linenum, category, confidence, message)
 
   ResetNolintSuppressions()
 
-  CheckForCopyright(filename, lines, error)
+  if changed_lines is None or any(linenum <= 10 for linenum in changed_lines):
+    CheckForCopyright(filename, lines, error)
 
-  if file_extension == 'h':
+  if file_extension == 'h' and _AnyChangedLineMatches(
+      lines, changed_lines, _RE_PATTERN_HEADER_GUARD_LINE.match):
     CheckForHeaderGuard(filename, lines, error)
 
-  RemoveMultiLineComments(filename, lines, error)
+  RemoveMultiLineComments(filename, lines, line_error)
   clean_lines = CleansedLines(lines)
   for line in xrange(clean_lines.NumLines()):
     ProcessLine(filename, file_extension, clean_lines, line,
-                include_state, function_state, nesting_state, error,
-                extra_check_functions)
-  nesting_state.CheckClassFinished(filename, error)
+                include_state, function_state, nesting_state, line_error,
+                extra_check_functions, file_context)
+  nesting_state.CheckClassFinished(filename, line_error)
+  function_state.CheckBodyFound(filename, line_error)
 
-  CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error)
+  if (_cpplint_state.AnyCategoryPassesFilters(('build/include_what_you_use',))
+      and _AnyChangedLineMatches(clean_lines.elided, changed_lines,
+                                 _UsesHeaders)):
+    CheckForIncludeWhatYouUse(filename, clean_lines, include_state, error)
+
+  if _symbol_index:
+    CheckAgainstSymbolIndex(filename, file_extension, line_error)
+
+  _RunPluginFileChecks(filename, clean_lines, line_error)
 
   # We check here rather than inside ProcessLine so that we see raw
   # lines rather than "cleaned" lines.
-  CheckForUnicodeReplacementCharacters(filename, lines, error)
+  CheckForUnicodeReplacementCharacters(filename, lines, line_error)
+
+  CheckForNewlineAtEOF(filename, lines, line_error)
+
+
+_RE_PATTERN_HEADER_GUARD_LINE = _Regexp(r'\s*#\s*(ifndef|define|endif)\b')
+
+
+def _UsesHeaders(line):
+  """Returns whether an elided line includes or needs a header."""
+  return bool(_RE_PATTERN_INCLUDE.match(line) or _RequiredHeaders(line))
+
+
+def _AnyChangedLineMatches(lines, changed_lines, predicate):
+  """Returns whether a whole-file check has to run for --diff.
+
+  Args:
+    lines: The lines the check looks at.
+    changed_lines: The set of changed line numbers, None if all lines count as
+      changed.
+    predicate: A function taking a line and returning whether a change to the
+      line can change the errors the check reports.
+
+  Returns:
+    True if changed_lines is None or the predicate holds for a changed line.
+  """
+  if changed_lines is None:
+    return True
+  for linenum in changed_lines:
+    if linenum < len(lines) and predicate(lines[linenum]):
+      return True
+  return False
+
+# ART specific checks.  They are run as extra check functions, by main() and
+# by whoever passes them to ProcessFile, and only look at the files in the
+# directories they are meant for.
+
+_tree_paths = {}
+
+# The path of a file in the ART tree.  Its repository name starts with 'art/'
+# in a checkout, and is its absolute path otherwise.
+_RE_PATTERN_TREE_PATH = _Regexp(r'(?:.*?/)?art/(.*)')
+
+
+def _DirectoryEntry(filename, entries):
+  """Looks up the entry for the directory of a file.
+
+  Args:
+    filename: The name of the file.
+    entries: A dict from directories, relative to the root of the ART tree
+      and ending in '/', to entries.
+
+  Returns:
+    The entry of the innermost directory that holds the file, or None.
+  """
+  path = _tree_paths.get(filename)
+  if path is None:
+    match = _RE_PATTERN_TREE_PATH.match(FileInfo(filename).RepositoryName())
+    path = _tree_paths[filename] = match.group(1) if match else ''
+  innermost = None
+  for directory in entries:
+    if path.startswith(directory) and len(directory) > len(innermost or ''):
+      innermost = directory
+  return entries[innermost] if innermost else None
+
+
+def _IsArtTestFilename(filename):
+  """Returns whether a file is a test or a header only included by tests."""
+  return _IsTestFilename(filename) or filename.endswith('_test.h')
+
+
+def _TemplateArgumentsEnd(line, pos):
+  """Returns the position just past the '>' closing the '<' at line[pos].
+
+  Only the rest of the line is looked at; None is returned if the template
+  arguments do not end on it.
+  """
+  depth = 0
+  for i in xrange(pos, len(line)):
+    char = line[i]
+    if char == '<':
+      depth += 1
+    elif char == '>':
+      depth -= 1
+      if not depth:
+        return i + 1
+    elif char in ';{}':
+      return None
+  return None
+
+
+# The std containers that have an arena or ART counterpart, with the error
+# category for using them, the counterpart and where it is declared.
+_ARENA_CONTAINERS = {
+    'std::vector': ('runtime/arena_container',
+                    'ArenaVector or ScopedArenaVector',
+                    'compiler/utils/(scoped_)arena_containers.h'),
+    'std::deque': ('runtime/arena_container',
+                   'ArenaDeque or ScopedArenaDeque',
+                   'compiler/utils/(scoped_)arena_containers.h'),
+    'std::queue': ('runtime/arena_container',
+                   'ArenaQueue or ScopedArenaQueue',
+                   'compiler/utils/(scoped_)arena_containers.h'),
+    'std::set': ('runtime/arena_container',
+                 'ArenaSet or ScopedArenaSet',
+                 'compiler/utils/(scoped_)arena_containers.h'),
+    'std::map': ('runtime/arena_container',
+                 'ArenaSafeMap or ScopedArenaSafeMap',
+                 'compiler/utils/(scoped_)arena_containers.h'),
+    'std::unordered_map': ('runtime/hash_container', 'HashMap',
+                           'runtime/base/hash_map.h'),
+    'std::unordered_set': ('runtime/hash_container', 'HashSet',
+                           'runtime/base/hash_set.h'),
+    }
+
+# The directories whose code should allocate its containers from an arena,
+# with the containers that may still be used there: either a kind of container
+# (e.g. 'std::map') or a container spelt without spaces (e.g.
+# 'std::vector<uint8_t>').
+_ARENA_CONTAINER_DIRECTORIES = {
+    # Code, tables and maps outlive the arena of the method compiled, and are
+    # built in std::vector<uint8_t>s handed over to the CompiledMethod.
+    'compiler/dex/': frozenset(['std::vector<uint8_t>']),
+    'compiler/optimizing/': frozenset(['std::vector<uint8_t>']),
+    }
+
+_RE_PATTERN_STD_CONTAINER = _Regexp(
+    r'\b(new\s+)?(std::(?:vector|deque|queue|set|map|unordered_map|'
+    r'unordered_set))\s*<')
+# What follows the template arguments of a container that is an object: the
+# name of a variable, member or parameter, possibly annotated (e.g. with
+# GUARDED_BY), or the arguments of a temporary.
+_RE_PATTERN_CONTAINER_OBJECT = _Regexp(
+    r'\s*(?:[a-z_]\w*\s*(?:[A-Z_]+\([^)]*\)\s*)*[;=({[,)]|[({])')
+
+
+def CheckArenaContainers(filename, clean_lines, linenum, error):
+  """Checks for std containers where the code should use arena containers.
+
+  In the directories of _ARENA_CONTAINER_DIRECTORIES, the variables, members,
+  parameters and temporaries whose type is a std container with an arena or
+  ART counterpart are reported, unless the container is allowed there or has
+  an allocator of its own.  References, pointers, types and tests are fine.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+  if 'std::' not in line:
+    return
+  allowed = _DirectoryEntry(filename, _ARENA_CONTAINER_DIRECTORIES)
+  if allowed is None or _IsArtTestFilename(filename):
+    return
+  for match in _RE_PATTERN_STD_CONTAINER.finditer(line):
+    end = _TemplateArgumentsEnd(line, match.end() - 1)
+    if end is None:
+      continue
+    kind = match.group(2)
+    container = ''.join(line[match.start(2):end].split())
+    if (kind in allowed or container in allowed or
+        'Arena' in container or 'Allocator' in container):
+      continue
+    if match.group(1) or _RE_PATTERN_CONTAINER_OBJECT.match(line, end):
+      category, replacement, header = _ARENA_CONTAINERS[kind]
+      error(filename, linenum, category, 3,
+            'Use %s from %s instead of %s, which allocates from the heap.'
+            % (replacement, header, kind))
+
+
+# The types that are expensive to copy, and those among them whose elements
+# are pairs of a key and a value.
+_HEAVY_TYPES = frozenset([
+    'std::string', 'std::vector', 'std::set', 'std::map', 'std::multimap',
+    'std::list', 'std::deque', 'std::unordered_map', 'std::unordered_set',
+    'SafeMap', 'ArenaVector', 'ArenaDeque', 'ArenaSet', 'ArenaSafeMap',
+    'ScopedArenaVector', 'ScopedArenaDeque', 'ScopedArenaSet',
+    'ScopedArenaSafeMap'])
+_HEAVY_MAP_TYPES = frozenset([
+    'std::map', 'std::multimap', 'std::unordered_map', 'SafeMap',
+    'ArenaSafeMap', 'ScopedArenaSafeMap'])
+
+# The directories where copies of heavy types are reported, with the types
+# that may be copied there: either a kind of type (e.g. 'std::set') or a type
+# spelt without spaces (e.g. 'std::vector<uint8_t>').
+_HEAVY_COPY_DIRECTORIES = {
+    'compiler/': frozenset(),
+    'runtime/': frozenset(),
+    }
+
+_RE_PATTERN_VALUE_PARAMETER = _Regexp(
+    r'(?:^|[(,])\s*(?:const\s+)?((?:[A-Za-z_]\w*::)*[A-Za-z_]\w*)\s*(<)?')
+_RE_PATTERN_VALUE_PARAMETER_NAME = _Regexp(
+    r'\s*(?:const\s+)?([a-z_]\w*)\s*(?:[,)]|=[^=])')
+_RE_PATTERN_CONDITION_START = _Regexp(r'\b(?:for|if|while|switch|catch)\s*$')
+# The end of a declaration, or the opening brace of a function body; braces
+# right after a name or template arguments initialize members.
+_RE_PATTERN_BODY_START = _Regexp(r';|(?<![\w>])\{')
+_RE_PATTERN_RANGE_FOR = _Regexp(
+    r'\bfor\s*\(\s*(.*?)\s*([&*]*)\s*([a-z_]\w*)\s*:(?!:)\s*(.*?)\s*\)')
+_RE_PATTERN_RANGE_NAME = _Regexp(r'(?:.*(?:\.|->))?\*?\s*(\w+)$')
+_RE_PATTERN_LAMBDA_CAPTURES = _Regexp(
+    r'(?:^|[=(,{]|\breturn)\s*\[([^\[\]]+)\]\s*(?:[({]|mutable\b)')
+
+
+def _HeavyKind(spelling, allowed):
+  """Returns the kind of a heavy type that may not be copied, or None."""
+  kind = _TemplateArguments(spelling)[0]
+  if kind in _HEAVY_TYPES and kind not in allowed and spelling not in allowed:
+    return kind
+  return None
+
+
+def _HeavyElementKind(spelling, type_table, allowed):
+  """Returns the kind of the heavy elements of a container type, or None."""
+  kind, arguments = _TemplateArguments(spelling)
+  if kind not in _HEAVY_TYPES or not arguments:
+    return None
+  if kind in _HEAVY_MAP_TYPES:
+    if any(_HeavyKind(type_table.Resolve(argument), allowed)
+           for argument in arguments[:2]):
+      return 'std::pair'
+    return None
+  return _HeavyKind(type_table.Resolve(arguments[0]), allowed)
+
+
+def CheckHeavyCopies(filename, clean_lines, linenum, error):
+  """Checks for copies of heavy types where a reference would do.
+
+  In the directories of _HEAVY_COPY_DIRECTORIES, this reports parameters,
+  range-based for loop variables and lambda captures that copy a string,
+  a container or a container of them.  The types of the containers looped
+  over and of the captured names come from the _TypeTable of the file.
+  Parameters that the function moves from are sinks, which are meant to be
+  passed by value.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    error: The function to call with any errors found.
+  """
+  allowed = _DirectoryEntry(filename, _HEAVY_COPY_DIRECTORIES)
+  if allowed is None or _IsArtTestFilename(filename):
+    return
+  line = clean_lines.elided[linenum]
+  type_table = clean_lines.TypeTable()
+
+  # Parameters passed by value, including those on the lines of a parameter
+  # list split over several lines.
+  if type_table.NamesPattern(_HEAVY_TYPES).search(line):
+    _CheckHeavyParameters(filename, clean_lines, linenum, allowed, error)
+
+  # Range-based for loops which copy every element.
+  match = 'for' in line and _RE_PATTERN_RANGE_FOR.search(line)
+  if match and not match.group(2):
+    loop_type = type_table.Resolve(_TypeSpelling(match.group(1)))
+    if loop_type == 'auto':
+      kind = None
+      container = _RE_PATTERN_RANGE_NAME.match(match.group(4))
+      if container and type_table.Type(container.group(1)):
+        kind = _HeavyElementKind(type_table.Type(container.group(1)),
+                                 type_table, allowed)
+    else:
+      kind = _HeavyKind(loop_type, allowed)
+    if kind:
+      error(filename, linenum, 'runtime/heavy_copy', 3,
+            'Loop variable %s copies every %s it iterates over; '
+            'declare it as a const reference.' % (match.group(3), kind))
+
+  # Lambdas capturing names by copy.
+  if '[' in line:
+    for match in _RE_PATTERN_LAMBDA_CAPTURES.finditer(line):
+      for capture in match.group(1).split(','):
+        capture = capture.strip()
+        if not Match(r'[a-z_]\w*$', capture) or capture == 'this':
+          continue
+        captured_type = type_table.Type(capture)
+        kind = captured_type and _HeavyKind(captured_type, allowed)
+        if kind:
+          error(filename, linenum, 'runtime/heavy_copy', 3,
+                'Lambda copies the %s %s; capture it by reference.'
+                % (kind, capture))
+
+
+def _CheckHeavyParameters(filename, clean_lines, linenum, allowed, error):
+  """Checks for parameters of heavy types passed by value.
+
+  Args:
+    filename: The name of the current file.
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line to check.
+    allowed: The heavy types that may be copied in the file.
+    error: The function to call with any errors found.
+  """
+  line = clean_lines.elided[linenum]
+  continued = linenum and Match(r'.*[(,]\s*$', clean_lines.elided[linenum - 1])
+  for match in _RE_PATTERN_VALUE_PARAMETER.finditer(line):
+    if match.group(1) in _NOT_TYPES:
+      continue
+    if line[match.start()] == '(':
+      if _RE_PATTERN_CONDITION_START.search(line, 0, match.start()):
+        continue
+    elif line[match.start()] != ',' and not continued:
+      continue
+    end = match.end()
+    if match.group(2):
+      end = _TemplateArgumentsEnd(line, end - 1)
+      if end is None:
+        continue
+    name = _RE_PATTERN_VALUE_PARAMETER_NAME.match(line, end)
+    if not name:
+      continue
+    spelling = clean_lines.TypeTable().Resolve(
+        _TypeSpelling(line[match.start(1):end]))
+    kind = _HeavyKind(spelling, allowed)
+    if kind and not _IsMovedFrom(clean_lines, linenum, name.end(),
+                                 name.group(1)):
+      error(filename, linenum, 'runtime/heavy_copy', 3,
+            'Parameter %s copies a %s; pass it by const reference%s.'
+            % (name.group(1), kind,
+               ' or as a StringPiece' if kind == 'std::string' else ''))
+
+
+def _IsMovedFrom(clean_lines, linenum, pos, name):
+  """Returns whether a parameter is moved from by its function.
+
+  The member initializers and the body of the function are searched for
+  std::move(name).  A parameter of a declaration without a body is not.
+
+  Args:
+    clean_lines: A CleansedLines instance containing the file.
+    linenum: The number of the line of the parameter.
+    pos: The position on the line after the name of the parameter.
+    name: The name of the parameter.
+
+  Returns:
+    True if the parameter is moved from.
+  """
+  elided = clean_lines.elided
+  for start in xrange(linenum, clean_lines.NumLines()):
+    match = _RE_PATTERN_BODY_START.search(elided[start],
+                                          pos if start == linenum else 0)
+    if match:
+      if match.group() == ';':
+        return False
+      end = clean_lines.BracketIndex().BlockEnd(start) or len(elided) - 1
+      moved = _CompileRegexp(r'\b(?:std::)?move\(\s*%s\s*\)' % name,
+                             bundled=False)
+      return any(moved.search(line) for line in elided[linenum:end + 1])
+  return False
+
+
+# The ART checks, with the error categories each of them can report.  main()
+# runs those which can report an error that passes the filters.
+_ART_CHECKS = (
+    (CheckArenaContainers, ('runtime/arena_container',
+                            'runtime/hash_container')),
+    (CheckHeavyCopies, ('runtime/heavy_copy',)),
+    )
+
+
+def _ArtCheckFunctions():
+  """Returns the ART checks that can report an error passing the filters."""
+  return [function for function, categories in _ART_CHECKS
+          if _cpplint_state.AnyCategoryPassesFilters(categories)]
+
+
+class _Plugin(object):
+  """The checks of a module loaded with --plugin.
+
+  The checks are wrapped to add up the time they take, both in total and
+  on the file being linted.
+
+  Attributes:
+    name: The name of the module.
+    line_checks: A tuple of _LineCheck instances for the LINE_CHECKS of the
+      module.
+    file_checks: A tuple of (function, categories, triggers) tuples for the
+      FILE_CHECKS of the module.
+    file_seconds: The time taken since _StartPluginTimers was last called.
+  """
+
+  def __init__(self, name, module):
+    self.name = name
+    self.file_seconds = 0.0
+    self.line_checks = tuple(
+        _LineCheck(self._Timed(function),
+                   ('filename', 'clean_lines', 'linenum', 'error'),
+                   categories=tuple(categories), triggers=triggers)
+        for function, categories, triggers in getattr(module, 'LINE_CHECKS',
+                                                      ()))
+    self.file_checks = tuple(
+        (self._Timed(function), tuple(categories), tuple(triggers))
+        for function, categories, triggers in getattr(module, 'FILE_CHECKS',
+                                                      ()))
+
+  def _Timed(self, function):
+    def Timed(*args):
+      start = time.time()
+      try:
+        return function(*args)
+      finally:
+        self.file_seconds += time.time() - start
+    Timed.__name__ = function.__name__
+    return Timed
+
+
+# The loaded --plugin modules, and their line checks.
+_plugins = ()
+_plugin_line_checks = ()
+
+
+def _LoadPlugins(names):
+  """Imports the --plugin modules and makes ProcessFileData run their checks.
+
+  The categories of their checks are added to _ERROR_CATEGORIES, for NOLINT
+  comments and the list printed by --filter=.  The current directory is only
+  on the Python path while the modules are imported.
+
+  Args:
+    names: The names of the modules.
+
+  Raises:
+    ImportError: A module could not be imported.
+    ValueError: A module has no checks, or declares them wrongly.
+  """
+  global _plugins, _plugin_line_checks
+  # Only imported here, as no other mode needs it.
+  import importlib
+  path = sys.path[:]
+  sys.path.append(os.getcwd())
+  plugins = []
+  try:
+    for name in names:
+      module = importlib.import_module(name)
+      if not hasattr(module, 'LINE_CHECKS') and not hasattr(module,
+                                                            'FILE_CHECKS'):
+        raise ValueError('%s has neither LINE_CHECKS nor FILE_CHECKS' % name)
+      try:
+        plugins.append(_Plugin(name, module))
+      except (TypeError, ValueError):
+        raise ValueError('%s must list its checks as (function, categories, '
+                         'triggers) tuples' % name)
+  finally:
+    sys.path[:] = path
+  _plugins = tuple(plugins)
+  _plugin_line_checks = sum((plugin.line_checks for plugin in _plugins), ())
+  for plugin in _plugins:
+    for categories in ([check.categories for check in plugin.line_checks] +
+                       [categories for _, categories, _ in plugin.file_checks]):
+      for category in categories:
+        if category not in _ERROR_CATEGORIES:
+          _ERROR_CATEGORIES.append(category)
+
+
+def _RunPluginFileChecks(filename, clean_lines, error):
+  """Runs the file checks of the --plugin modules which the file triggers."""
+  text = None
+  for plugin in _plugins:
+    for function, categories, triggers in plugin.file_checks:
+      if not _cpplint_state.AnyCategoryPassesFilters(categories):
+        continue
+      if triggers:
+        if text is None:
+          text = '\n'.join(clean_lines.elided)
+        if not any(trigger in text for trigger in triggers):
+          continue
+      function(filename, clean_lines, error)
+
+
+def _StartPluginTimers():
+  """Starts timing the --plugin modules on a new file."""
+  for plugin in _plugins:
+    plugin.file_seconds = 0.0
+
+
+def _StopPluginTimers(filename):
+  """Records the time the --plugin modules took on a file.
+
+  The times are added to the current _FileLintState, and the plugins which
+  took longer than --plugin-budget are reported in its output.
+
+  Args:
+    filename: The name of the file.
+  """
+  budget = _cpplint_state.plugin_budget
+  for plugin in _plugins:
+    _file_lint_state.plugin_seconds[plugin.name] = plugin.file_seconds
+    if plugin.file_seconds > budget:
+      _file_lint_state.Write(
+          'Plugin %s took %d ms on %s, over its budget of %d ms\n'
+          % (plugin.name, plugin.file_seconds * 1000, filename,
+             budget * 1000))
 
-  CheckForNewlineAtEOF(filename, lines, error)
 
 def ProcessFile(filename, vlevel, extra_check_functions=[]):
   """Does google-lint on a single file.
@@ -3879,6 +7257,75 @@ def ProcessFile(filename, vlevel, extra_check_functions=[]):
                            run on each source line. Each function takes 4
                            arguments: filename, clean_lines, line, error
   """
+  _cpplint_state.AddFileResults(
+      _LintFile(filename, vlevel, extra_check_functions))
+
+
+def _LintFile(filename, vlevel, extra_check_functions=[]):
+  """Lints a single file in isolation from any other file.
+
+  Args:
+    filename: The name of the file to parse.
+    vlevel: The level of errors to report.
+    extra_check_functions: An array of additional check functions that will be
+                           run on each source line.
+
+  Returns:
+    The _FileLintState holding the output and the errors of the file.
+  """
+  global _file_lint_state
+  _SetVerboseLevel(vlevel)
+
+  # Results can only be cached if they are fully determined by the flags and
+  # the files involved, which is not the case for stdin or custom checks.
+  # The extra checks of cpplint itself, such as the ART checks, are fine.
+  cache = cache_key = None
+  if (_cpplint_state.cache_dir and filename != '-' and not _plugins and
+      all(f.__module__ == __name__ for f in extra_check_functions)):
+    cache = _LintResultCache(_cpplint_state.cache_dir)
+    cache_key = cache.Key(filename, extra_check_functions)
+    if cache_key:
+      file_state = cache.Load(cache_key)
+      if file_state:
+        return file_state
+
+  _file_lint_state = _FileLintState(filename)
+  try:
+    start = time.time()
+    _ProcessFileInState(filename, vlevel, extra_check_functions)
+    _file_lint_state.seconds = time.time() - start
+    if cache_key:
+      cache.Store(cache_key, _file_lint_state)
+    return _file_lint_state
+  finally:
+    _file_lint_state = _UnattachedLintState()
+
+
+def _SplitLines(contents):
+  """Splits the contents of a file into lines, removing trailing '\r's.
+
+  Args:
+    contents: The contents of the file.
+
+  Returns:
+    A tuple of the list of lines and whether a '\r' was found.
+  """
+  carriage_return_found = '\r\n' in contents or contents.endswith('\r')
+  if carriage_return_found:
+    lines = _RE_PATTERN_LINE_BREAK.split(contents.rstrip('\r'))
+  else:
+    lines = contents.split('\n')
+  return lines, carriage_return_found
+
+
+def _BinaryStream(stream):
+  """Returns the stream of bytes under a standard stream."""
+  # On Python 3 the standard streams are text streams over a binary buffer.
+  return getattr(stream, 'buffer', stream)
+
+
+def _ProcessFileInState(filename, vlevel, extra_check_functions):
+  """Lints a single file, reporting to the current _FileLintState."""
 
   _SetVerboseLevel(vlevel)
 
@@ -3894,22 +7341,18 @@ def ProcessFile(filename, vlevel, extra_check_functions=[]):
     # is processed.
 
     if filename == '-':
-      lines = codecs.StreamReaderWriter(sys.stdin,
-                                        codecs.getreader('utf8'),
-                                        codecs.getwriter('utf8'),
-                                        'replace').read().split('\n')
+      contents = codecs.StreamReaderWriter(_BinaryStream(sys.stdin),
+                                           codecs.getreader('utf8'),
+                                           codecs.getwriter('utf8'),
+                                           'replace').read()
     else:
-      lines = codecs.open(filename, 'r', 'utf8', 'replace').read().split('\n')
+      with open(filename, 'rb') as source:
+        contents = source.read().decode('utf8', 'replace')
 
-    carriage_return_found = False
-    # Remove trailing '\r'.
-    for linenum in range(len(lines)):
-      if lines[linenum].endswith('\r'):
-        lines[linenum] = lines[linenum].rstrip('\r')
-        carriage_return_found = True
+    lines, carriage_return_found = _SplitLines(contents)
 
   except IOError:
-    sys.stderr.write(
+    _file_lint_state.Write(
         "Skipping input '%s': Can't open for reading\n" % filename)
     return
 
@@ -3920,8 +7363,9 @@ def ProcessFile(filename, vlevel, extra_check_functions=[]):
   # should rely on the extension.
   if (filename != '-' and file_extension != 'cc' and file_extension != 'h'
       and file_extension != 'cpp'):
-    sys.stderr.write('Ignoring %s; not a .cc or .h file\n' % filename)
+    _file_lint_state.Write('Ignoring %s; not a .cc or .h file\n' % filename)
   else:
+    _StartPluginTimers()
     ProcessFileData(filename, file_extension, lines, Error,
                     extra_check_functions)
     if carriage_return_found and os.linesep != '\r\n':
@@ -3930,8 +7374,1029 @@ def ProcessFile(filename, vlevel, extra_check_functions=[]):
       Error(filename, 0, 'whitespace/newline', 1,
             'One or more unexpected \\r (^M) found;'
             'better to use only a \\n')
+    _StopPluginTimers(filename)
+    _file_lint_state.linted = True
 
-  sys.stderr.write('Done processing %s\n' % filename)
+  _file_lint_state.Write('Done processing %s\n' % filename)
+
+
+_RE_PATTERN_HUNK = _Regexp(r'@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+
+def _GitChangedLines(rev):
+  """Asks git for the lines of the working tree changed since a revision.
+
+  Args:
+    rev: The git revision to compare the working tree with.
+
+  Returns:
+    A dict from the normalized name of every file changed since rev, relative
+    to the current directory, to the set of the numbers of its changed lines.
+    Deleting lines counts as changing the lines on either side.  Deleted files
+    are left out.
+
+  Raises:
+    OSError: git could not be run.
+    subprocess.CalledProcessError: git failed.
+  """
+  output = subprocess.check_output(
+      ['git', 'diff', '-U0', '--no-color', '--no-ext-diff', '--relative',
+       '--diff-filter=d', '--src-prefix=a/', '--dst-prefix=b/', rev, '--'])
+  output = output.decode('utf8', 'replace')
+  changed_lines = {}
+  file_lines = None
+  in_header = False
+  for line in output.splitlines():
+    # Added lines start with '+' as well, so '+++' is only looked for before
+    # the first hunk of each file.
+    if line.startswith('diff --git '):
+      file_lines = None
+      in_header = True
+    elif in_header and line.startswith('+++ b/'):
+      filename = os.path.normpath(line[len('+++ b/'):].rstrip('\t'))
+      file_lines = changed_lines.setdefault(filename, set())
+    elif line.startswith('@@ ') and file_lines is not None:
+      in_header = False
+      match = _RE_PATTERN_HUNK.match(line)
+      start = int(match.group(1))
+      count = int(match.group(2) or 1)
+      if count:
+        file_lines.update(xrange(start, start + count))
+      else:
+        # Lines were only deleted, after line start.
+        file_lines.update((start, start + 1))
+  return changed_lines
+
+
+_worker_check_functions = []
+
+def _InitWorker(cpplint_state, root, extra_check_functions, symbol_index):
+  """Copies the module-wide settings into a worker process.
+
+  Args:
+    cpplint_state: The _CppLintState of the parent process.
+    root: The --root flag of the parent process.
+    extra_check_functions: The extra check functions of the parent process.
+    symbol_index: The _SymbolIndex of the parent process, or None.
+  """
+  global _cpplint_state, _root, _worker_check_functions, _symbol_index
+  _cpplint_state = cpplint_state
+  _root = root
+  _worker_check_functions = extra_check_functions
+  _symbol_index = symbol_index
+  if cpplint_state.plugins and not _plugins:
+    # The process was not forked from the parent, so import them again.
+    _LoadPlugins(cpplint_state.plugins)
+
+
+def _LintFileInWorker(filename):
+  """Lints a file in a worker process and returns its _FileLintState."""
+  return _LintFile(filename, _cpplint_state.verbose_level,
+                   _worker_check_functions)
+
+
+def ProcessFiles(filenames, jobs, extra_check_functions=[]):
+  """Does google-lint on a list of files.
+
+  Output and error counts are reported in the order of the filenames, even
+  if the files are linted in parallel.
+
+  Args:
+    filenames: The names of the files to parse.
+    jobs: The number of processes to use for linting.
+    extra_check_functions: An array of additional check functions that will be
+                           run on each source line.
+  """
+  if jobs <= 1 or len(filenames) <= 1:
+    for filename in filenames:
+      ProcessFile(filename, _cpplint_state.verbose_level,
+                  extra_check_functions)
+    return
+
+  # Only imported here, as importing it slows down the start of every run.
+  import multiprocessing
+  pool = multiprocessing.Pool(min(jobs, len(filenames)), _InitWorker,
+                              (_cpplint_state, _root, extra_check_functions,
+                               _symbol_index))
+  try:
+    for file_state in pool.imap(_LintFileInWorker, filenames):
+      _cpplint_state.AddFileResults(file_state)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+
+class _Profiler(object):
+  """Collects the figures printed by --profile.
+
+  Install replaces the check functions, and the functions and methods that
+  parse the file for them, with wrappers that add up their calls and time,
+  and Match and Search with versions that count the hits and misses of
+  _regexp_compile_cache.  Since the checks are looked up by name when they
+  are called, the wrappers are used everywhere, including by ProcessLine and
+  ProcessFileData.
+  """
+
+  # Methods timed along with the module's check functions.
+  _METHODS = ((CleansedLines, '__init__', 'CleansedLines'),
+              (_NestingState, 'Update', '_NestingState.Update'),
+              (_NestingState, 'CheckClassFinished',
+               '_NestingState.CheckClassFinished'))
+
+  def __init__(self):
+    self.calls = {}
+    self.seconds = {}
+    self.regexp_hits = 0
+    self.regexp_misses = 0
+    self.start = time.time()
+
+  def Install(self):
+    """Starts profiling all the checks run from now on."""
+    module = globals()
+    wrappers = {}
+    for name, value in list(module.items()):
+      if (isinstance(value, types.FunctionType) and
+          (name.startswith('Check') or name == 'RemoveMultiLineComments')):
+        wrappers[value] = module[name] = self._Wrap(name, value)
+    for check in _LINE_CHECKS:
+      check.function = wrappers[check.function]
+    module['_ART_CHECKS'] = tuple((wrappers[function], categories)
+                                  for function, categories in _ART_CHECKS)
+    for cls, method, name in self._METHODS:
+      setattr(cls, method, self._Wrap(name, cls.__dict__[method]))
+    module['Match'] = self._Match
+    module['Search'] = self._Search
+    self.start = time.time()
+
+  def _Wrap(self, name, function):
+    calls = self.calls
+    seconds = self.seconds
+    calls[name] = 0
+    seconds[name] = 0.0
+
+    def Timed(*args, **kwargs):
+      start = time.time()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        seconds[name] += time.time() - start
+        calls[name] += 1
+    Timed.__name__ = function.__name__
+    Timed.__doc__ = function.__doc__
+    return Timed
+
+  def _Compiled(self, pattern):
+    if pattern in _regexp_compile_cache:
+      self.regexp_hits += 1
+    else:
+      self.regexp_misses += 1
+    return _CompileRegexp(pattern)
+
+  def _Match(self, pattern, s):
+    return self._Compiled(pattern).match(s)
+
+  def _Search(self, pattern, s):
+    return self._Compiled(pattern).search(s)
+
+  def Figures(self):
+    """Returns the figures collected so far as a JSON-compatible dict."""
+    checks = [{'name': name, 'calls': self.calls[name],
+               'seconds': self.seconds[name]}
+              for name in self.calls if self.calls[name]]
+    checks.sort(key=lambda check: (-check['seconds'], check['name']))
+    return {'seconds': time.time() - self.start,
+            'checks': checks,
+            'regexp_cache': {'hits': self.regexp_hits,
+                             'misses': self.regexp_misses}}
+
+  def Report(self, stream, filename):
+    """Prints the ranked table to stream and writes the JSON to filename."""
+    figures = self.Figures()
+    total = figures['seconds'] or 1.0
+    stream.write('%-44s %10s %10s %7s\n' %
+                 ('Check', 'Calls', 'Seconds', 'Share'))
+    for check in figures['checks']:
+      stream.write('%-44s %10d %10.3f %6.1f%%\n' %
+                   (check['name'], check['calls'], check['seconds'],
+                    100 * check['seconds'] / total))
+    stream.write('Total time: %.3f seconds\n' % figures['seconds'])
+    stream.write('Regexp cache: %d hits, %d misses\n' %
+                 (self.regexp_hits, self.regexp_misses))
+    with open(filename, 'w') as f:
+      json.dump(figures, f, indent=2, separators=(',', ': '), sort_keys=True)
+      f.write('\n')
+
+
+# The directories of the ART tree --include-graph looks at by default.
+_INCLUDE_GRAPH_DIRECTORIES = ('runtime', 'compiler', 'dex2oat')
+
+# The directories ART's makefiles put on the include path of every module,
+# after the directory of the including file and that of its module.
+_ART_INCLUDE_DIRECTORIES = ('runtime', '')
+
+
+def _ArtDirectory():
+  """Returns the top directory of the ART tree holding this script."""
+  return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _IncludeGraph(object):
+  """The include graph of the C++ files of the ART tree, for --include-graph.
+
+  Quoted includes are resolved the way ART's makefiles set up the include
+  path: relative to the including file, then to the top directory of its
+  module, such as compiler/, then to runtime/ and to the top of the tree.
+  Includes that do not resolve to a file of the tree, such as those of the
+  C and C++ libraries, are kept as external includes of their file.
+
+  Attributes:
+    root: The top directory of the tree.
+    files: The paths of the files of the graph relative to root, sources
+      first, then the headers they reach, in the order they were found.
+    lines: The number of lines of each file, by path.
+    size: The number of bytes of each file, by path.
+    includes: The paths of the files each file includes, by path.
+    external: The includes of each file that were not resolved, by path.
+  """
+
+  def __init__(self, root, paths):
+    self.root = root
+    self.files = []
+    self.lines = {}
+    self.size = {}
+    self.includes = {}
+    self.external = {}
+    pending = list(paths)
+    while pending:
+      path = pending.pop(0)
+      if path in self.includes:
+        continue
+      self._ReadFile(path)
+      pending.extend(self.includes[path])
+
+  def _ReadFile(self, path):
+    with open(os.path.join(self.root, path), 'rb') as f:
+      contents = f.read()
+    lines = contents.decode('utf8', 'replace').splitlines()
+    self.files.append(path)
+    self.lines[path] = len(lines)
+    self.size[path] = len(contents)
+    includes = self.includes[path] = []
+    external = self.external[path] = []
+    for line in lines:
+      if '#' not in line:
+        continue
+      match = _RE_PATTERN_INCLUDE.search(CleanseComments(line))
+      if not match:
+        continue
+      include = match.group(2)
+      resolved = None
+      if match.group(1) == '"':
+        resolved = self._Resolve(path, include)
+      if resolved is None:
+        external.append(include)
+      elif resolved not in includes:
+        includes.append(resolved)
+
+  def _Resolve(self, path, include):
+    directory = os.path.dirname(path)
+    candidates = [directory, directory.split('/')[0]]
+    candidates.extend(_ART_INCLUDE_DIRECTORIES)
+    for candidate in candidates:
+      resolved = os.path.normpath(os.path.join(candidate, include))
+      if (not resolved.startswith('..') and
+          os.path.isfile(os.path.join(self.root, resolved))):
+        return resolved.replace(os.sep, '/')
+    return None
+
+  def Closure(self, path):
+    """Returns the set of files a file includes, itself included."""
+    closure = set([path])
+    pending = [path]
+    while pending:
+      for include in self.includes[pending.pop()]:
+        if include not in closure:
+          closure.add(include)
+          pending.append(include)
+    return closure
+
+  def DominatedSizes(self, source):
+    """Works out what each header costs a translation unit.
+
+    A header dominates the files that the translation unit only reaches
+    through it.  These are the files it would no longer preprocess if the
+    header included nothing.
+
+    Args:
+      source: The path of the source file of the translation unit.
+
+    Returns:
+      A dict from each file reached from source, other than source, to the
+      number of bytes of the files it dominates, itself included.
+    """
+    # Number the files in reverse postorder and find their immediate
+    # dominators, as in "A Simple, Fast Dominance Algorithm" by Cooper,
+    # Harvey and Kennedy.
+    order = []
+    visited = set([source])
+    stack = [(source, iter(self.includes[source]))]
+    while stack:
+      path, children = stack[-1]
+      for child in children:
+        if child not in visited:
+          visited.add(child)
+          stack.append((child, iter(self.includes[child])))
+          break
+      else:
+        stack.pop()
+        order.append(path)
+    order.reverse()
+    number = dict((path, i) for i, path in enumerate(order))
+    predecessors = [[] for _ in order]
+    for path in order:
+      for include in self.includes[path]:
+        predecessors[number[include]].append(number[path])
+    idom = [None] * len(order)
+    idom[0] = 0
+    changed = True
+    while changed:
+      changed = False
+      for i in xrange(1, len(order)):
+        new_idom = None
+        for p in predecessors[i]:
+          if idom[p] is None:
+            continue
+          if new_idom is None:
+            new_idom = p
+            continue
+          a, b = p, new_idom
+          while a != b:
+            while a > b:
+              a = idom[a]
+            while b > a:
+              b = idom[b]
+          new_idom = a
+        if idom[i] != new_idom:
+          idom[i] = new_idom
+          changed = True
+
+    # Files come after their dominators in reverse postorder, so adding up
+    # from the back gives the size of each dominator subtree.
+    sizes = [self.size[path] for path in order]
+    for i in xrange(len(order) - 1, 0, -1):
+      sizes[idom[i]] += sizes[i]
+    return dict((order[i], sizes[i]) for i in xrange(1, len(order)))
+
+  def Report(self):
+    """Returns the figures of every file, as written to the JSON report.
+
+    Returns:
+      A dict with a list of the 'sources' and one of the 'headers', each
+      file given by its path, lines, bytes, includes, external includes and
+      the files, lines and bytes of its transitive closure.  Headers also
+      have their number of 'dependents', the translation units reaching
+      them, of 'direct_dependents', the files including them, and the
+      'slimming_bytes', the bytes the translation units would no longer
+      preprocess if the header included nothing, by which they are ranked.
+    """
+    sources = [path for path in self.files if not path.endswith('.h')]
+    dependents = dict((path, 0) for path in self.files)
+    direct_dependents = dict((path, 0) for path in self.files)
+    slimming = dict((path, 0) for path in self.files)
+    for path in self.files:
+      for include in self.includes[path]:
+        direct_dependents[include] += 1
+    for source in sources:
+      for path, size in iteritems(self.DominatedSizes(source)):
+        dependents[path] += 1
+        slimming[path] += size - self.size[path]
+
+    def Figures(path):
+      closure = self.Closure(path)
+      return {'file': path,
+              'lines': self.lines[path],
+              'bytes': self.size[path],
+              'includes': self.includes[path],
+              'external_includes': self.external[path],
+              'closure_files': len(closure),
+              'closure_lines': sum(self.lines[f] for f in closure),
+              'closure_bytes': sum(self.size[f] for f in closure)}
+
+    headers = []
+    for path in self.files:
+      if path.endswith('.h'):
+        figures = Figures(path)
+        figures['dependents'] = dependents[path]
+        figures['direct_dependents'] = direct_dependents[path]
+        figures['slimming_bytes'] = slimming[path]
+        headers.append(figures)
+    headers.sort(key=lambda figures: (-figures['slimming_bytes'],
+                                      figures['file']))
+    return {'root': self.root,
+            'sources': [Figures(path) for path in sources],
+            'headers': headers}
+
+  def WriteDot(self, stream, report):
+    """Writes the graph in the dot language of Graphviz."""
+    stream.write('digraph includes {\n')
+    stream.write('  node [shape=box, fontsize=10];\n')
+    for figures in report['sources'] + report['headers']:
+      label = '%s\\n%d lines, %d in closure' % (
+          figures['file'], figures['lines'], figures['closure_lines'])
+      if 'dependents' in figures:
+        label += '\\n%d dependents' % figures['dependents']
+      stream.write('  "%s" [label="%s"%s];\n' % (
+          figures['file'], label,
+          '' if 'dependents' in figures else ', style=filled'))
+    for path in self.files:
+      for include in self.includes[path]:
+        stream.write('  "%s" -> "%s";\n' % (path, include))
+    stream.write('}\n')
+
+
+def _IncludeGraphSources(root, filenames):
+  """Returns the paths of the files --include-graph starts from.
+
+  Args:
+    root: The top directory of the tree.
+    filenames: The files and directories given on the command line, or an
+      empty list for the _INCLUDE_GRAPH_DIRECTORIES of the tree.
+
+  Returns:
+    The paths relative to root of the .h, .cc and .cpp files given or found
+    in the directories, sorted.
+  """
+  if not filenames:
+    filenames = [os.path.join(root, directory)
+                 for directory in _INCLUDE_GRAPH_DIRECTORIES
+                 if os.path.isdir(os.path.join(root, directory))]
+  paths = set()
+  for filename in filenames:
+    if os.path.isdir(filename):
+      for dirpath, dirnames, names in os.walk(filename):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        paths.update(os.path.join(dirpath, name) for name in names
+                     if os.path.splitext(name)[1] in ('.cc', '.h', '.cpp'))
+    elif os.path.isfile(filename):
+      paths.add(filename)
+    else:
+      sys.stderr.write(
+          "Skipping input '%s': Can't open for reading\n" % filename)
+  return sorted(os.path.relpath(os.path.abspath(path), root).replace(
+      os.sep, '/') for path in paths)
+
+
+def PrintIncludeGraph(filenames, output):
+  """Writes the --include-graph report of the files.
+
+  Writes output + '.json' and output + '.dot', and prints the headers whose
+  slimming would save the most preprocessed bytes.
+
+  Args:
+    filenames: The files and directories to start from, see
+      _IncludeGraphSources.
+    output: The path of the reports, without extension.
+  """
+  root = _ArtDirectory()
+  graph = _IncludeGraph(root, _IncludeGraphSources(root, filenames))
+  report = graph.Report()
+  with open(output + '.json', 'w') as f:
+    json.dump(report, f, indent=2, separators=(',', ': '), sort_keys=True)
+    f.write('\n')
+  with open(output + '.dot', 'w') as f:
+    graph.WriteDot(f, report)
+
+  sys.stderr.write('%d sources, %d headers\n' %
+                   (len(report['sources']), len(report['headers'])))
+  sys.stderr.write('%-52s %10s %8s %8s %13s\n' %
+                   ('Header', 'Dependents', 'Files', 'Lines',
+                    'Slimming (B)'))
+  for figures in report['headers'][:30]:
+    sys.stderr.write('%-52s %10d %8d %8d %13d\n' %
+                     (figures['file'], figures['dependents'],
+                      figures['closure_files'], figures['closure_lines'],
+                      figures['slimming_bytes']))
+
+
+def _CommonPrefixLength(a, b):
+  """Returns the number of leading items that the lists a and b share."""
+  # Compare halving slices, so that the items are compared in C.
+  low, high = 0, min(len(a), len(b))
+  while low < high:
+    middle = (low + high + 1) // 2
+    if a[low:middle] == b[low:middle]:
+      low = middle
+    else:
+      high = middle - 1
+  return low
+
+
+def _NestingBlocks(nesting_state):
+  """Returns the blocks on the stacks of a nesting state, each one once.
+
+  Besides the current stack, these are the stacks saved by the #if and #else
+  directives the state is in, which share blocks with it.
+  """
+  blocks = []
+  seen = set()
+  for frame in (nesting_state._top,) + tuple(
+      pp.stack_before_if for pp in nesting_state.pp_stack) + tuple(
+          pp.stack_before_else for pp in nesting_state.pp_stack):
+    while frame:
+      if id(frame.block) not in seen:
+        seen.add(id(frame.block))
+        blocks.append(frame.block)
+      frame = frame.parent
+  return blocks
+
+
+class _LineShift(object):
+  """An edit that moved the lines after it, to apply to a saved state.
+
+  The checkpoints of the _IncrementalLinter which are reused after an edit
+  that added or removed lines still hold the line numbers from before it.
+  Rather than unpickling all of them on every edit, each keeps the edits it
+  has not been moved past yet, as a chain from the latest one.
+  """
+
+  __slots__ = ('previous', 'end', 'delta')
+
+  def __init__(self, previous, end, delta):
+    self.previous = previous
+    self.end = end
+    self.delta = delta
+
+
+def _ShiftLineNumbers(state, end, delta):
+  """Moves the line numbers in a state past an edit that added lines.
+
+  Args:
+    state: A tuple of the _IncludeState, _FunctionState and _NestingState
+           carried from line to line, which is changed in place.
+    end: The end of the edited lines, before the edit.  The line numbers from
+         there on are moved.
+    delta: The number of lines the edit added, negative if it removed lines.
+  """
+  include_state, function_state, nesting_state = state
+  for include, linenum in list(include_state.items()):
+    # The includes of headers are recorded as 'header:line' strings.
+    if isinstance(linenum, int) and linenum >= end:
+      include_state[include] = linenum + delta
+  function_state.pending_linenums = [
+      linenum + delta if linenum >= end else linenum
+      for linenum in function_state.pending_linenums]
+  for block in _NestingBlocks(nesting_state):
+    for name in ('starting_linenum', 'last_line'):
+      linenum = getattr(block, name, 0)
+      if linenum >= end:
+        setattr(block, name, linenum + delta)
+
+
+def _NestingSummary(frame):
+  """Returns the blocks of a nesting stack as a list of comparable values."""
+  blocks = []
+  while frame:
+    blocks.append((type(frame.block), dict(vars(frame.block))))
+    frame = frame.parent
+  return blocks
+
+
+def _StateSummary(include_state, function_state, nesting_state):
+  """Returns a value that equals another summary iff the states are equal.
+
+  The generations of the nesting state are left out, as they only count how
+  often the stack was saved.  So is the number of lines in the current
+  function, which callers compare on their own; outside of a function it is
+  not used again before it is reset.
+  """
+  return (dict(include_state), dict(vars(include_state)),
+          function_state.in_a_function and function_state.current_function,
+          function_state.pending_function,
+          _NestingSummary(nesting_state._top),
+          [(_NestingSummary(pp.stack_before_if),
+            _NestingSummary(pp.stack_before_else), pp.seen_else)
+           for pp in nesting_state.pp_stack])
+
+
+class _IncrementalLinter(object):
+  """Relints a file that is being edited, reusing the work of the last run.
+
+  The linter keeps the lines of the last run, the errors reported while
+  processing each line, and a pickled checkpoint of the state carried from
+  line to line (includes, function and nesting state) every
+  _CHECKPOINT_INTERVAL lines.  After an edit, processing resumes from the
+  last checkpoint at least _CONTEXT_LINES before the first edited line.  It
+  stops at the first checkpoint of the last run at least _CONTEXT_LINES after
+  the last edited line whose state is the same as it is now; the following
+  lines keep the errors and checkpoints of the last run, with the line
+  numbers in them moved by the number of lines added or removed.
+
+  The context lines are for the checks that look at the lines around the
+  one being processed.  An error found by looking further than that from an
+  edit, e.g. across a statement of more than _CONTEXT_LINES lines, is only
+  updated when the file is linted in full.  The exception is the end of a
+  class, which the checks of all its lines depend on: if an edit moves it,
+  processing resumes before the start of the class.
+
+  NOLINT comments only apply to errors reported for their own line once it
+  has been processed, so errors are recorded without them and suppressed
+  when the output is put together.
+  """
+
+  _CHECKPOINT_INTERVAL = 8
+  _CONTEXT_LINES = 8
+
+  def __init__(self, filename, extra_check_functions=[]):
+    self.filename = filename
+    self.file_extension = filename[filename.rfind('.') + 1:]
+    self._extra_check_functions = extra_check_functions
+    self._file_context = _FileContext(filename, self.file_extension)
+    self._clean_lines = None
+    # For each line, the errors reported while processing it, as tuples of
+    # (line offset, category, confidence, message).
+    self._line_errors = []
+    # Sorted lists of the lines with checkpoints, and of the checkpoints: the
+    # pickled states before processing each of those lines.
+    self._checkpoint_lines = []
+    self._checkpoints = []
+    # The (starting line, last line) of the classes still open after the line
+    # they start on, in order.  The spacing checks of the lines in a class
+    # depend on where it ends, however far from them that is.
+    self._class_extents = []
+    self._include_state = None
+    self._class_errors = []
+    self._line_requirements = {}
+    self._errors = None
+    self._contents = None
+    self._lines = None
+
+  def _Record(self, filename, linenum, category, confidence, message):
+    """An error function that records the errors that may be printed."""
+    if (confidence >= _cpplint_state.verbose_level and
+        _cpplint_state.PassesFilters(category)):
+      self._errors.append((linenum, category, confidence, message))
+
+  def Lint(self, contents):
+    """Lints the current contents of the file.
+
+    Args:
+      contents: The contents of the file, as unicode.
+
+    Returns:
+      A _FileLintState holding the output and the errors of the file, the
+      same as _LintFile would return for these contents.
+    """
+    global _file_lint_state
+    _file_lint_state = _FileLintState(self.filename)
+    try:
+      if self.file_extension not in ('cc', 'h', 'cpp'):
+        _file_lint_state.Write('Ignoring %s; not a .cc or .h file\n' %
+                               self.filename)
+      else:
+        lines, carriage_return_found = self._SplitLines(contents)
+        _StartPluginTimers()
+        self._LintLines(lines)
+        if carriage_return_found and os.linesep != '\r\n':
+          Error(self.filename, 0, 'whitespace/newline', 1,
+                'One or more unexpected \\r (^M) found;'
+                'better to use only a \\n')
+        _StopPluginTimers(self.filename)
+      _file_lint_state.Write('Done processing %s\n' % self.filename)
+      return _file_lint_state
+    finally:
+      _file_lint_state = _UnattachedLintState()
+
+  def _SplitLines(self, contents):
+    """Like _SplitLines, but only splits the lines edited since last time."""
+    old = self._contents
+    self._contents = contents
+    if old is None or '\r' in contents or '\r' in old:
+      self._lines, carriage_return_found = _SplitLines(contents)
+      return self._lines, carriage_return_found
+
+    # contents[begin_pos:new_end_pos] replaced the lines self._lines[begin:end].
+    prefix = _CommonPrefixLength(contents, old)
+    suffix = _CommonPrefixLength(contents[prefix:][::-1], old[prefix:][::-1])
+    begin = old.count('\n', 0, prefix)
+    end = old.count('\n', 0, len(old) - suffix) + 1
+    begin_pos = old.rfind('\n', 0, prefix) + 1
+    new_end_pos = contents.find('\n', len(contents) - suffix)
+    if new_end_pos < 0:
+      new_end_pos = len(contents)
+    self._lines = (self._lines[:begin] +
+                   contents[begin_pos:new_end_pos].split('\n') +
+                   self._lines[end:])
+    return self._lines, False
+
+  def _LintLines(self, lines):
+    """Does what ProcessFileData does, reusing the last run where it can."""
+    filename = self.filename
+    lines = (['// marker so line numbers and indices both start at 1'] + lines +
+             ['// marker so line numbers end in a known way'])
+
+    self._errors = []
+    CheckForCopyright(filename, lines, self._Record)
+    if self.file_extension == 'h':
+      CheckForHeaderGuard(filename, lines, self._Record)
+    RemoveMultiLineComments(filename, lines, self._Record)
+    file_errors = self._errors
+
+    # Find the edited lines: lines[begin:new_end] replaced old[begin:end].
+    old = self._clean_lines
+    if old is None:
+      begin = end = 0
+      new_end = len(lines)
+      clean_lines = CleansedLines(lines)
+    else:
+      old_lines = old.raw_lines
+      begin = _CommonPrefixLength(lines, old_lines)
+      suffix = _CommonPrefixLength(lines[begin:][::-1],
+                                   old_lines[begin:][::-1])
+      end = len(old_lines) - suffix
+      new_end = len(lines) - suffix
+      clean_lines = old.Splice(lines, begin, end, new_end)
+    delta = new_end - end
+
+    # Resume from the last checkpoint far enough before the edit, and before
+    # any class whose end the edit moved.
+    resume = begin
+    for class_start, last_line in self._class_extents:
+      if class_start >= begin:
+        break
+      if 0 < last_line < begin:
+        continue
+      if not last_line:
+        moved = 0
+      elif last_line >= end:
+        moved = last_line + delta
+      else:
+        moved = None
+      if (clean_lines.BracketIndex().BlockEnd(class_start) or 0) != moved:
+        resume = class_start
+        break
+    index = bisect.bisect_right(self._checkpoint_lines,
+                                resume - self._CONTEXT_LINES) - 1
+    if index < 0:
+      start = 0
+      include_state = _IncludeState()
+      function_state = _FunctionState()
+      nesting_state = _NestingState()
+    else:
+      start = self._checkpoint_lines[index]
+      include_state, function_state, nesting_state = self._LoadCheckpoint(
+          self._checkpoints[index])
+      # The ends of the classes were found in the old lines.
+      for block in _NestingBlocks(nesting_state):
+        if isinstance(block, _ClassInfo) and (
+            block.last_line >= begin or not block.last_line):
+          block.last_line = clean_lines.BracketIndex().BlockEnd(
+              block.starting_linenum) or 0
+    old_checkpoint_lines = self._checkpoint_lines[index + 1:]
+    old_checkpoints = dict(zip(old_checkpoint_lines,
+                               self._checkpoints[index + 1:]))
+    old_line_errors = self._line_errors
+    line_errors = old_line_errors[:start]
+    old_class_extents = self._class_extents
+    class_extents = [
+        (class_start, last_line + delta if last_line >= end else last_line)
+        for class_start, last_line in old_class_extents[
+            :bisect.bisect_left(old_class_extents, (start,))]]
+    checkpoint_lines = self._checkpoint_lines[:max(index, 0)]
+    checkpoints = self._checkpoints[:max(index, 0)]
+    # The old checkpoints and errors after the edit are reused with their
+    # line numbers moved by delta.
+    shifts = {}
+    def Shifted(checkpoint):
+      data, shift = checkpoint
+      if not delta:
+        return checkpoint
+      if shift not in shifts:
+        shifts[shift] = _LineShift(shift, end, delta)
+      return data, shifts[shift]
+    def LoadShifted(checkpoint):
+      state = self._LoadCheckpoint(checkpoint)
+      if delta:
+        _ShiftLineNumbers(state, end, delta)
+      return state
+    def ShiftedClassExtents(first, last):
+      return [(class_start + delta, last_line and last_line + delta)
+              for class_start, last_line in old_class_extents[
+                  bisect.bisect_left(old_class_extents, (first,)):
+                  bisect.bisect_left(old_class_extents, (last,))]]
+
+    converged = False
+    linenum = start
+    while linenum < clean_lines.NumLines():
+      old_linenum = linenum - delta
+      # A pending function start is reported at the end of the file if no
+      # body follows, from a line that may have moved, so wait for it to be
+      # decided.
+      if (old_linenum in old_checkpoints and
+          linenum >= new_end + self._CONTEXT_LINES and
+          function_state.pending_function is None):
+        old_state = LoadShifted(old_checkpoints[old_linenum])
+        if (_StateSummary(*old_state) ==
+            _StateSummary(include_state, function_state, nesting_state)):
+          count = (function_state.lines_in_function -
+                   old_state[1].lines_in_function)
+          if not function_state.in_a_function or not count:
+            converged = True
+            break
+          # Only the number of lines of the current function differs, which
+          # matters when the function ends.  Until the next line that can end
+          # or begin a function, take the old run's results and correct the
+          # number in its checkpoints.
+          target = linenum
+          while (target < clean_lines.NumLines() and
+                 not Match(r'[\w}]', clean_lines.lines[target])):
+            target += 1
+          first = bisect.bisect_left(old_checkpoint_lines, old_linenum)
+          last = bisect.bisect_right(old_checkpoint_lines, target - delta) - 1
+          if last > first:
+            for checkpoint_linenum in old_checkpoint_lines[first:last + 1]:
+              old_state = LoadShifted(old_checkpoints[checkpoint_linenum])
+              old_state[1].lines_in_function += count
+              checkpoint_lines.append(checkpoint_linenum + delta)
+              checkpoints.append(self._SaveCheckpoint(old_state))
+            include_state, function_state, nesting_state = old_state
+            line_errors.extend(self._ShiftErrors(
+                old_line_errors[old_linenum:checkpoint_linenum], end, delta))
+            class_extents.extend(
+                ShiftedClassExtents(old_linenum, checkpoint_linenum))
+            linenum = checkpoint_linenum + delta
+            continue
+      if linenum == start or (
+          linenum - checkpoint_lines[-1] >= self._CHECKPOINT_INTERVAL):
+        checkpoint_lines.append(linenum)
+        checkpoints.append(self._SaveCheckpoint(
+            (include_state, function_state, nesting_state)))
+      self._errors = []
+      ProcessLine(filename, self.file_extension, clean_lines, linenum,
+                  include_state, function_state, nesting_state, self._Record,
+                  self._extra_check_functions, self._file_context)
+      line_errors.append(tuple(
+          (error[0] - linenum,) + error[1:] for error in self._errors))
+      opened = []
+      frame = nesting_state._top
+      while frame and getattr(frame.block, 'starting_linenum',
+                              linenum) == linenum:
+        if isinstance(frame.block, _ClassInfo):
+          opened.append((linenum, frame.block.last_line))
+        frame = frame.parent
+      class_extents.extend(reversed(opened))
+      linenum += 1
+
+    # The lines after the ones processed keep the results of the last run.
+    if converged:
+      tail = linenum - delta
+      line_errors.extend(
+          self._ShiftErrors(old_line_errors[tail:], end, delta))
+      class_extents.extend(
+          ShiftedClassExtents(tail, len(old_line_errors) + 1))
+      first = bisect.bisect_left(old_checkpoint_lines, tail)
+      for checkpoint_linenum in old_checkpoint_lines[first:]:
+        checkpoint_lines.append(checkpoint_linenum + delta)
+        checkpoints.append(Shifted(old_checkpoints[checkpoint_linenum]))
+      self._class_errors = [
+          (error[0] + delta if error[0] >= end else error[0],) + error[1:]
+          for error in self._class_errors]
+    else:
+      self._errors = []
+      nesting_state.CheckClassFinished(filename, self._Record)
+      function_state.CheckBodyFound(filename, self._Record)
+      self._class_errors = self._errors
+      self._include_state = include_state
+    self._line_errors = line_errors
+    self._class_extents = class_extents
+    self._checkpoint_lines = checkpoint_lines
+    self._checkpoints = checkpoints
+    self._clean_lines = clean_lines
+
+    self._errors = []
+    if _cpplint_state.AnyCategoryPassesFilters(('build/include_what_you_use',)):
+      if len(self._line_requirements) > 2 * len(lines):
+        self._line_requirements.clear()
+      CheckForIncludeWhatYouUse(filename, clean_lines, self._include_state,
+                                self._Record,
+                                line_requirements=self._line_requirements)
+    _RunPluginFileChecks(filename, clean_lines, self._Record)
+    if u'\ufffd' in self._contents:
+      CheckForUnicodeReplacementCharacters(filename, lines, self._Record)
+    CheckForNewlineAtEOF(filename, lines, self._Record)
+    final_errors = self._class_errors + self._errors
+    self._errors = None
+
+    self._Report(file_errors, final_errors)
+
+  @staticmethod
+  def _SaveCheckpoint(state):
+    """Returns a checkpoint of the state carried from line to line."""
+    return pickle.dumps(state, pickle.HIGHEST_PROTOCOL), None
+
+  @staticmethod
+  def _LoadCheckpoint(checkpoint):
+    """Returns the state saved in a checkpoint, moved past later edits."""
+    data, shift = checkpoint
+    state = pickle.loads(data)
+    shifts = []
+    while shift:
+      shifts.append(shift)
+      shift = shift.previous
+    for shift in reversed(shifts):
+      _ShiftLineNumbers(state, shift.end, shift.delta)
+    return state
+
+  def _ShiftErrors(self, line_errors, end, delta):
+    """Moves the lines of the file named in reused error messages.
+
+    The errors of a line are recorded relative to it, so they move with it,
+    but a message can name another line, as in '"x.h" already included at
+    file:line'.
+
+    Args:
+      line_errors: The errors recorded for each of a run of lines.
+      end: The end of the edited lines, before the edit.
+      delta: The number of lines the edit added, negative if it removed lines.
+
+    Returns:
+      The errors, with the lines named in their messages moved.
+    """
+    if not delta:
+      return line_errors
+    reference = '%s:' % self.filename
+    pattern = _CompileRegexp(r'(\s%s)(\d+)' % re.escape(reference),
+                             bundled=False)
+    def Shift(match):
+      linenum = int(match.group(2))
+      return match.group(1) + str(linenum + delta if linenum >= end
+                                  else linenum)
+    shifted = []
+    for errors in line_errors:
+      if any(reference in error[3] for error in errors):
+        errors = tuple(error[:3] + (pattern.sub(Shift, error[3]),)
+                       for error in errors)
+      shifted.append(errors)
+    return shifted
+
+  def _Report(self, file_errors, final_errors):
+    """Writes the recorded errors which are not suppressed by a NOLINT."""
+    filename = self.filename
+    raw_lines = self._clean_lines.raw_lines
+    if 'NOLINT' in self._contents:
+      for linenum, line in enumerate(raw_lines):
+        if 'NOLINT' in line:
+          ParseNolintSuppressions(filename, line, linenum, lambda *args: None)
+    errors = [(-1, error) for error in file_errors]
+    for linenum, recorded in enumerate(self._line_errors):
+      for error in recorded:
+        errors.append((linenum, (linenum + error[0],) + error[1:]))
+    errors.extend((len(raw_lines), error) for error in final_errors)
+    for processed, (linenum, category, confidence, message) in errors:
+      if linenum <= processed and IsErrorSuppressedByNolint(category, linenum):
+        continue
+      _file_lint_state.IncrementErrorCount(category)
+      _file_lint_state.Write(
+          _FormatError(filename, linenum, category, confidence, message))
+
+
+def _ServeRequests(requests, responses, extra_check_functions=[]):
+  """Lints the files that an editor sends, until it closes the requests.
+
+  Every request and response is a JSON object on a line of its own.  A
+  request {"file": name, "contents": text} lints text as the contents of the
+  file name, incrementally if the file was linted before; adding "full": true
+  lints it from scratch.  The response is {"file": name, "output": text,
+  "error_count": count}, where text is what cpplint would print for the file.
+  A request {"file": name, "close": true} forgets the file, and gets the
+  response {"file": name}.
+
+  Args:
+    requests: The stream to read requests from.
+    responses: The stream to write responses to.
+    extra_check_functions: An array of additional check functions that will be
+                           run on each source line.
+  """
+  linters = {}
+  for request in iter(requests.readline, ''):
+    if not request.strip():
+      continue
+    request = json.loads(request)
+    filename = request['file']
+    response = {'file': filename}
+    if request.get('close'):
+      linters.pop(filename, None)
+    else:
+      if request.get('full') or filename not in linters:
+        linters[filename] = _IncrementalLinter(filename,
+                                               extra_check_functions)
+      file_state = linters[filename].Lint(request['contents'])
+      response['output'] = file_state.Output()
+      response['error_count'] = file_state.error_count
+    responses.write(json.dumps(response) + '\n')
+    responses.flush()
 
 
 def PrintUsage(message):
@@ -3972,7 +8437,17 @@ def ParseArguments(args):
                                                  'stdout', # TODO(enh): added --stdout
                                                  'counting=',
                                                  'filter=',
-                                                 'root='])
+                                                 'root=',
+                                                 'jobs=',
+                                                 'cache-dir=',
+                                                 'stamp-dir=',
+                                                 'server',
+                                                 'diff=',
+                                                 'profile=',
+                                                 'plugin=',
+                                                 'plugin-budget=',
+                                                 'index=',
+                                                 'include-graph='])
   except getopt.GetoptError:
     PrintUsage('Invalid arguments.')
 
@@ -3980,7 +8455,18 @@ def ParseArguments(args):
   output_format = _OutputFormat()
   output_stream = sys.stderr # TODO(enh): added --stdout
   filters = ''
+  list_categories = False
   counting_style = ''
+  jobs = 1
+  cache_dir = None
+  stamp_dir = None
+  server = False
+  diff_rev = None
+  profile = None
+  plugins = []
+  plugin_budget = 100
+  index = None
+  include_graph = None
 
   for (opt, val) in opts:
     if opt == '--help':
@@ -3988,15 +8474,15 @@ def ParseArguments(args):
     elif opt == '--stdout': # TODO(enh): added --stdout
       output_stream = sys.stdout # TODO(enh): added --stdout
     elif opt == '--output':
-      if not val in ('emacs', 'vs7', 'eclipse'):
-        PrintUsage('The only allowed output formats are emacs, vs7 and eclipse.')
+      if not val in ('emacs', 'vs7', 'eclipse') + _STRUCTURED_OUTPUT_FORMATS:
+        PrintUsage('The only allowed output formats are emacs, vs7, eclipse, '
+                   'jsonl and sarif.')
       output_format = val
     elif opt == '--verbose':
       verbosity = int(val)
     elif opt == '--filter':
       filters = val
-      if not filters:
-        PrintCategories()
+      list_categories = not filters
     elif opt == '--counting':
       if val not in ('total', 'toplevel', 'detailed'):
         PrintUsage('Valid counting options are total, toplevel, and detailed')
@@ -4004,14 +8490,90 @@ def ParseArguments(args):
     elif opt == '--root':
       global _root
       _root = val
+    elif opt == '--jobs':
+      try:
+        jobs = int(val)
+      except ValueError:
+        PrintUsage('Jobs must be a positive number.')
+      if jobs < 1:
+        PrintUsage('Jobs must be a positive number.')
+    elif opt == '--cache-dir':
+      cache_dir = val
+    elif opt == '--stamp-dir':
+      stamp_dir = val
+    elif opt == '--server':
+      server = True
+    elif opt == '--diff':
+      diff_rev = val
+    elif opt == '--profile':
+      profile = val
+    elif opt == '--plugin':
+      plugins.append(val)
+    elif opt == '--plugin-budget':
+      try:
+        plugin_budget = int(val)
+      except ValueError:
+        PrintUsage('The plugin budget must be a number of milliseconds.')
+    elif opt == '--index':
+      index = val
+    elif opt == '--include-graph':
+      include_graph = val
 
-  if not filenames:
+  try:
+    _LoadPlugins(plugins)
+  except (ImportError, ValueError) as e:
+    PrintUsage('Could not load the plugins: %s' % e)
+
+  if list_categories:
+    # Lists the categories of the plugins too.
+    PrintCategories()
+
+  if (not filenames and not server and diff_rev is None and
+      include_graph is None):
     PrintUsage('No files were specified.')
 
+  changed_lines = None
+  if diff_rev is not None:
+    if server or stamp_dir:
+      PrintUsage('--diff cannot be used with --server or --stamp-dir.')
+    try:
+      changed_lines = _GitChangedLines(diff_rev)
+    except (OSError, subprocess.CalledProcessError):
+      PrintUsage('Could not ask git for the changes since %s.' % diff_rev)
+    if filenames:
+      filenames = [filename for filename in filenames
+                   if os.path.normpath(filename) in changed_lines]
+    else:
+      filenames = sorted(
+          filename for filename in changed_lines
+          if os.path.splitext(filename)[1] in ('.cc', '.h', '.cpp'))
+
+  if index and server:
+    PrintUsage('--index cannot be used with --server.')
+
+  if output_format in _STRUCTURED_OUTPUT_FORMATS and (server or profile):
+    PrintUsage('--output=%s cannot be used with --server or --profile.' %
+               output_format)
+
+  if profile:
+    # Every check has to run in this process to be timed.
+    jobs = 1
+    cache_dir = None
+
   _SetOutputFormat(output_format)
   _SetVerboseLevel(verbosity)
   _SetFilters(filters)
   _SetCountingStyle(counting_style)
+  _cpplint_state.jobs = jobs
+  _cpplint_state.cache_dir = cache_dir
+  _cpplint_state.stamp_dir = stamp_dir
+  _cpplint_state.server = server
+  _cpplint_state.changed_lines = changed_lines
+  _cpplint_state.profile = profile
+  _cpplint_state.plugins = plugins
+  _cpplint_state.plugin_budget = plugin_budget / 1000.0
+  _cpplint_state.index = index
+  _cpplint_state.include_graph = include_graph
   sys.stderr = output_stream # TODO(enh): added --stdout
 
   return filenames
@@ -4022,15 +8584,47 @@ def main():
 
   # Change stderr to write with replacement characters so we don't die
   # if we try to print something containing non-ASCII characters.
-  sys.stderr = codecs.StreamReaderWriter(sys.stderr,
+  sys.stderr = codecs.StreamReaderWriter(_BinaryStream(sys.stderr),
                                          codecs.getreader('utf8'),
                                          codecs.getwriter('utf8'),
                                          'replace')
 
+  if _cpplint_state.cache_dir and _RegexpBundle.IsSupported():
+    global _regexp_bundle
+    _regexp_bundle = _RegexpBundle(_cpplint_state.cache_dir)
+
+  if _cpplint_state.include_graph:
+    PrintIncludeGraph(filenames, _cpplint_state.include_graph)
+    sys.exit(0)
+
+  if _cpplint_state.server:
+    _ServeRequests(sys.stdin, sys.stdout, _ArtCheckFunctions())
+    if _regexp_bundle:
+      _regexp_bundle.Store()
+    sys.exit(0)
+
+  if _cpplint_state.index:
+    global _symbol_index
+    _symbol_index = _SymbolIndex(_cpplint_state.index)
+    _symbol_index.Update(_IndexRoots(filenames))
+
+  profiler = None
+  if _cpplint_state.profile:
+    profiler = _Profiler()
+    profiler.Install()
+
+  if _cpplint_state.stamp_dir:
+    filenames = _UnstampedFiles(_cpplint_state.stamp_dir, filenames,
+                                _cpplint_state.stamp_signatures)
+
   _cpplint_state.ResetErrorCounts()
-  for filename in filenames:
-    ProcessFile(filename, _cpplint_state.verbose_level)
+  ProcessFiles(filenames, _cpplint_state.jobs, _ArtCheckFunctions())
   _cpplint_state.PrintErrorCounts()
+  if _regexp_bundle:
+    _regexp_bundle.Store()
+
+  if profiler:
+    profiler.Report(sys.stderr, _cpplint_state.profile)
 
   sys.exit(_cpplint_state.error_count > 0)
 
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how many lines per second cpplint lints.
+
+Lints the pinned corpus of cpplint_benchmark_corpus.txt, a sample of the
+files of the ART tree spread over all file sizes, several times and reports
+the lines per second of the fastest run.  Every run is a fresh cpplint
+process, so start up costs are included, as they are in presubmit checks.
+The benchmark fails if cpplint crashes, or if the runs do not all find the
+same number of errors.
+
+  cpplint_benchmark.py [--runs=#] [--filter=-x,+y,...] [--python=path]
+                       [--cpplint=path] [--json=file]
+
+The defaults are 5 runs of the cpplint.py next to this script, without
+filters, under the interpreter running this script.  Use --cpplint and
+--python to compare versions of cpplint.py or interpreters on the same
+corpus, and --json to keep the figures for regression tracking.
+"""
+
+import getopt
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+
+_TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+_ART_DIR = os.path.dirname(_TOOLS_DIR)
+_CORPUS = os.path.join(_TOOLS_DIR, 'cpplint_benchmark_corpus.txt')
+
+
+def ReadCorpus(corpus):
+  """Returns the (digest, path) pairs listed in the corpus file."""
+  files = []
+  with open(corpus) as f:
+    for line in f:
+      line = line.strip()
+      if line and not line.startswith('#'):
+        digest, path = line.split(None, 1)
+        files.append((digest, path))
+  return files
+
+
+def CheckCorpus(files):
+  """Returns the number of lines of the corpus and its changed files."""
+  lines = 0
+  changed = []
+  for digest, path in files:
+    with open(os.path.join(_ART_DIR, path), 'rb') as f:
+      contents = f.read()
+    lines += contents.count(b'\n')
+    if hashlib.sha1(contents).hexdigest() != digest:
+      changed.append(path)
+  return lines, changed
+
+
+def TimeRun(python, cpplint, filters, paths):
+  """Lints the paths in a new cpplint process.
+
+  Exits if cpplint did not finish, i.e. it did not report its total.
+
+  Returns:
+    The time taken, and the number of errors found.
+  """
+  command = [python, cpplint]
+  if filters:
+    command.append('--filter=' + filters)
+  with open(os.devnull, 'w') as devnull:
+    start = time.time()
+    process = subprocess.Popen(command + paths, cwd=_ART_DIR, stdout=devnull,
+                               stderr=subprocess.PIPE)
+    output = process.communicate()[1].decode('utf-8', 'replace')
+    seconds = time.time() - start
+  # cpplint exits with 1 when it finds errors, and writes their total last.
+  total = re.search(r'^Total errors found: (\d+)$', output, re.MULTILINE)
+  if process.returncode not in (0, 1) or not total:
+    sys.exit('%s failed with exit status %d:\n%s' %
+             (cpplint, process.returncode, output[-2000:]))
+  return seconds, int(total.group(1))
+
+
+def main():
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '',
+                               ['runs=', 'filter=', 'python=', 'cpplint=',
+                                'json='])
+  except getopt.GetoptError as e:
+    sys.exit('%s\n%s' % (e, __doc__))
+  if args:
+    sys.exit(__doc__)
+  runs = 5
+  filters = ''
+  python = sys.executable
+  cpplint = os.path.join(_TOOLS_DIR, 'cpplint.py')
+  json_path = None
+  for opt, val in opts:
+    if opt == '--runs':
+      runs = int(val)
+    elif opt == '--filter':
+      filters = val
+    elif opt == '--python':
+      python = val
+    elif opt == '--cpplint':
+      cpplint = os.path.abspath(val)
+    elif opt == '--json':
+      json_path = val
+
+  files = ReadCorpus(_CORPUS)
+  lines, changed = CheckCorpus(files)
+  for path in changed:
+    sys.stderr.write('Warning: %s differs from the pinned corpus\n' % path)
+
+  paths = [path for _, path in files]
+  times = []
+  error_counts = set()
+  for _ in range(runs):
+    seconds, error_count = TimeRun(python, cpplint, filters, paths)
+    times.append(seconds)
+    error_counts.add(error_count)
+  if len(error_counts) > 1:
+    sys.exit('The number of errors found changed between runs: %s' %
+             ', '.join(str(count) for count in sorted(error_counts)))
+  error_count, = error_counts
+  best = min(times)
+  print('%d files, %d lines, best of %d runs: %.3f s, %.0f lines/s' %
+        (len(paths), lines, runs, best, lines / best))
+
+  if json_path:
+    with open(json_path, 'w') as f:
+      json.dump({'files': len(paths), 'lines': lines, 'filter': filters,
+                 'errors': error_count,
+                 'python': python, 'cpplint': cpplint, 'seconds': times,
+                 'lines_per_second': lines / best,
+                 'pinned': not changed},
+                f, indent=2, separators=(',', ': '), sort_keys=True)
+      f.write('\n')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,1167 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2026 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tests of the parts of cpplint added for ART: the dispatch of the line checks,
+# the incremental linter and the server, the bracket index, the nesting state,
+# the header include cache, the result cache, the symbol index, the include
+# graph, the structured output formats, the stamps, --jobs, --diff, the ART
+# checks, plugins and the regexp bundle.
+
+import codecs
+import cpplint
+import gc
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import warnings
+
+
+SOURCE = """// Copyright 2014 The Android Open Source Project
+
+#include "foo.h"
+
+#include <map>
+#include <string>
+#include <vector>
+
+#include "base/logging.h"
+#include <string>
+
+namespace art {
+
+class Base {
+ public:
+  explicit Base(int value) : value_(value) {}
+  virtual ~Base() {}
+
+  int Value() const { return value_; }
+
+ private:
+  int value_;
+};
+
+class Derived : public Base {
+ public:
+  Derived(int value, int other)
+      : Base(value),
+        other_(other) {
+  }
+
+  int Other() const {
+    if (other_ > 0) {
+      return other_;
+    } else {
+      return -other_;
+    }
+  }
+
+ private:
+  int other_;
+  DISALLOW_COPY_AND_ASSIGN(Derived);
+};
+
+#if defined(__LP64__)
+struct Pair {
+  int first;
+  int second;
+};
+#else
+struct Pair {
+  int first;
+};
+#endif
+
+static int Sum(const std::vector<int>& values) {
+  int sum = 0;
+  for (size_t i = 0; i < values.size(); ++i) {
+    sum += values[i];
+  }
+  return sum;
+}
+
+void Long(int a,
+          int b) {
+  int c = a+b;
+  if (c) {
+    c++;
+  }
+  for (int i = 0; i < c; ++i) {
+    c--;
+  }
+  std::map<std::string, int> m;
+  m["a"] = c;
+}
+
+TEST(Foo, Bar) {
+  Derived d(1, 2);
+  EXPECT_EQ(3, d.Value() + d.Other());
+}
+
+}  // namespace art
+"""
+
+
+def WriteFile(directory, path, contents):
+  """Writes a file below a directory and returns its path."""
+  path = os.path.join(directory, path)
+  if not os.path.isdir(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  with open(path, 'w') as f:
+    f.write(contents)
+  return path
+
+
+def RunCpplint(args, cwd):
+  """Runs cpplint.py in a new process and returns its status and stderr."""
+  script = os.path.join(os.path.dirname(os.path.abspath(cpplint.__file__)),
+                        'cpplint.py')
+  process = subprocess.Popen([sys.executable, script] + args, cwd=cwd,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  stderr = process.communicate()[1].decode('utf8')
+  return process.returncode, stderr
+
+
+def Umask():
+  umask = os.umask(0)
+  os.umask(umask)
+  return umask
+
+
+class OutputStream(object):
+  """Collects what is written to it, as byte or unicode strings."""
+
+  def __init__(self):
+    self.parts = []
+
+  def write(self, text):
+    self.parts.append(text)
+
+  def flush(self):
+    pass
+
+  def getvalue(self):
+    return ''.join(self.parts)
+
+
+class CpplintTestCase(unittest.TestCase):
+  def setUp(self):
+    cpplint._cpplint_state.ResetErrorCounts()
+    self.verbose_level = cpplint._cpplint_state.verbose_level
+    self.filters = cpplint._cpplint_state.filters
+    cpplint._cpplint_state.SetVerboseLevel(0)
+    cpplint._cpplint_state.SetFilters('')
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    cpplint._cpplint_state.SetVerboseLevel(self.verbose_level)
+    cpplint._cpplint_state.filters = self.filters
+
+
+# SOURCE with more errors, many of them in checks of their own, for the tests
+# that compare whole outputs.
+ERRORS = SOURCE + """
+void Log(ArtMethod* m) {
+  std::string name = PrettyMethod(m);
+  VLOG(jit) << name << std::endl;
+  std::vector<int> v;
+  long x = (int)y;
+  char* s = strcpy(a, b);
+  if(x){
+    printf("%qd", x);
+  }
+\tint tab;
+  using namespace std;
+  int arr[n];
+  short s2 = 0 ;
+  a = b and c;
+}
+void Copy(std::vector<int> v) { v_ = v; }
+const static int kLimit = 1;
+"""
+
+
+class TestCheckPruning(CpplintTestCase):
+  def __lint(self, filters):
+    cpplint._cpplint_state.SetFilters(filters)
+    linter = cpplint._IncrementalLinter('art/compiler/optimizing/foo.cc',
+                                        cpplint._ArtCheckFunctions())
+    output = linter.Lint(u'' + ERRORS).Output()
+    return [line for line in output.splitlines()
+            if not line.startswith('Done processing ')]
+
+  def test_TriggersNeverChangeTheOutput(self):
+    output = self.__lint('+build/include_alpha')
+    self.assertTrue(len(output) > 20)
+    for check in cpplint._LINE_CHECKS:
+      check.always = True
+    try:
+      self.assertEqual(self.__lint('+build/include_alpha'), output)
+    finally:
+      for check in cpplint._LINE_CHECKS:
+        check.always = not check.triggers and not check.words
+
+  def test_FiltersMatchAnUnprunedRun(self):
+    # An unpruned run reports everything; filtering its errors afterwards,
+    # the way cpplint always did, must give what the pruned runs report.
+    everything = self.__lint('+build/include_alpha')
+    categories = sorted(set(category for category in cpplint._ERROR_CATEGORIES
+                            if not category.startswith('plugin/')))
+    prefixes = sorted(set(category.split('/')[0] for category in categories))
+    names = [''] + prefixes + categories + ['whitespace/b', 'runtime/']
+    filter_sets = [['-', '+' + category] for category in categories]
+    rng = random.Random(37)
+    for trial in range(60):
+      filter_sets.append(rng.choice([['-'], []]) +
+                         ['%s%s' % (rng.choice('+-'), rng.choice(names))
+                          for _ in range(rng.randint(1, 6))])
+    for filters in filter_sets:
+      expected = []
+      for line in everything:
+        category = line.rsplit('[', 2)[1].rstrip('] ')
+        passes = True
+        for one_filter in ['-build/include_alpha'] + filters:
+          if category.startswith(one_filter[1:]):
+            passes = one_filter[0] == '+'
+        if passes:
+          expected.append(line)
+      self.assertEqual(self.__lint(','.join(filters)), expected,
+                       ','.join(filters))
+
+  def test_OldEntryPoints(self):
+    clean_lines = cpplint.CleansedLines(
+        ['', 'class Foo {', ' public:', '  long x;', '  Foo(int x);', '};',
+         'if(x){', 'const static int y = 1;', ''])
+    nesting_state = cpplint._NestingState()
+    include_state = cpplint._IncludeState()
+    errors = []
+    def error(filename, linenum, category, confidence, message):
+      errors.append((linenum, category))
+    for linenum in range(clean_lines.NumLines()):
+      nesting_state.Update('foo.cc', clean_lines, linenum, error)
+      cpplint.CheckStyle('foo.cc', clean_lines, linenum, 'cc', nesting_state,
+                         error)
+      cpplint.CheckLanguage('foo.cc', clean_lines, linenum, 'cc',
+                            include_state, error)
+      cpplint.CheckForNonStandardConstructs('foo.cc', clean_lines, linenum,
+                                            nesting_state, error)
+    self.assertEqual(errors, [(3, 'runtime/int'), (4, 'runtime/explicit'),
+                              (6, 'whitespace/braces'),
+                              (7, 'build/storage_class')])
+
+
+  def test_OldSignatures(self):
+    clean_lines = cpplint.CleansedLines(
+        ['', '#include <map>', '#include <map>', '\tint x;', ''])
+    include_state = cpplint._IncludeState()
+    errors = []
+    def error(filename, linenum, category, confidence, message):
+      errors.append((linenum, category))
+    for linenum in range(clean_lines.NumLines()):
+      cpplint.CheckIncludeLine('foo.cc', clean_lines, linenum, include_state,
+                               error)
+      cpplint.CheckLineFormat('foo.cc', clean_lines, linenum, 'cc', error)
+    self.assertEqual(errors, [(2, 'build/include'), (3, 'whitespace/tab')])
+
+
+class TestIncrementalLinter(CpplintTestCase):
+  def __lint(self, lines, linter=None):
+    if linter is None:
+      linter = cpplint._IncrementalLinter('art/runtime/foo.cc')
+    return linter.Lint(u'\n'.join(lines)).Output()
+
+  def __edit(self, rng, lines, pool):
+    i = rng.randrange(len(lines))
+    op = rng.choice(['insert', 'delete', 'replace', 'char', 'brace'])
+    if op == 'insert':
+      lines[i:i] = rng.sample(pool, rng.choice([1, 2, 3]))
+    elif op == 'delete':
+      del lines[i:i + rng.choice([1, 2, 5])]
+    elif op == 'replace':
+      lines[i] = rng.choice(pool)
+    elif op == 'char':
+      line = lines[i]
+      j = rng.randrange(len(line) + 1)
+      if line and rng.random() < 0.5:
+        lines[i] = line[:j] + line[j + 1:]
+      else:
+        lines[i] = line[:j] + rng.choice('{}();/ *"') + line[j:]
+    else:
+      braces = [k for k, line in enumerate(lines) if '{' in line or '}' in line]
+      k = rng.choice(braces)
+      if rng.random() < 0.5:
+        del lines[k]
+      else:
+        lines.insert(k, lines[k])
+
+  def test_FirstRunIsAFullLint(self):
+    lines = SOURCE.split('\n')
+    output = self.__lint(lines)
+    self.assertIn('already included at art/runtime/foo.cc:6', output)
+    self.assertIn('Done processing art/runtime/foo.cc', output)
+
+  def test_MovesReusedLineNumbers(self):
+    lines = SOURCE.split('\n')
+    linter = cpplint._IncrementalLinter('art/runtime/foo.cc')
+    self.__lint(lines, linter)
+    lines[3:3] = ['// a comment'] * 3
+    output = self.__lint(lines, linter)
+    self.assertEqual(output, self.__lint(lines))
+    self.assertIn('foo.cc:13:  "string" already included at '
+                  'art/runtime/foo.cc:9', output)
+
+  def test_RandomEditsMatchFullRelint(self):
+    rng = random.Random(38)
+    pool = [line for line in SOURCE.split('\n') if line.strip()]
+    pool += ['void F(int a,', '    int b) {', '}', '{', 'class C {',
+             ' public:', '};', '#if FOO', '#endif', '#include <map>']
+    for trial in range(20):
+      lines = SOURCE.split('\n')
+      linter = cpplint._IncrementalLinter('art/runtime/foo.cc')
+      self.__lint(lines, linter)
+      for step in range(30):
+        self.__edit(rng, lines, pool)
+        self.assertEqual(self.__lint(lines, linter), self.__lint(lines),
+                         'trial %d, step %d' % (trial, step))
+
+
+class TestServer(CpplintTestCase):
+  def __serve(self, *requests):
+    responses = OutputStream()
+    cpplint._ServeRequests(
+        io.StringIO(u''.join(json.dumps(request) + u'\n'
+                             for request in requests)),
+        responses)
+    return [json.loads(line) for line in responses.getvalue().splitlines()]
+
+  def test_LintsEditedContents(self):
+    lines = SOURCE.split('\n')
+    edited = lines[:20] + ['int x ;'] + lines[20:]
+    responses = self.__serve(
+        {'file': 'art/runtime/foo.cc', 'contents': '\n'.join(lines)},
+        {'file': 'art/runtime/foo.cc', 'contents': '\n'.join(edited)},
+        {'file': 'art/runtime/foo.cc', 'contents': '\n'.join(edited),
+         'full': True},
+        {'file': 'art/runtime/foo.cc', 'close': True})
+    self.assertEqual(len(responses), 4)
+    first, second, full, closed = responses
+    self.assertNotIn('foo.cc:21:', first['output'])
+    self.assertIn('foo.cc:21:  Extra space', second['output'])
+    self.assertEqual(second['output'], full['output'])
+    self.assertEqual(second['error_count'], first['error_count'] + 1)
+    self.assertEqual(closed, {'file': 'art/runtime/foo.cc'})
+
+
+class TestBracketIndex(CpplintTestCase):
+  def test_AnswersLikeScanning(self):
+    lines = SOURCE.split('\n') + [
+        'template <typename T, typename U = std::map<int, int>>',
+        'bool Less(T a, U b) { return a < b && (b > a || a >> 2); }',
+        'int x = (1 +',
+        '         (2 * [] { return 3; }()));',
+        'std::vector<std::pair<int,',
+        '                      int>> v;',
+        'if (a < b) {']
+    clean_lines = cpplint.CleansedLines(lines)
+    index = cpplint._BracketIndex(clean_lines)
+    scanner = cpplint._BracketScanner(clean_lines)
+    for linenum, line in enumerate(clean_lines.elided):
+      self.assertEqual(index.BlockEnd(linenum), scanner.BlockEnd(linenum))
+      for pos, char in enumerate(line):
+        position = (linenum, pos)
+        if char in '([{':
+          self.assertEqual(index.ClosingPosition(linenum, pos),
+                           scanner.ClosingPosition(linenum, pos), position)
+        elif char == '<':
+          self.assertEqual(index.HasClosingAngleBracket(linenum, pos),
+                           scanner.HasClosingAngleBracket(linenum, pos),
+                           position)
+        elif char == '>':
+          self.assertEqual(index.HasOpeningAngleBracket(linenum, pos),
+                           scanner.HasOpeningAngleBracket(linenum, pos),
+                           position)
+
+  def test_UnclosedBlock(self):
+    clean_lines = cpplint.CleansedLines(['void F() {', '  {', '  }'])
+    index = clean_lines.BracketIndex()
+    self.assertEqual(index.BlockEnd(1), 2)
+    self.assertIsNone(index.BlockEnd(0))
+    self.assertIsNone(index.ClosingPosition(0, 9))
+    self.assertEqual(index.ClosingPosition(0, 6), (0, 8))
+
+
+class TestNestingState(CpplintTestCase):
+  def __update(self, lines):
+    clean_lines = cpplint.CleansedLines(lines)
+    nesting_state = cpplint._NestingState()
+    states = []
+    for linenum in range(clean_lines.NumLines()):
+      nesting_state.Update('foo.cc', clean_lines, linenum,
+                           lambda *args: None)
+      block = nesting_state.InnermostBlock()
+      states.append(block and (block.name, block.access))
+    return nesting_state, states
+
+  def test_ElseStartsFromTheStackBeforeIf(self):
+    _, states = self.__update([
+        'class A {', '#if X', ' public:', '  int x;', '#else', '  int y;',
+        '#endif', '};'])
+    self.assertEqual(states, [
+        ('A', 'private'), ('A', 'private'), ('A', 'public'),
+        ('A', 'public'), ('A', 'private'), ('A', 'private'),
+        ('A', 'public'), None])
+
+  def test_SavedStacksAreNotModified(self):
+    nesting_state, _ = self.__update(['class A {', '#if X', ' public:'])
+    saved = nesting_state.pp_stack[-1].stack_before_if
+    self.assertEqual(saved.block.access, 'private')
+    self.assertEqual(nesting_state.InnermostBlock().access, 'public')
+    self.assertEqual([block.name for block in nesting_state.stack], ['A'])
+
+
+class TestHeaderIncludes(CpplintTestCase):
+  def setUp(self):
+    CpplintTestCase.setUp(self)
+    self.header = WriteFile(self.directory, 'foo.h',
+                            '#include <map>\n\n#include "bar.h"\n')
+    cpplint._header_includes.clear()
+
+  def test_ReadOnceUntilChanged(self):
+    includes = cpplint._ReadHeaderIncludes(self.header, codecs)
+    self.assertEqual(includes, [('map', 1), ('bar.h', 3)])
+    self.assertIs(cpplint._ReadHeaderIncludes(self.header, codecs), includes)
+    mtime = os.path.getmtime(self.header)
+    WriteFile(self.directory, 'foo.h', '#include <set>\n')
+    os.utime(self.header, (mtime + 10, mtime + 10))
+    self.assertEqual(cpplint._ReadHeaderIncludes(self.header, codecs),
+                     [('set', 1)])
+    self.assertIsNone(cpplint._ReadHeaderIncludes(
+        os.path.join(self.directory, 'missing.h'), codecs))
+
+  def test_ClosesTheHeader(self):
+    with warnings.catch_warnings(record=True) as caught:
+      warnings.simplefilter('always')
+      cpplint._ReadHeaderIncludes(self.header, codecs)
+      gc.collect()
+    self.assertEqual([str(warning.message) for warning in caught], [])
+
+
+class TestLintResultCache(CpplintTestCase):
+  def setUp(self):
+    CpplintTestCase.setUp(self)
+    self.source = WriteFile(self.directory, 'foo.cc',
+                            '// Copyright 2014\n#include "foo.h"\n'
+                            'std::string s;\n')
+    self.header = WriteFile(self.directory, 'foo.h',
+                            '// Copyright 2014\n#include <string>\n')
+    cpplint._cpplint_state.cache_dir = os.path.join(self.directory, 'cache')
+    self.process = cpplint._ProcessFileInState
+
+  def tearDown(self):
+    cpplint._ProcessFileInState = self.process
+    cpplint._cpplint_state.cache_dir = None
+    CpplintTestCase.tearDown(self)
+
+  def __lint(self, cached):
+    if cached:
+      def Fail(*args):
+        self.fail('%s was linted again' % self.source)
+      cpplint._ProcessFileInState = Fail
+    else:
+      cpplint._ProcessFileInState = self.process
+    return cpplint._LintFile(self.source, 0).Output()
+
+  def test_ReusesResults(self):
+    output = self.__lint(cached=False)
+    self.assertEqual(self.__lint(cached=True), output)
+    cache_dir = cpplint._cpplint_state.cache_dir
+    entry = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+    self.assertEqual(os.stat(entry).st_mode & 0o777, 0o666 & ~Umask())
+
+  def test_KeyedByContentsAndFilters(self):
+    self.__lint(cached=False)
+    WriteFile(self.directory, 'foo.cc', '// Copyright 2014\nint x ;\n')
+    self.assertIn('Extra space', self.__lint(cached=False))
+    cpplint._cpplint_state.SetFilters('-whitespace')
+    self.assertNotIn('Extra space', self.__lint(cached=False))
+    self.__lint(cached=True)
+
+  def test_DependsOnTheHeader(self):
+    self.assertNotIn('Add #include <string>', self.__lint(cached=False))
+    WriteFile(self.directory, 'foo.h', '// Copyright 2014\n')
+    self.assertIn('Add #include <string>', self.__lint(cached=False))
+
+  def test_UnusableEntries(self):
+    output = self.__lint(cached=False)
+    cache_dir = cpplint._cpplint_state.cache_dir
+    for name in os.listdir(cache_dir):
+      WriteFile(cache_dir, name, 'truncated')
+    self.assertEqual(self.__lint(cached=False), output)
+
+
+HEADER = """// Copyright 2014 The Android Open Source Project
+
+#ifndef ART_RUNTIME_THREAD_H_
+#define ART_RUNTIME_THREAD_H_
+
+namespace art {
+
+class Thread {
+ public:
+  void Run();
+  void Stop();
+};
+
+}  // namespace art
+
+#endif  // ART_RUNTIME_THREAD_H_
+"""
+
+
+class TestSymbolIndex(CpplintTestCase):
+  def setUp(self):
+    CpplintTestCase.setUp(self)
+    self.header = WriteFile(self.directory, 'runtime/thread.h', HEADER)
+    self.path = os.path.join(self.directory, 'index.json')
+    self.__write('runtime/thread.cc', 'void Thread::Run() {\n}\n')
+
+  def __write(self, path, contents):
+    return WriteFile(self.directory, path,
+                     '// Copyright 2014 The Android Open Source Project\n\n'
+                     'namespace art {\n\n%s\n}  // namespace art\n' % contents)
+
+  def __index(self):
+    index = cpplint._SymbolIndex(self.path)
+    index.Update([self.directory])
+    return index
+
+  def test_Facts(self):
+    index = self.__index()
+    record = index.Record(self.header)
+    self.assertEqual(record['guard'], ['ART_RUNTIME_THREAD_H_', 3])
+    self.assertEqual(record['classes'], ['art::Thread'])
+    self.assertEqual(record['declarations'],
+                     [['Thread::Run', 10], ['Thread::Stop', 11]])
+    self.assertTrue(index.IsDefined('Thread::Run'))
+    self.assertFalse(index.IsDefined('Thread::Stop'))
+    self.assertEqual(index.GuardUsers('ART_RUNTIME_THREAD_H_'), [self.header])
+
+  def test_StoredAndReloaded(self):
+    digest = self.__index().Digest(self.header)
+    index = cpplint._SymbolIndex(self.path)
+    self.assertEqual(index.Digest(self.header), digest)
+    os.remove(self.header)
+    index.Update([self.directory])
+    self.assertIsNone(index.Record(self.header))
+
+  def test_FingerprintOnlyChangesWithWhatTheIndexSaysAboutAFile(self):
+    fingerprint = self.__index().Fingerprint(self.header)
+    self.__write('runtime/other.cc', 'void Other() {\n}\n')
+    self.assertEqual(self.__index().Fingerprint(self.header), fingerprint)
+    self.__write('runtime/stop.cc', 'void Thread::Stop() {\n}\n')
+    self.assertNotEqual(self.__index().Fingerprint(self.header), fingerprint)
+    fingerprint = self.__index().Fingerprint(self.header)
+    WriteFile(self.directory, 'runtime/copy.h', HEADER)
+    self.assertNotEqual(self.__index().Fingerprint(self.header), fingerprint)
+
+  def test_Checks(self):
+    WriteFile(self.directory, 'runtime/copy.h', HEADER)
+    status, output = RunCpplint(
+        ['--index=' + self.path, '--filter=-,+build/header_guard,'
+         '+build/undefined_function', 'runtime/thread.h'], self.directory)
+    self.assertEqual(status, 1)
+    self.assertIn('runtime/thread.h:3:  Header guard ART_RUNTIME_THREAD_H_ '
+                  'is also used by runtime/copy.h', output)
+    self.assertIn('runtime/thread.h:11:  Thread::Stop is declared but not '
+                  'defined in any indexed file', output)
+    self.assertNotIn('Thread::Run is declared', output)
+
+
+class TestIncludeGraph(CpplintTestCase):
+  def setUp(self):
+    CpplintTestCase.setUp(self)
+    WriteFile(self.directory, 'compiler/driver.cc',
+              '#include "driver.h"\n#include "base/macros.h"\n'
+              '#include <vector>\n')
+    WriteFile(self.directory, 'compiler/driver.h',
+              '#include "thread.h"  // In runtime/.\n')
+    WriteFile(self.directory, 'runtime/thread.h',
+              '#include "base/macros.h"\n#include "heavy.h"\n')
+    WriteFile(self.directory, 'runtime/heavy.h', 'x' * 1000 + '\n')
+    WriteFile(self.directory, 'runtime/base/macros.h', '#define X\n')
+    self.graph = cpplint._IncludeGraph(self.directory, ['compiler/driver.cc'])
+
+  def test_ResolvesIncludes(self):
+    graph = self.graph
+    self.assertEqual(graph.files, [
+        'compiler/driver.cc', 'compiler/driver.h', 'runtime/base/macros.h',
+        'runtime/thread.h', 'runtime/heavy.h'])
+    self.assertEqual(graph.includes['compiler/driver.cc'],
+                     ['compiler/driver.h', 'runtime/base/macros.h'])
+    self.assertEqual(graph.external['compiler/driver.cc'], ['vector'])
+    self.assertEqual(graph.Closure('runtime/thread.h'), set([
+        'runtime/thread.h', 'runtime/base/macros.h', 'runtime/heavy.h']))
+
+  def test_RanksHeadersByWhatTheyDominate(self):
+    graph = self.graph
+    sizes = graph.DominatedSizes('compiler/driver.cc')
+    # macros.h is also included directly, so only heavy.h is saved by
+    # slimming down thread.h.
+    self.assertEqual(sizes['runtime/thread.h'],
+                     graph.size['runtime/thread.h'] +
+                     graph.size['runtime/heavy.h'])
+    self.assertEqual(sizes['compiler/driver.h'],
+                     sizes['runtime/thread.h'] +
+                     graph.size['compiler/driver.h'])
+    report = graph.Report()
+    self.assertEqual([figures['file'] for figures in report['sources']],
+                     ['compiler/driver.cc'])
+    headers = report['headers']
+    self.assertEqual([figures['file'] for figures in headers[:2]],
+                     ['compiler/driver.h', 'runtime/thread.h'])
+    self.assertEqual(headers[0]['slimming_bytes'], sizes['runtime/thread.h'])
+    self.assertEqual(headers[1]['direct_dependents'], 1)
+    macros = [figures for figures in headers
+              if figures['file'] == 'runtime/base/macros.h'][0]
+    self.assertEqual(macros['direct_dependents'], 2)
+    self.assertEqual(macros['dependents'], 1)
+
+  def test_WritesDot(self):
+    stream = OutputStream()
+    self.graph.WriteDot(stream, self.graph.Report())
+    dot = stream.getvalue()
+    self.assertTrue(dot.startswith('digraph includes {\n'))
+    self.assertIn('  "compiler/driver.h" -> "runtime/thread.h";\n', dot)
+
+
+class TestStructuredOutput(CpplintTestCase):
+  def setUp(self):
+    CpplintTestCase.setUp(self)
+    WriteFile(self.directory, 'foo.cc', 'int x ;\nint y;  \n')
+    WriteFile(self.directory, 'bar.txt', '')
+
+  def __run(self, output_format):
+    status, output = RunCpplint(
+        ['--output=' + output_format, '--filter=-,+whitespace,+legal',
+         'foo.cc', 'bar.txt'], self.directory)
+    self.assertEqual(status, 1)
+    return output
+
+  def test_JsonLines(self):
+    records = [json.loads(line)
+               for line in self.__run('jsonl').splitlines()]
+    errors = [(record['line'], record['category'])
+              for record in records if record['type'] == 'error']
+    self.assertEqual(errors, [(0, 'legal/copyright'),
+                              (1, 'whitespace/semicolon'),
+                              (2, 'whitespace/end_of_line')])
+    notes = [record for record in records if record['type'] == 'note']
+    self.assertEqual(len(notes), 1)
+    self.assertEqual(notes[0]['file'], 'bar.txt')
+    files = [record for record in records if record['type'] == 'file']
+    self.assertEqual([(record['file'], record['errors']) for record in files],
+                     [('foo.cc', 3), ('bar.txt', 0)])
+    self.assertEqual(records[-1]['type'], 'summary')
+    self.assertEqual(records[-1]['errors'], 3)
+
+  def test_Sarif(self):
+    log = json.loads(self.__run('sarif'))
+    self.assertEqual(log['version'], '2.1.0')
+    run = log['runs'][0]
+    self.assertEqual([artifact['location']['uri']
+                      for artifact in run['artifacts']], ['foo.cc', 'bar.txt'])
+    rules = [rule['id'] for rule in run['tool']['driver']['rules']]
+    results = [(result['ruleId'], result['locations'][0]['physicalLocation'])
+               for result in run['results']]
+    self.assertEqual([rules.index(rule) for rule, _ in results],
+                     [result['ruleIndex'] for result in run['results']])
+    self.assertNotIn('region', results[0][1])
+    self.assertEqual([location['region']['startLine']
+                      for _, location in results[1:]], [1, 2])
+    notifications = run['invocations'][0]['toolExecutionNotifications']
+    self.assertEqual(len(notifications), 1)
+
+
+class TestStamps(CpplintTestCase):
+  def setUp(self):
+    CpplintTestCase.setUp(self)
+    self.stamp_dir = os.path.join(self.directory, 'stamps')
+    self.good = WriteFile(self.directory, 'good.cc',
+                          '// Copyright 2014\nint x;\n')
+    WriteFile(self.directory, 'bad.cc', '// Copyright 2014\nint x ;\n')
+
+  def __run(self):
+    status, output = RunCpplint(
+        ['--stamp-dir=' + self.stamp_dir, 'good.cc', 'bad.cc'],
+        self.directory)
+    return [line[len('Done processing '):]
+            for line in output.splitlines()
+            if line.startswith('Done processing ')]
+
+  def test_OnlyPassingFilesAreStamped(self):
+    self.assertEqual(self.__run(), ['good.cc', 'bad.cc'])
+    self.assertEqual(os.listdir(self.stamp_dir), ['good.cc'])
+    self.assertEqual(self.__run(), ['bad.cc'])
+    WriteFile(self.directory, 'good.cc', '// Copyright 2014\nint y ;\n')
+    self.assertEqual(self.__run(), ['good.cc', 'bad.cc'])
+    self.assertEqual(os.listdir(self.stamp_dir), [])
+
+  def test_EditsInvalidateTheStamp(self):
+    signatures = {}
+    self.assertEqual(
+        cpplint._UnstampedFiles(self.stamp_dir, [self.good], signatures),
+        [self.good])
+    cpplint._UpdateStamp(self.stamp_dir, self.good, signatures[self.good])
+    self.assertEqual(
+        cpplint._UnstampedFiles(self.stamp_dir, [self.good], {}), [])
+    # An edit within the same tick of the mtime changes the size.
+    mtime = os.path.getmtime(self.good)
+    WriteFile(self.directory, 'good.cc', '// Copyright 2014\nint xy;\n')
+    os.utime(self.good, (mtime, mtime))
+    self.assertEqual(
+        cpplint._UnstampedFiles(self.stamp_dir, [self.good], {}), [self.good])
+    # One keeping the size changes the mtime, even to an older one.
+    WriteFile(self.directory, 'good.cc', '// Copyright 2014\nint x;\n')
+    os.utime(self.good, (mtime - 10, mtime - 10))
+    self.assertEqual(
+        cpplint._UnstampedFiles(self.stamp_dir, [self.good], {}), [self.good])
+    cpplint._UpdateStamp(self.stamp_dir, self.good, None)
+    self.assertEqual(os.listdir(self.stamp_dir), [])
+
+
+class TestJobs(CpplintTestCase):
+  def test_OutputMatchesOneJob(self):
+    filenames = []
+    for i in range(6):
+      filename = 'art/runtime/foo%d.cc' % i
+      WriteFile(self.directory, filename,
+                SOURCE * (i % 3) + 'int y%d ;\n' % i)
+      filenames.append(filename)
+    WriteFile(self.directory, 'art/runtime/notes.txt', '')
+    filenames.insert(3, 'art/runtime/notes.txt')
+    status, output = RunCpplint(['--jobs=1'] + filenames, self.directory)
+    self.assertEqual(status, 1)
+    self.assertIn('foo5.cc:', output)
+    self.assertEqual(RunCpplint(['--jobs=2'] + filenames, self.directory),
+                     (status, output))
+    self.assertEqual(RunCpplint(['--jobs=3'] + filenames, self.directory),
+                     (status, output))
+
+
+class TestDiff(CpplintTestCase):
+  def setUp(self):
+    CpplintTestCase.setUp(self)
+    self.cwd = os.getcwd()
+    self.changed_lines = cpplint._cpplint_state.changed_lines
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    cpplint._cpplint_state.changed_lines = self.changed_lines
+    CpplintTestCase.tearDown(self)
+
+  def __git(self, *args):
+    subprocess.check_output(
+        ['git', '-c', 'user.name=cpplint', '-c', 'user.email=cpplint@test',
+         '-c', 'diff.renames=true'] + list(args), cwd=self.directory)
+
+  def test_ChangedLines(self):
+    numbered = ''.join('%d\n' % i for i in range(1, 21))
+    WriteFile(self.directory, 'changed.cc', numbered)
+    WriteFile(self.directory, 'deleted.cc', numbered)
+    WriteFile(self.directory, 'removed.cc', numbered)
+    WriteFile(self.directory, 'renamed.h', numbered)
+    self.__git('init', '-q')
+    self.__git('add', '.')
+    self.__git('commit', '-q', '-m', 'base')
+    WriteFile(self.directory, 'changed.cc',
+              numbered.replace('3\n', 'three\n', 1)
+              .replace('10\n11\n', 'ten\n10.5\neleven\n'))
+    WriteFile(self.directory, 'deleted.cc',
+              numbered.replace('5\n6\n7\n', ''))
+    os.remove(os.path.join(self.directory, 'removed.cc'))
+    self.__git('mv', 'renamed.h', 'moved.h')
+    WriteFile(self.directory, 'moved.h', numbered.replace('20\n', 'end\n'))
+    os.chdir(self.directory)
+    self.assertEqual(cpplint._GitChangedLines('HEAD'),
+                     {'changed.cc': set([3, 10, 11, 12]),
+                      'deleted.cc': set([4, 5]),
+                      'moved.h': set([20])})
+
+  def __lint(self, changed_lines, source):
+    cpplint._cpplint_state.changed_lines = changed_lines
+    errors = []
+    def error(filename, linenum, category, confidence, message):
+      errors.append((linenum, category))
+    cpplint.ProcessFileData('foo.cc', 'cc', source.split('\n'), error)
+    return errors
+
+  def test_OnlyReportsChangedLines(self):
+    source = """#include <string>
+#include <string>
+int x ;
+class Foo {
+ public:
+  Foo(int y);
+};
+"""
+    self.assertEqual(self.__lint(None, source),
+                     [(0, 'legal/copyright'), (2, 'build/include'),
+                      (3, 'whitespace/semicolon'), (6, 'runtime/explicit')])
+    # The include and the class on unchanged lines are still tracked, and a
+    # change near the top still checks the copyright.
+    self.assertEqual(self.__lint({'foo.cc': set([2, 6])}, source),
+                     [(0, 'legal/copyright'), (2, 'build/include'),
+                      (6, 'runtime/explicit')])
+    self.assertEqual(self.__lint({'foo.cc': set([3, 20])}, source),
+                     [(0, 'legal/copyright'), (3, 'whitespace/semicolon')])
+    self.assertEqual(self.__lint({}, source), [])
+
+
+def Errors(output):
+  """Returns the line numbers and categories of the errors in an output."""
+  errors = []
+  for line in output.splitlines():
+    if line.startswith('Done processing '):
+      continue
+    _, linenum, rest = line.split(':', 2)
+    errors.append((int(linenum), rest.rsplit('[', 2)[1].rstrip('] ')))
+  return errors
+
+
+class TestArenaContainers(CpplintTestCase):
+  def __lint(self, filename, source):
+    cpplint._cpplint_state.SetFilters(
+        '-,+runtime/arena_container,+runtime/hash_container')
+    linter = cpplint._IncrementalLinter(filename,
+                                        [cpplint.CheckArenaContainers])
+    return linter.Lint(source).Output()
+
+  def test_HeapContainers(self):
+    output = self.__lint('art/compiler/optimizing/foo.cc', u"""
+std::vector<int> v;
+  std::map<int, int> map_ GUARDED_BY(lock_);
+void F(std::set<int> s, int x);
+  auto* d = new std::deque<int>();
+  Use(std::vector<int>());
+  std::unordered_map<int, int> m = Make();
+""")
+    self.assertEqual(Errors(output),
+                     [(2, 'runtime/arena_container'),
+                      (3, 'runtime/arena_container'),
+                      (4, 'runtime/arena_container'),
+                      (5, 'runtime/arena_container'),
+                      (6, 'runtime/arena_container'),
+                      (7, 'runtime/hash_container')])
+    self.assertIn('Use ArenaSafeMap or ScopedArenaSafeMap', output)
+    self.assertIn('Use HashMap from runtime/base/hash_map.h', output)
+
+  def test_AllowedContainers(self):
+    output = self.__lint('art/compiler/optimizing/foo.cc', u"""
+std::vector<uint8_t> code;
+std::vector<int, ArenaAllocatorAdapter<int>> a;
+std::set<int, std::less<int>, ScopedArenaAllocatorAdapter<int>> s;
+ArenaVector<int> b;
+void G(const std::vector<int>& r, std::vector<int>* p);
+typedef std::vector<int> Ints;
+using Ints = std::vector<int>;
+// std::vector<int> c;
+""")
+    self.assertEqual(Errors(output), [])
+
+  def test_OnlyInArenaDirectories(self):
+    source = u'std::vector<int> v;\n'
+    self.assertEqual(Errors(self.__lint('art/compiler/dex/foo.cc', source)),
+                     [(1, 'runtime/arena_container')])
+    self.assertEqual(Errors(self.__lint('art/runtime/foo.cc', source)), [])
+    self.assertEqual(
+        Errors(self.__lint('art/compiler/optimizing/foo_test.cc', source)),
+        [])
+
+
+class TestFunctionLengths(CpplintTestCase):
+  def __lint(self, *parts):
+    cpplint._cpplint_state.SetFilters('-,+readability/fn_size')
+    errors = []
+    def error(filename, linenum, category, confidence, message):
+      if category == 'readability/fn_size':
+        errors.append((linenum, message))
+    lines = []
+    for part in parts:
+      lines.extend(part.split('\n') if isinstance(part, str) else part)
+    cpplint.ProcessFileData('foo.cc', 'cc', lines, error)
+    return errors
+
+  def __body(self, length):
+    return ['  Call(%d);' % i for i in range(length)] + ['}']
+
+  def __long(self, name, length, trigger=250):
+    return ('Small and focused functions are preferred: %s() has %d '
+            'non-comment lines (error triggered by exceeding %d lines).'
+            % (name, length, trigger))
+
+  def test_SingleLineSignature(self):
+    self.assertEqual(self.__lint('void Foo(int a) {', self.__body(251)),
+                     [(253, self.__long('Foo', 251))])
+    self.assertEqual(self.__lint('void Foo(int a) {', self.__body(250)), [])
+
+  def test_MultiLineSignature(self):
+    # The lines of the signature after the first one count as well.
+    self.assertEqual(
+        self.__lint('void Foo(int a,\n         int b,\n         int c) {',
+                    self.__body(249)),
+        [(253, self.__long('Foo', 251))])
+    self.assertEqual(
+        self.__lint('void Foo(int a,\n         int b) {', self.__body(249)),
+        [])
+
+  def test_BodyOnTheNextLine(self):
+    self.assertEqual(self.__lint('void Foo(int a)\n{', self.__body(250)),
+                     [(253, self.__long('Foo', 251))])
+    self.assertEqual(
+        self.__lint('void Foo(int a,\n         int b)\n    const\n{',
+                    self.__body(249)),
+        [(254, self.__long('Foo', 252))])
+
+  def test_DeclarationWithoutBody(self):
+    # The declarations are forgotten, and the function that follows is
+    # reported with its own name.
+    self.assertEqual(
+        self.__lint('void Foo(int a);\nvoid Bar(int a,\n         int b);',
+                    'void Baz(int a) {', self.__body(251)),
+        [(256, self.__long('Baz', 251))])
+    self.assertEqual(
+        self.__lint('void Foo(int a);\nint Bar(int a,\n        int b);'), [])
+
+  def test_BodyNotFound(self):
+    self.assertEqual(
+        self.__lint('void Foo(int a) {', self.__body(3),
+                    'void Bar(int a,\n         int b)', ''),
+        [(6, 'Lint failed to find start of function body.')])
+
+  def test_TestsMayBeLonger(self):
+    self.assertEqual(self.__lint('TEST(Foo, Bar) {', self.__body(400)), [])
+    self.assertEqual(self.__lint('TEST(Foo,\n     Bar) {', self.__body(400)),
+                     [(403, 'Small and focused functions are preferred: '
+                       'TEST(Foo, Bar) has 401 non-comment lines (error '
+                       'triggered by exceeding 400 lines).')])
+
+
+class TestHeavyCopies(CpplintTestCase):
+  def __lint(self, filename, source):
+    cpplint._cpplint_state.SetFilters('-,+runtime/heavy_copy')
+    linter = cpplint._IncrementalLinter(filename, [cpplint.CheckHeavyCopies])
+    return linter.Lint(source).Output()
+
+  def test_CopiedParameters(self):
+    output = self.__lint('art/runtime/foo.cc', u"""
+void Copy(std::vector<int> v) { v_ = v; }
+void Declared(std::string s);
+Foo::Foo(std::string a, int x) : a_{a} { x_ = x; }
+""")
+    self.assertIn('foo.cc:2:  Parameter v copies a std::vector', output)
+    self.assertIn('foo.cc:3:  Parameter s copies a std::string', output)
+    self.assertIn('foo.cc:4:  Parameter a copies a std::string', output)
+
+  def test_SinkParameters(self):
+    output = self.__lint('art/runtime/foo.cc', u"""
+explicit Foo(std::string name) : name_(std::move(name)) {}
+void Set(std::vector<int> v) { v_ = std::move(v); }
+Foo::Foo(std::string a,
+         std::string b)
+    : a_{a},
+      b_(std::move(b)) {
+  Use(std::move(a));
+}
+""")
+    self.assertNotIn('Parameter', output)
+
+  def test_DirectoriesStartAtTheRootOfTheTree(self):
+    source = u'void Copy(std::vector<int> v) { v_ = v; }\n'
+    self.assertIn('Parameter v', self.__lint('art/runtime/foo.cc', source))
+    self.assertIn('Parameter v',
+                  self.__lint('/src/art/compiler/foo.cc', source))
+    self.assertNotIn('Parameter v',
+                     self.__lint('art/tools/runtime/foo.cc', source))
+
+
+class TestLoggingCost(CpplintTestCase):
+  def __lint(self, filename, source):
+    cpplint._cpplint_state.SetFilters('-,+runtime/logging,+runtime/endl')
+    return cpplint._IncrementalLinter(filename).Lint(source).Output()
+
+  def test_UnguardedLogging(self):
+    output = self.__lint('art/runtime/foo.cc', u"""
+void F(ArtMethod* m) {
+  std::string name = PrettyMethod(m);
+  VLOG(jit) << name;
+  for (ArtMethod* n : methods) {
+    VLOG_STREAM(jit) << PrettyMethod(n)
+                     << StringPrintf("%d", 1);
+  }
+}
+""")
+    self.assertEqual(Errors(output),
+                     [(3, 'runtime/logging'), (6, 'runtime/logging')])
+    self.assertIn('foo.cc:3:  PrettyMethod is called for a VLOG message even '
+                  'when verbose logging is off;', output)
+    self.assertIn('foo.cc:6:  PrettyMethod and StringPrintf is called for a '
+                  'VLOG message even when verbose logging is off, on every '
+                  'iteration of the loop;', output)
+
+  def test_CheapOrGuardedLogging(self):
+    output = self.__lint('art/runtime/foo.cc', u"""
+void F(ArtMethod* m) {
+  if (VLOG_IS_ON(jit)) {
+    std::string guarded = PrettyMethod(m);
+    VLOG(jit) << guarded;
+    VLOG_STREAM(jit) << PrettyMethod(m);
+  }
+  if (VLOG_IS_ON(jit))
+    VLOG_STREAM(jit) << PrettyMethod(m);
+  std::string used = PrettyMethod(m);
+  VLOG(jit) << used;
+  Use(used);
+  std::string cheap = m->GetName();
+  VLOG(jit) << cheap;
+  LOG(INFO) << PrettyMethod(m);
+  os << PrettyMethod(m) << "\\n";
+  // VLOG_STREAM(jit) << PrettyMethod(m);
+}
+""")
+    self.assertEqual(Errors(output), [])
+
+  def test_Endl(self):
+    output = self.__lint('art/runtime/foo.cc', u"""
+void F(std::ostream& os) {
+  os << "done" << std::endl;
+  LOG(INFO) << "done" << std::endl;
+  while (true) {
+    os << std::endl;
+  }
+  // std::endl
+  os << "std::endl";
+}
+""")
+    self.assertEqual(Errors(output),
+                     [(3, 'runtime/endl'), (4, 'runtime/endl'),
+                      (6, 'runtime/endl')])
+    self.assertIn('foo.cc:3:  std::endl flushes the stream; use', output)
+    self.assertIn('foo.cc:6:  std::endl flushes the stream on every iteration '
+                  'of the loop;', output)
+
+  def test_OnlyInArtDirectories(self):
+    source = u"""void F(ArtMethod* m) {
+  VLOG_STREAM(jit) << PrettyMethod(m) << std::endl;
+}
+"""
+    self.assertEqual(Errors(self.__lint('art/compiler/foo.cc', source)),
+                     [(2, 'runtime/endl'), (2, 'runtime/logging')])
+    self.assertEqual(Errors(self.__lint('art/tools/foo.cc', source)), [])
+    self.assertEqual(Errors(self.__lint('art/runtime/foo_test.cc', source)),
+                     [])
+
+
+PLUGIN = """
+def CheckFoo(filename, clean_lines, linenum, error):
+  if 'foo' in clean_lines.elided[linenum]:
+    error(filename, linenum, 'plugin/foo', 3, 'No foo.')
+
+def CheckBar(filename, clean_lines, error):
+  error(filename, 0, 'plugin/bar', 1, 'Bar.')
+
+LINE_CHECKS = [(CheckFoo, ['plugin/foo'], ['foo'])]
+FILE_CHECKS = [(CheckBar, ['plugin/bar'], ['bar'])]
+"""
+
+
+class TestPlugins(CpplintTestCase):
+  def setUp(self):
+    CpplintTestCase.setUp(self)
+    WriteFile(self.directory, 'cpplint_test_plugin.py', PLUGIN)
+    self.cwd = os.getcwd()
+    self.categories = list(cpplint._ERROR_CATEGORIES)
+    os.chdir(self.directory)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    cpplint._LoadPlugins([])
+    cpplint._ERROR_CATEGORIES[:] = self.categories
+    sys.modules.pop('cpplint_test_plugin', None)
+    sys.modules.pop('cpplint_test_empty_plugin', None)
+    CpplintTestCase.tearDown(self)
+
+  def __lint(self, source):
+    linter = cpplint._IncrementalLinter('foo.cc')
+    return linter.Lint(source).Output()
+
+  def test_RunsChecksOnTriggers(self):
+    cpplint._LoadPlugins(['cpplint_test_plugin'])
+    output = self.__lint(u'// Copyright 2014\nint foo;\nint bar;\n')
+    self.assertIn('foo.cc:2:  No foo.  [plugin/foo] [3]', output)
+    self.assertIn('foo.cc:0:  Bar.  [plugin/bar] [1]', output)
+    output = self.__lint(u'// Copyright 2014\nint baz;\n')
+    self.assertNotIn('plugin/', output)
+
+  def test_RegistersCategories(self):
+    cpplint._LoadPlugins(['cpplint_test_plugin'])
+    self.assertIn('plugin/foo', cpplint._ERROR_CATEGORIES)
+    self.assertIn('plugin/bar', cpplint._ERROR_CATEGORIES)
+    output = self.__lint(
+        u'// Copyright 2014\nint foo;  // NOLINT(plugin/foo)\n')
+    self.assertNotIn('plugin/foo', output)
+    self.assertNotIn('Unknown NOLINT error category', output)
+
+  def test_LeavesThePythonPathAlone(self):
+    path = list(sys.path)
+    cpplint._LoadPlugins(['cpplint_test_plugin'])
+    self.assertEqual(sys.path, path)
+
+  def test_MissingChecks(self):
+    with open('cpplint_test_empty_plugin.py', 'w') as f:
+      f.write('CHECKS = []\n')
+    with self.assertRaises(ValueError):
+      cpplint._LoadPlugins(['cpplint_test_empty_plugin'])
+
+
+class TestRegexpBundle(CpplintTestCase):
+  @unittest.skipUnless(cpplint._sre, 'regexps are never bundled')
+  def test_CompilesLikeTheReModule(self):
+    self.assertTrue(cpplint._RegexpBundle.IsSupported())
+    bundle = cpplint._RegexpBundle(self.directory)
+    compiled = bundle.Compile(r'(\w+)::(?P<name>\w+)', 0)
+    self.assertEqual(compiled.match('art::Thread').groups(), ('art', 'Thread'))
+    self.assertEqual(compiled.groupindex, {'name': 2})
+    bundle.Store()
+    bundle = cpplint._RegexpBundle(self.directory)
+    self.assertIn((r'(\w+)::(?P<name>\w+)', 0), bundle._code)
+
+  def test_UnsupportedWithoutSreCode(self):
+    sre_compile = cpplint.sre_compile
+    cpplint.sre_compile = object()
+    try:
+      self.assertFalse(cpplint._RegexpBundle.IsSupported())
+    finally:
+      cpplint.sre_compile = sre_compile
+
+
+if __name__ == '__main__':
+  unittest.main()